@@ -0,0 +1,106 @@
+"""
+Encoding benchmark: bytes on the wire and encode CPU time of typical
+course payloads for JSON and MessagePack, uncompressed and with every
+supported content coding.
+
+Payloads are serialized from unsaved objects, no database is needed:
+
+    python benchmarks/encoding.py [--lessons 20] [--runs 200]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+WORDS = ('course lesson python django model view serializer request '
+         'response database query index cache queue worker task student '
+         'teacher video practice example chapter exercise project').split()
+
+
+def text(words):
+    return ' '.join(random.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def payloads(lessons_per_course):
+    """Returns course detail and first page of course list"""
+    from django.utils import timezone
+
+    from courses.models import Course, Lesson
+    from courses.serializers import CourseSyncSerializer, LessonSerializer
+
+    def course(pk):
+        data = dict(CourseSyncSerializer(Course(
+            pk=pk, name=text(4), description=text(300), owner_id=1,
+            updated_at=timezone.now(), lesson_count=lessons_per_course,
+            subscriber_count=random.randint(0, 5000),
+        )).data)
+        data['lessons'] = LessonSerializer([
+            Lesson(pk=pk * 1000 + index, name=text(5), description=text(80),
+                   video_url=f'https://youtube.com/watch?v={pk}{index}',
+                   course_id=pk, owner_id=1)
+            for index in range(lessons_per_course)
+        ], many=True).data
+        return data
+
+    return {
+        'detail': course(1),
+        'list': {'count': 120, 'next': 'http://localhost/courses/?page=2',
+                 'previous': None,
+                 'results': [course(pk) for pk in range(1, 6)]},
+    }
+
+
+def cpu_time(function, runs):
+    """Median process time of function call in milliseconds"""
+    samples = []
+    for _ in range(runs):
+        start = time.process_time()
+        function()
+        samples.append(time.process_time() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lessons', type=int, default=20,
+                        help='Lessons per course')
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+    from rest_framework.renderers import JSONRenderer
+
+    from config import compression
+    from config.encoding import MessagePackRenderer
+
+    random.seed(0)
+    renderers = {'json': JSONRenderer(), 'msgpack': MessagePackRenderer()}
+    print(f'{"payload":<8} {"format":<8} {"coding":<9} '
+          f'{"bytes":>8} {"encode ms":>10}')
+    for name, data in payloads(args.lessons).items():
+        for format_name, renderer in renderers.items():
+            body = renderer.render(data)
+            render_ms = cpu_time(lambda: renderer.render(data), args.runs)
+            print(f'{name:<8} {format_name:<8} {"identity":<9} '
+                  f'{len(body):>8} {render_ms:>10.3f}')
+            for encoding in compression.COMPRESSORS:
+                compressed = compression.compress(body, encoding)
+                compress_ms = cpu_time(
+                    lambda: compression.compress(body, encoding), args.runs
+                )
+                # Encode time includes rendering
+                print(f'{"":<8} {"":<8} {encoding:<9} '
+                      f'{len(compressed):>8} '
+                      f'{render_ms + compress_ms:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+First-request benchmark of `manage.py serve`: latency of the first and
+the second request to a fresh worker, with and without warmup.
+
+Every run starts a new server with one worker on a free port:
+
+    python benchmarks/first_request.py [--runs 5] [--path /openapi.json]
+"""
+import argparse
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    """Waits until worker accepts connections"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f'Server did not start on port {port}')
+
+
+def timed_get(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def run(interface, warmup, path):
+    port = free_port()
+    command = [sys.executable, 'manage.py', 'serve',
+               '--interface', interface, '--workers', '1',
+               '--bind', f'127.0.0.1:{port}']
+    if not warmup:
+        command.append('--no-warmup')
+    server = subprocess.Popen(command, cwd=BASE_DIR,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        # Worker may still run post_worker_init after socket is bound
+        time.sleep(0.5)
+        url = f'http://127.0.0.1:{port}{path}'
+        return timed_get(url), timed_get(url)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/openapi.json')
+    parser.add_argument('--interface', choices=('wsgi', 'asgi'),
+                        default='wsgi')
+    args = parser.parse_args()
+
+    for warmup in (False, True):
+        results = [run(args.interface, warmup, args.path)
+                   for _ in range(args.runs)]
+        first = statistics.median(result[0] for result in results) * 1000
+        second = statistics.median(result[1] for result in results) * 1000
+        print(f'{"warm" if warmup else "cold":>5}: '
+              f'first request {first:8.1f} ms, '
+              f'second request {second:8.1f} ms '
+              f'(median of {args.runs})')
+
+
+if __name__ == '__main__':
+    main()
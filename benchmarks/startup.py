@@ -0,0 +1,78 @@
+"""
+Startup benchmark: import time and time to first request of web process,
+import time of Celery worker boot.
+
+Every measurement runs in a fresh interpreter:
+
+    python benchmarks/startup.py [--runs 5]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Each snippet prints seconds spent in the measured phases as JSON
+SNIPPETS = {
+    'manage.py (django.setup)': '''
+import os, time, json
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+import django
+django.setup()
+setup = time.perf_counter()
+import config.urls
+print(json.dumps({'import': time.perf_counter() - start,
+                  'setup': setup - start}))
+''',
+    'web first request': '''
+import os, time, json
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+from django.test.utils import setup_test_environment
+application = get_wsgi_application()
+setup_test_environment()
+ready = time.perf_counter()
+response = Client().get('/openapi.json')
+assert response.status_code == 200, response.status_code
+print(json.dumps({'import': ready - start,
+                  'first_request': time.perf_counter() - start}))
+''',
+    'celery worker boot': '''
+import time, json
+start = time.perf_counter()
+from config.celery import app
+app.loader.import_default_modules()
+app.finalize()
+print(json.dumps({'import': time.perf_counter() - start}))
+''',
+}
+
+
+def run(snippet):
+    output = subprocess.run([sys.executable, '-c', snippet], cwd=BASE_DIR,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"process":<28}{"phase":<16}{"median, ms":>12}{"min, ms":>10}')
+    for name, snippet in SNIPPETS.items():
+        results = [run(snippet) for _ in range(args.runs)]
+        for phase in results[0]:
+            values = [result[phase] * 1000 for result in results]
+            print(f'{name:<28}{phase:<16}'
+                  f'{statistics.median(values):>12.1f}{min(values):>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -13,4 +13,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up
+from courses import stream  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # Long-lived event streams are served without Django request handling
+    if scope['type'] == 'http' and scope['path'] == '/events/':
+        return await stream.application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,205 @@
+"""
+Batch endpoint: several API requests in one round trip.
+
+    POST /batch/
+    {"requests": [{"method": "GET", "path": "/courses/"},
+                  {"method": "POST", "path": "/lesson/create/",
+                   "body": {...}}]}
+
+Sub-requests are authenticated once (as the batch request) and dispatched
+directly to API views of the URLconf, skipping middleware, so other views
+(admin, schema UI) cannot be batched. An exception of a sub-request becomes
+its 500 response, other sub-requests still run. Consecutive safe
+requests run concurrently, unsafe requests run alone in the given order.
+A successful write pins the user to the primary at once, so the following
+sub-requests read their own writes.
+"""
+import asyncio
+import functools
+import io
+import json
+import logging
+from urllib.parse import urlsplit
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections, transaction
+from django.urls import Resolver404, resolve
+from rest_framework import serializers, status
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from config import db_router
+
+logger = logging.getLogger(__name__)
+
+# Headers of sub-responses returned to client
+RESPONSE_HEADERS = ('Content-Type', 'Location', 'Retry-After', 'ETag')
+
+
+class SubRequestSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(
+        choices=('GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE'),
+        default='GET',
+    )
+    path = serializers.RegexField(r'^/', max_length=2000)
+    body = serializers.JSONField(required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = SubRequestSerializer(many=True, allow_empty=False)
+
+    def validate_requests(self, value):
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(
+                f'At most {settings.BATCH_MAX_REQUESTS} requests are allowed'
+            )
+        return value
+
+
+class BatchAPIView(APIView):
+    """
+    Executes list of API requests, returns list of their responses
+    """
+    serializer_class = BatchSerializer
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['requests']
+
+        responses = self.execute(request, items)
+
+        # Writes of sub-requests have pinned the user already
+        request._request.replica_pin = False
+        return Response({'responses': responses})
+
+    def execute(self, request, items):
+        """Runs groups of consecutive safe requests concurrently"""
+        # Other connections cannot see rows of an open transaction
+        concurrent = not transaction.get_connection().in_atomic_block
+        responses = []
+        group = []
+        for item in items:
+            call = functools.partial(self.dispatch_item, request, item)
+            if item['method'] in SAFE_METHODS and concurrent:
+                group.append(call)
+                continue
+            responses.extend(self.run_concurrently(group))
+            group = []
+            response = call()
+            responses.append(response)
+            if item['method'] not in SAFE_METHODS and \
+                    response['status'] < 400 and \
+                    request.user.is_authenticated:
+                # Later sub-requests read from the primary
+                db_router.pin_user(request.user)
+        responses.extend(self.run_concurrently(group))
+        return responses
+
+    @staticmethod
+    def run_concurrently(calls):
+        if len(calls) < 2:
+            return [call() for call in calls]
+
+        async def gather():
+            semaphore = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+
+            async def run(call):
+                async with semaphore:
+                    return await sync_to_async(
+                        in_own_connection(call), thread_sensitive=False
+                    )()
+            return await asyncio.gather(*(run(call) for call in calls))
+
+        # Under ASGI coroutines run in the server event loop
+        return async_to_sync(gather)()
+
+    def dispatch_item(self, request, item):
+        """Calls view of sub-request, returns status, headers and body"""
+        sub_request = self.build_request(request, item)
+        try:
+            match = resolve(sub_request.path_info)
+        except Resolver404:
+            return {'status': status.HTTP_404_NOT_FOUND, 'headers': {},
+                    'body': {'detail': 'Not found.'}}
+        view_class = getattr(match.func, 'cls', None)
+        if not (isinstance(view_class, type) and
+                issubclass(view_class, APIView)):
+            # Other views need middleware (sessions, CSRF, messages)
+            return {'status': status.HTTP_400_BAD_REQUEST, 'headers': {},
+                    'body': {'detail': 'Only API requests can be batched.'}}
+        if view_class is type(self):
+            return {'status': status.HTTP_400_BAD_REQUEST, 'headers': {},
+                    'body': {'detail': 'Batches cannot be nested.'}}
+
+        try:
+            response = match.func(sub_request, *match.args, **match.kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+        except Exception:
+            # DRF converts only API exceptions to responses
+            logger.error('Sub-request %s %s failed', item['method'],
+                         sub_request.path_info, exc_info=True)
+            return {'status': status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    'headers': {},
+                    'body': {'detail': 'Internal server error.'}}
+        return {
+            'status': response.status_code,
+            'headers': {name: response[name] for name in RESPONSE_HEADERS
+                        if response.has_header(name)},
+            'body': self.parse_body(response),
+        }
+
+    @staticmethod
+    def build_request(request, item):
+        """Creates request of batch user without repeating authentication"""
+        url = urlsplit(item['path'])
+        body = b''
+        if 'body' in item:
+            body = json.dumps(item['body']).encode()
+        environ = {key: value for key, value in request.META.items()
+                   if not key.startswith('wsgi.')}
+        environ.update({
+            'REQUEST_METHOD': item['method'],
+            'SCRIPT_NAME': '',
+            'PATH_INFO': url.path,
+            'QUERY_STRING': url.query,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(body)),
+            # Batch response is encoded as a whole
+            'HTTP_ACCEPT': 'application/json',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.url_scheme': request.scheme,
+        })
+        sub_request = WSGIRequest(environ)
+        # DRF uses these instead of authentication classes
+        sub_request._force_auth_user = request.user
+        sub_request._force_auth_token = request.auth
+        sub_request.user = request.user
+        return sub_request
+
+    @staticmethod
+    def parse_body(response):
+        if not response.content:
+            return None
+        if response.get('Content-Type', '').startswith('application/json'):
+            return json.loads(response.content)
+        return response.content.decode(errors='replace')
+
+
+def in_own_connection(call):
+    """
+    Wraps call executed in a worker thread, so its database connections
+    are handled as in a regular request
+    """
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
@@ -0,0 +1,342 @@
+"""
+Two-tier cache backend: bounded per-process LRU (L1) in front of shared
+Redis (L2).
+
+Every write and deletion is broadcast over Redis pub/sub, so the other
+processes drop their stale L1 copies of the key. Helpers at the end keep
+entries computed from the database under versioned keys with any backend.
+"""
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import redis
+from django.core.cache import cache
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# INCRBY of existing keys only, nil if key is missing
+INCR_EXISTING = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+return redis.call('INCRBY', KEYS[1], ARGV[1])
+"""
+
+
+class LRUCache:
+    """
+    Bounded in-process cache with per-entry expiration time
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.evictions = 0
+        # key -> (expires_at, value), least recently used first
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Returns (found, value) tuple"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, entry[1]
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._data[key] = (time.monotonic() + timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TwoTierCache(BaseCache):
+    """
+    Django cache backend with in-process L1 and Redis L2.
+
+    OPTIONS:
+        L1_MAX_ENTRIES - size of per-process LRU
+        L1_TIMEOUT - max time (seconds) entry may live in L1
+        CHANNEL - pub/sub channel for invalidations
+        CLIENT_CLASS - Redis client class (e.g. fakeredis.FakeRedis in tests)
+    """
+
+    def __init__(self, server, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        client_class = import_string(options.get('CLIENT_CLASS', 'redis.Redis'))
+        self._client = client_class.from_url(server)
+        self._l1 = LRUCache(options.get('L1_MAX_ENTRIES', 1000))
+        self._l1_timeout = options.get('L1_TIMEOUT', 30)
+        self._channel = options.get('CHANNEL', 'cache-invalidation')
+        # Identifies messages sent by this process
+        self._origin = uuid.uuid4().hex
+        self._listener = None
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+        self._stats = {'l1_hits': 0, 'l1_misses': 0,
+                       'l2_hits': 0, 'l2_misses': 0}
+        self._stats_lock = threading.Lock()
+        # Script object loads the script once, then calls it by SHA
+        self._incr_existing = self._client.register_script(INCR_EXISTING)
+
+    # Serialization compatible with Redis INCR for integers
+
+    @staticmethod
+    def _dumps(value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return str(value).encode()
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _loads(data):
+        try:
+            return int(data)
+        except ValueError:
+            return pickle.loads(data)
+
+    # Invalidation
+
+    def _ensure_listener(self):
+        """Starts pub/sub listener thread (again after fork)"""
+        if self._listener_pid == os.getpid() and self._listener.is_alive():
+            return
+        with self._listener_lock:
+            if self._listener_pid == os.getpid() and self._listener.is_alive():
+                return
+            # Entries inherited from parent process missed its invalidations
+            self._l1.clear()
+            self._listener = threading.Thread(target=self._listen,
+                                              name='cache-invalidation',
+                                              daemon=True)
+            self._listener_pid = os.getpid()
+            self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                for message in pubsub.listen():
+                    origin, _, key = message['data'].decode().partition(':')
+                    if origin == self._origin:
+                        continue
+                    if key == '*':
+                        self._l1.clear()
+                    else:
+                        self._l1.delete(key)
+            except redis.RedisError:
+                # Invalidations may have been lost while disconnected
+                self._l1.clear()
+                time.sleep(1)
+
+    def _invalidate(self, key):
+        """Asks other processes to drop the key ('*' - everything)"""
+        self._client.publish(self._channel, f'{self._origin}:{key}')
+
+    @staticmethod
+    def _expiry(timeout):
+        """Converts backend timeout to Redis EX argument"""
+        if timeout is None:
+            return None
+        return max(int(timeout), 1)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _l1_set(self, key, data, timeout):
+        if timeout is None or timeout > self._l1_timeout:
+            timeout = self._l1_timeout
+        self._l1.set(key, data, timeout)
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._ensure_listener()
+        found, data = self._l1.get(key)
+        if found:
+            self._count('l1_hits')
+            return self._loads(data)
+        self._count('l1_misses')
+
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.ttl(key)
+            data, ttl = pipe.execute()
+        except redis.RedisError:
+            logger.warning('Cache L2 is unavailable', exc_info=True)
+            data = None
+        if data is None:
+            self._count('l2_misses')
+            return default
+        self._count('l2_hits')
+        # Do not keep entry in L1 longer than it lives in L2
+        self._l1_set(key, data, ttl if ttl > 0 else None)
+        return self._loads(data)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._ensure_listener()
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is not None and timeout <= 0:
+            self._delete(key)
+            return
+        data = self._dumps(value)
+        try:
+            self._client.set(key, data, ex=self._expiry(timeout))
+            self._invalidate(key)
+        except redis.RedisError:
+            logger.warning('Cache L2 is unavailable', exc_info=True)
+        self._l1_set(key, data, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._ensure_listener()
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is not None and timeout <= 0:
+            return False
+        data = self._dumps(value)
+        try:
+            added = self._client.set(key, data, nx=True,
+                                     ex=self._expiry(timeout))
+        except redis.RedisError:
+            logger.warning('Cache L2 is unavailable', exc_info=True)
+            return False
+        if added:
+            self._l1_set(key, data, timeout)
+        return bool(added)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        timeout = self.get_backend_timeout(timeout)
+        try:
+            if timeout is None:
+                return bool(self._client.persist(key))
+            return bool(self._client.expire(key, int(timeout)))
+        except redis.RedisError:
+            logger.warning('Cache L2 is unavailable', exc_info=True)
+            return False
+
+    def _delete(self, key):
+        self._l1.delete(key)
+        try:
+            deleted = self._client.delete(key)
+            self._invalidate(key)
+        except redis.RedisError:
+            logger.warning('Cache L2 is unavailable', exc_info=True)
+            return False
+        return bool(deleted)
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._ensure_listener()
+        return self._delete(key)
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        found, _ = self._l1.get(key)
+        if found:
+            return True
+        try:
+            return bool(self._client.exists(key))
+        except redis.RedisError:
+            logger.warning('Cache L2 is unavailable', exc_info=True)
+            return False
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._ensure_listener()
+        # Counters are changed atomically in Redis only
+        self._l1.delete(key)
+        try:
+            # Checked and changed by one command, key can not expire between
+            value = self._incr_existing(keys=[key], args=[delta])
+        except redis.RedisError:
+            logger.warning('Cache L2 is unavailable', exc_info=True)
+            # Counter can not be changed, as if key was missing
+            value = None
+        if value is None:
+            raise ValueError(f"Key '{key}' not found.")
+        self._invalidate(key)
+        return value
+
+    def clear(self):
+        self._l1.clear()
+        try:
+            self._client.flushdb()
+            self._invalidate('*')
+        except redis.RedisError:
+            logger.warning('Cache L2 is unavailable', exc_info=True)
+
+    def close(self, **kwargs):
+        # Connection pool and listener live as long as the process
+        pass
+
+    def stats(self):
+        """Returns hit ratio of each tier and number of L1 evictions"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        l1_total = stats['l1_hits'] + stats['l1_misses']
+        l2_total = stats['l2_hits'] + stats['l2_misses']
+        stats['l1_hit_ratio'] = stats['l1_hits'] / l1_total if l1_total else 0.0
+        stats['l2_hit_ratio'] = stats['l2_hits'] / l2_total if l2_total else 0.0
+        stats['l1_evictions'] = self._l1.evictions
+        stats['l1_size'] = len(self._l1)
+        return stats
+
+
+# Versioned entries
+#
+# Entries computed from the database are stored under keys with a random
+# version. Writers drop the version after commit, so an entry computed from
+# rows read before the write (concurrent get-then-set) is never read again.
+
+def version_key(key):
+    return f'{key}:version'
+
+
+def versioned_keys(keys, timeout):
+    """Returns {key: key of current version of entry}"""
+    versions = cache.get_many([version_key(key) for key in keys])
+    result = {}
+    for key in keys:
+        version = versions.get(version_key(key))
+        if version is None:
+            version = uuid.uuid4().hex
+            # Another process may have created the version meanwhile
+            if not cache.add(version_key(key), version, timeout):
+                version = cache.get(version_key(key), version)
+        result[key] = f'{key}:{version}'
+    return result
+
+
+def delete_versions(keys):
+    """Makes current entries of keys unreachable"""
+    cache.delete_many([version_key(key) for key in keys])
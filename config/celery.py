@@ -1,6 +1,11 @@
+import logging
 import os
+import time
 
-from celery import Celery
+from celery import Celery, signals
+from django.conf import settings
+
+from config import metrics
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
@@ -14,4 +19,81 @@ app = Celery('config')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Load task modules from all registered Django apps.
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+# Task telemetry, reported to the metrics endpoint of web processes
+slow_task_logger = logging.getLogger('celery.slow_tasks')
+
+TASKS_PUBLISHED = metrics.Counter(
+    'celery_tasks_published_total', 'Tasks sent to the broker',
+    ('task', 'queue'),
+)
+TASK_QUEUE_LAG = metrics.Histogram(
+    'celery_task_queue_lag_seconds',
+    'Time between publishing of task and start of execution',
+    ('task', 'queue'),
+)
+TASK_RUNTIME = metrics.Histogram(
+    'celery_task_runtime_seconds', 'Execution time of task', ('task',),
+)
+TASK_OUTCOMES = metrics.Counter(
+    'celery_task_outcomes_total',
+    'Finished executions of task by state (SUCCESS, FAILURE, RETRY, ...)',
+    ('task', 'state'),
+)
+QUEUE_DEPTH = metrics.Gauge(
+    'celery_queue_depth', 'Messages waiting in the queue', ('queue',),
+)
+
+# Start time of tasks executed by this process: task id -> monotonic time
+_started = {}
+
+
+@signals.before_task_publish.connect
+def task_published(sender=None, headers=None, routing_key=None, **kwargs):
+    # Wall clock, as the task is started by another host
+    headers['enqueued_at'] = time.time()
+    TASKS_PUBLISHED.inc(task=sender, queue=routing_key)
+
+
+@signals.task_prerun.connect
+def task_started(task_id=None, task=None, **kwargs):
+    _started[task_id] = time.monotonic()
+    enqueued_at = getattr(task.request, 'enqueued_at', None)
+    if enqueued_at is None:
+        # Eager tasks are not published
+        return
+    queue = (task.request.delivery_info or {}).get('routing_key')
+    TASK_QUEUE_LAG.observe(max(time.time() - enqueued_at, 0),
+                           task=task.name, queue=queue)
+
+
+@signals.task_postrun.connect
+def task_finished(task_id=None, task=None, args=None, kwargs=None,
+                  state=None, **extra):
+    TASK_OUTCOMES.inc(task=task.name, state=state)
+    started = _started.pop(task_id, None)
+    if started is None:
+        return
+    runtime = time.monotonic() - started
+    TASK_RUNTIME.observe(runtime, task=task.name)
+    if runtime >= settings.SLOW_TASK_SECONDS:
+        slow_task_logger.warning(
+            'Task %s[%s] took %.2f s, args=%.1000r kwargs=%.1000r',
+            task.name, task_id, runtime, args, kwargs,
+        )
+
+
+def collect_queue_depth():
+    """Counts messages of every queue (all priorities) in the broker"""
+    samples = []
+    with app.connection_for_read() as connection:
+        channel = connection.default_channel
+        for queue in app.conf.task_queues:
+            _, depth, _ = channel.queue_declare(queue.name, passive=True)
+            samples.append((QUEUE_DEPTH, {'queue': queue.name}, depth))
+    return samples
+
+
+metrics.COLLECTORS.append(collect_queue_depth)
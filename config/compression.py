@@ -0,0 +1,206 @@
+"""
+Response compression negotiated by Accept-Encoding (zstd, br, gzip).
+
+Bodies smaller than COMPRESSION_MIN_SIZE are sent as is. Streaming
+responses are compressed chunk by chunk as they are sent, and so are
+bodies larger than COMPRESSION_STREAMING_SIZE: they are turned into
+streaming responses, so the compressed copy is never held in memory whole
+and the client receives first bytes earlier.
+"""
+import zlib
+
+import brotli
+import zstandard
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+# Levels for dynamic content: most of the ratio at a fraction of max CPU
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+
+class GzipCompressor:
+    def __init__(self):
+        self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self):
+        self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL) \
+            .compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+COMPRESSORS = {
+    'zstd': ZstdCompressor,
+    'br': BrotliCompressor,
+    'gzip': GzipCompressor,
+}
+
+
+def accepted_encodings(header):
+    """Returns {content coding: quality} of Accept-Encoding header"""
+    accepted = {}
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            accepted[coding.lower()] = quality
+    return accepted
+
+
+def choose_encoding(header):
+    """
+    Returns encoding with the highest quality for client, preferring
+    encodings listed first in COMPRESSION_ENCODINGS. None - no compression.
+    """
+    accepted = accepted_encodings(header)
+    best, best_quality = None, 0.0
+    for coding in settings.COMPRESSION_ENCODINGS:
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(data, encoding):
+    compressor = COMPRESSORS[encoding]()
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_chunks(chunks, encoding, flush=True):
+    """
+    Compresses iterable. Flushing after every chunk sends it to client
+    at once, at some cost of ratio.
+    """
+    compressor = COMPRESSORS[encoding]()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if flush:
+            data += compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def compress_chunks_async(chunks, encoding):
+    compressor = COMPRESSORS[encoding]()
+    async for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def split(content, size):
+    for start in range(0, len(content), size):
+        yield content[start:start + size]
+
+
+def streaming_copy(response, chunks):
+    """Returns streaming response with status and headers of response"""
+    streaming = StreamingHttpResponse(chunks, status=response.status_code,
+                                      reason=response.reason_phrase)
+    for header, value in response.items():
+        streaming.headers[header] = value
+    streaming.cookies = response.cookies
+    return streaming
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with the best encoding accepted by client.
+    Goes before middleware changing response content.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if not response.streaming and \
+                len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        if response.has_header('Content-Encoding') or \
+                'no-transform' in response.get('Cache-Control', ''):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = compress_chunks_async(
+                    response.streaming_content, encoding
+                )
+            else:
+                response.streaming_content = compress_chunks(
+                    response.streaming_content, encoding
+                )
+            # Compressed size is not known before the end of stream
+            del response.headers['Content-Length']
+        elif len(response.content) >= settings.COMPRESSION_STREAMING_SIZE:
+            content = response.content
+            response = streaming_copy(response, compress_chunks(
+                split(content, settings.COMPRESSION_CHUNK_SIZE), encoding,
+                flush=False
+            ))
+            del response.headers['Content-Length']
+        else:
+            content = compress(response.content, encoding)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response.headers['Content-Length'] = str(len(content))
+
+        # Strong ETag of uncompressed body becomes weak (RFC 9110 8.8.1)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,176 @@
+"""
+Routing of read-only API traffic to PostgreSQL read replicas.
+
+Safe-method requests of views using :class:`ReplicaReadMixin` read from one
+of ``settings.REPLICA_DATABASES``; everything else goes to ``default``.
+"""
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+# Database alias used for reads in the current request (None - primary)
+_read_alias = contextvars.ContextVar('read_alias', default=None)
+
+# Last measured lag of each replica: alias -> (checked_at, lag in seconds)
+_replica_lag = {}
+
+LAG_QUERY = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+def replica_lag(alias):
+    """
+    Returns replication lag of replica in seconds or None if it is
+    unreachable. Result is measured at most once per check interval.
+    """
+    checked_at, lag = _replica_lag.get(alias, (0, None))
+    if time.monotonic() - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return lag
+
+    connection = connections[alias]
+    try:
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(LAG_QUERY)
+                lag = float(cursor.fetchone()[0] or 0)
+        else:
+            # Local databases (tests) never lag behind
+            lag = 0.0
+    except DatabaseError:
+        lag = None
+    _replica_lag[alias] = (time.monotonic(), lag)
+    return lag
+
+
+def choose_replica():
+    """
+    Returns alias of random replica that is not lagging behind the primary
+    more than allowed, or None if reads must go to the primary.
+    """
+    healthy = []
+    for alias in settings.REPLICA_DATABASES:
+        lag = replica_lag(alias)
+        if lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS:
+            healthy.append(alias)
+    if healthy:
+        return random.choice(healthy)
+    return None
+
+
+def _pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_user(user):
+    """Sends reads of user to the primary for a while after a write"""
+    cache.set(_pin_key(user.pk), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(user):
+    """Checks whether user has written recently"""
+    if not user.is_authenticated:
+        return False
+    return cache.get(_pin_key(user.pk), False)
+
+
+def current_read_alias():
+    """Database of reads in current context"""
+    return _read_alias.get() or 'default'
+
+
+@contextmanager
+def replica_reads():
+    """Routes all reads inside the block to a healthy replica"""
+    token = _read_alias.set(choose_replica())
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Routes all reads inside the block to the primary, e.g. to build cache
+    entries that must not be older than the last commit
+    """
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to replica selected for current request, writes and
+    migrations - to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return current_read_alias()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas mirror the primary, so all objects are related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.REPLICA_DATABASES
+
+
+class ReplicaReadMixin:
+    """
+    DRF view mixin that serves safe-method requests from a replica, unless
+    user has written recently (read-your-writes).
+    """
+
+    def initial(self, request, *args, **kwargs):
+        # User is authenticated by DRF inside initial()
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not is_pinned(request.user):
+            self._read_alias_token = _read_alias.set(choose_replica())
+
+    def dispatch(self, request, *args, **kwargs):
+        # Errors other than API exceptions skip finalize_response()
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            token = getattr(self, '_read_alias_token', None)
+            if token is not None:
+                _read_alias.reset(token)
+                self._read_alias_token = None
+
+
+class ReplicaPinMiddleware:
+    """
+    Pins user to the primary after every successful write request.
+    DRF copies authenticated user to the underlying Django request.
+    Views can decide by setting `replica_pin` of request (batch endpoint).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        pin = getattr(request, 'replica_pin', None)
+        if pin is None:
+            pin = (request.method not in SAFE_METHODS
+                   and response.status_code < 400)
+        if pin and user is not None and user.is_authenticated:
+            pin_user(user)
+        return response
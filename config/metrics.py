@@ -0,0 +1,173 @@
+"""
+Metrics shared by web and worker processes.
+
+Values are accumulated in Redis hashes (one per metric), so every process
+of every container reports to the same place, and rendered in Prometheus
+text format by the `metrics` view. Redis errors never fail the caller.
+"""
+import logging
+import math
+
+import redis
+
+from config.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'metrics:'
+# Separates labels and bucket in fields of histogram hashes
+SEP = '\x1f'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, 300.0)
+
+REGISTRY = []
+# Functions returning [(metric, labels, value)] computed on scrape
+COLLECTORS = []
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def _series(name, labels):
+    return f'{name}{{{labels}}}' if labels else name
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.key = PREFIX + name
+        REGISTRY.append(self)
+
+    def _labels(self, labels):
+        """Serializes label values as in exposition format"""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} requires labels {self.labelnames}')
+        return ','.join(f'{name}="{_escape(labels[name])}"'
+                        for name in self.labelnames)
+
+    def _execute(self, fill):
+        """Runs commands added by fill(pipeline) in one round trip"""
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            fill(pipe)
+            pipe.execute()
+        except redis.RedisError:
+            logger.debug('Metric %s is not recorded', self.name,
+                         exc_info=True)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}',
+                f'# TYPE {self.name} {self.type}']
+
+    def render(self, values):
+        """Returns lines of exposition format from hash fields"""
+        lines = self.header()
+        for labels, value in sorted(values.items()):
+            lines.append(f'{_series(self.name, labels)} '
+                         f'{_format_value(float(value))}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        field = self._labels(labels)
+        self._execute(lambda pipe: pipe.hincrbyfloat(self.key, field, amount))
+
+
+class Gauge(Metric):
+    """Gauge computed by a collector on every scrape"""
+    type = 'gauge'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        bucket = next(le for le in self.buckets if value <= le)
+
+        def fill(pipe):
+            # Buckets are stored non-cumulative, summed on render
+            pipe.hincrby(self.key, f'{labels}{SEP}{_format_value(bucket)}')
+            pipe.hincrbyfloat(self.key, f'{labels}{SEP}sum', value)
+            pipe.hincrby(self.key, f'{labels}{SEP}count')
+        self._execute(fill)
+
+    def render(self, values):
+        series = {}
+        for field, value in values.items():
+            labels, _, part = field.partition(SEP)
+            series.setdefault(labels, {})[part] = float(value)
+
+        lines = self.header()
+        for labels, parts in sorted(series.items()):
+            prefix = f'{labels},' if labels else ''
+            total = 0
+            for le in self.buckets:
+                total += parts.get(_format_value(le), 0)
+                lines.append(f'{self.name}_bucket{{{prefix}le="'
+                             f'{_format_value(le)}"}} {_format_value(total)}')
+            lines.append(f'{_series(self.name + "_sum", labels)} '
+                         f'{_format_value(parts.get("sum", 0))}')
+            lines.append(f'{_series(self.name + "_count", labels)} '
+                         f'{_format_value(parts.get("count", 0))}')
+        return lines
+
+
+def render():
+    """
+    Returns all metrics in Prometheus text format. If Redis is unavailable,
+    only values computed by collectors in this process are returned.
+    """
+    stored = {metric: {} for metric in REGISTRY}
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for metric in REGISTRY:
+            pipe.hgetall(metric.key)
+        for metric, values in zip(REGISTRY, pipe.execute()):
+            stored[metric] = {field.decode(): value.decode()
+                              for field, value in values.items()}
+    except redis.RedisError:
+        logger.warning('Recorded metrics are unavailable', exc_info=True)
+
+    for collect in COLLECTORS:
+        try:
+            samples = collect()
+        except Exception:
+            logger.warning('Metrics collector %s failed', collect.__name__,
+                           exc_info=True)
+            continue
+        for metric, labels, value in samples:
+            stored[metric][metric._labels(labels)] = value
+
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(stored[metric]))
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Deletes recorded values (tests)"""
+    get_redis().delete(*(metric.key for metric in REGISTRY))
@@ -0,0 +1,253 @@
+"""
+Request profiling and slow-request log.
+
+Every request records its SQL queries and external calls (see
+`external_call`). Requests slower than SLOW_REQUEST_SECONDS are written
+to the slow-request log (logger `requests.slow`) with SQL fingerprints.
+
+A request is profiled when it carries a token made by
+`manage.py profile_token` (`X-Profile` header or `_profile` query
+parameter) or is sampled with PROFILE_SAMPLE_RATE. The stack of its thread
+is sampled every PROFILE_INTERVAL seconds, and PROFILES_ROOT receives
+`<id>.json` (call tree, queries, external calls) and `<id>.folded`
+(stacks in folded format of flame graph tools).
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.utils import timezone
+
+slow_logger = logging.getLogger('requests.slow')
+
+SALT = 'config.profiling'
+
+_record = contextvars.ContextVar('profiling_record', default=None)
+
+
+def make_token():
+    """Returns token enabling profiling for PROFILE_TOKEN_MAX_AGE"""
+    return signing.TimestampSigner(salt=SALT).sign('profile')
+
+
+def check_token(token):
+    try:
+        return signing.TimestampSigner(salt=SALT).unsign(
+            token, max_age=settings.PROFILE_TOKEN_MAX_AGE
+        ) == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+def fingerprint(sql):
+    """Returns SQL with values and lists of values replaced"""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'(?:\?|%s)(?:\s*,\s*(?:\?|%s))+', '...', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+class Record:
+    """Queries and external calls of a request"""
+
+    def __init__(self):
+        self.queries = []
+        self.external = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((context['connection'].alias, sql,
+                                 time.perf_counter() - start))
+
+    def fingerprints(self):
+        """Returns [(fingerprint, count, seconds)], slowest first"""
+        stats = {}
+        for _, sql, seconds in self.queries:
+            count, total = stats.get(fingerprint(sql), (0, 0.0))
+            stats[fingerprint(sql)] = count + 1, total + seconds
+        return sorted(((sql, count, total)
+                       for sql, (count, total) in stats.items()),
+                      key=lambda item: -item[2])
+
+
+@contextlib.contextmanager
+def external_call(name):
+    """Records duration of a call to external service in current request"""
+    record = _record.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if record is not None:
+            record.external.append((name, time.perf_counter() - start))
+
+
+def frame_name(frame):
+    code = frame.f_code
+    path = code.co_filename
+    if path.startswith(str(settings.BASE_DIR)):
+        path = os.path.relpath(path, settings.BASE_DIR)
+    else:
+        path = os.path.basename(path)
+    return f'{code.co_name} ({path}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """Samples stack of a thread below root frame from another thread"""
+
+    def __init__(self, thread_id, root, interval):
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name='stack-sampler')
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame is not self.root:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+def call_tree(stacks):
+    """Builds tree of calls with numbers of samples from folded stacks"""
+    root = {'name': 'request', 'samples': 0, 'children': {}}
+    for stack, count in stacks.items():
+        node = root
+        node['samples'] += count
+        for name in stack.split(';'):
+            node = node['children'].setdefault(
+                name, {'name': name, 'samples': 0, 'children': {}}
+            )
+            node['samples'] += count
+
+    def convert(node):
+        children = sorted(node['children'].values(),
+                          key=lambda child: -child['samples'])
+        return {**node, 'children': [convert(child) for child in children]}
+    return convert(root)
+
+
+def write_profile(request, response, duration, record, sampler):
+    """Writes profile files, removes the oldest ones over the limit"""
+    # Ids sort in order of creation
+    profile_id = f'{timezone.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}'
+    directory = settings.PROFILES_ROOT
+    os.makedirs(directory, exist_ok=True)
+
+    with open(os.path.join(directory, f'{profile_id}.folded'), 'w') as file:
+        for stack, count in sampler.stacks.most_common():
+            file.write(f'{stack} {count}\n')
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w') as file:
+        json.dump({
+            'id': profile_id,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'interval_ms': sampler.interval * 1000,
+            'queries': [{'alias': alias, 'sql': sql,
+                         'ms': round(seconds * 1000, 3)}
+                        for alias, sql, seconds in record.queries],
+            'external': [{'name': name, 'ms': round(seconds * 1000, 3)}
+                         for name, seconds in record.external],
+            'call_tree': call_tree(sampler.stacks),
+        }, file, indent=1)
+
+    profiles = sorted(name for name in os.listdir(directory)
+                      if name.endswith('.json'))
+    for name in profiles[:-settings.PROFILE_MAX_FILES]:
+        for suffix in ('.json', '.folded'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(directory, name[:-5] + suffix))
+    return profile_id
+
+
+def log_slow_request(request, response, duration, record):
+    slow_logger.warning(json.dumps({
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'queries': len(record.queries),
+        'sql_ms': round(sum(query[2] for query in record.queries) * 1000,
+                        3),
+        'fingerprints': [{'sql': sql, 'count': count,
+                          'ms': round(seconds * 1000, 3)}
+                         for sql, count, seconds in record.fingerprints()],
+        'external': [{'name': name, 'ms': round(seconds * 1000, 3)}
+                     for name, seconds in record.external],
+    }))
+
+
+class ProfilingMiddleware:
+    """
+    Records queries of every request, profiles requests with token or
+    sampled. Goes first to include the rest of middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        token = request.headers.get('X-Profile') or \
+            request.GET.get('_profile')
+        if token:
+            return check_token(token)
+        return random.random() < settings.PROFILE_SAMPLE_RATE
+
+    def __call__(self, request):
+        profile = self.should_profile(request)
+        record = Record()
+        context = _record.set(record)
+        start = time.perf_counter()
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(record))
+                if profile:
+                    sampler = stack.enter_context(StackSampler(
+                        threading.get_ident(), sys._getframe(),
+                        settings.PROFILE_INTERVAL
+                    ))
+                response = self.get_response(request)
+        finally:
+            _record.reset(context)
+        duration = time.perf_counter() - start
+
+        if profile:
+            response['X-Profile-Id'] = write_profile(request, response,
+                                                     duration, record,
+                                                     sampler)
+        if duration >= settings.SLOW_REQUEST_SECONDS:
+            log_slow_request(request, response, duration, record)
+        return response
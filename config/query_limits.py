@@ -0,0 +1,140 @@
+"""
+Statement timeouts and query budgets of API views.
+
+Views with :class:`QueryLimitMixin` run their handler in a transaction on
+every database the request reads from, with `SET LOCAL statement_timeout`
+on PostgreSQL, so a pathological query is cancelled by the server instead
+of holding the worker and the connection. Cancelled requests are answered
+with 503 and Retry-After and counted in metrics.
+
+A query budget limits the number of queries of the handler: exceeding it
+raises :class:`QueryBudgetExceeded` or is logged (QUERY_BUDGET_ACTION).
+"""
+import contextlib
+import logging
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, \
+    transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from config import metrics
+from config.db_router import current_read_alias
+
+logger = logging.getLogger(__name__)
+
+# SQLSTATE of statements cancelled by statement_timeout
+QUERY_CANCELED = '57014'
+
+STATEMENT_TIMEOUTS = metrics.Counter(
+    'db_statement_timeouts_total',
+    'Requests cancelled by statement timeout', ('view', 'action'),
+)
+
+
+class StatementTimeout(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Request took too long, try again later.'
+    default_code = 'statement_timeout'
+
+    def __init__(self, detail=None, code=None, wait=None):
+        super().__init__(detail, code)
+        # Sent as Retry-After by DRF exception handler
+        self.wait = wait
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def is_statement_timeout(exc):
+    return isinstance(exc, OperationalError) and \
+        getattr(exc.__cause__, 'pgcode', None) == QUERY_CANCELED
+
+
+class QueryBudget:
+    """execute_wrapper counting queries against the budget"""
+
+    def __init__(self, limit, view_name):
+        self.limit = limit
+        self.view_name = view_name
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        if self.count == self.limit + 1:
+            message = (f'{self.view_name} exceeded budget of {self.limit} '
+                       f'queries: {sql}')
+            if settings.QUERY_BUDGET_ACTION == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return execute(sql, params, many, context)
+
+
+class QueryLimitMixin:
+    """
+    DRF view mixin applying statement_timeout (seconds) and query_budget
+    (number of queries) to handler. Both are numbers or dicts by action
+    (method name for views without actions). Goes before
+    ReplicaReadMixin, which chooses the database of reads.
+    """
+    statement_timeout = None
+    query_budget = None
+
+    def get_limit(self, limit, request):
+        if isinstance(limit, dict):
+            action = getattr(self, 'action', None) or request.method.lower()
+            return limit.get(action)
+        return limit
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._limits = contextlib.ExitStack()
+        timeout = self.get_limit(self.statement_timeout, request)
+        budget = self.get_limit(self.query_budget, request)
+
+        if timeout:
+            for alias in {DEFAULT_DB_ALIAS, current_read_alias()}:
+                connection = connections[alias]
+                if connection.vendor != 'postgresql':
+                    continue
+                self._limits.enter_context(transaction.atomic(using=alias))
+                with connection.cursor() as cursor:
+                    # Reset at the end of transaction
+                    cursor.execute('SET LOCAL statement_timeout = %s',
+                                   [int(timeout * 1000)])
+        if budget is not None:
+            counter = QueryBudget(budget, type(self).__name__)
+            for connection in connections.all():
+                self._limits.enter_context(
+                    connection.execute_wrapper(counter)
+                )
+
+    def close_limits(self, exc_info=(None, None, None)):
+        limits = getattr(self, '_limits', None)
+        if limits is not None:
+            self._limits = None
+            limits.__exit__(*exc_info)
+
+    def handle_exception(self, exc):
+        if is_statement_timeout(exc):
+            STATEMENT_TIMEOUTS.inc(
+                view=type(self).__name__,
+                action=getattr(self, 'action', None) or
+                self.request.method.lower(),
+            )
+            exc = StatementTimeout(wait=settings.STATEMENT_TIMEOUT_RETRY_AFTER)
+        try:
+            response = super().handle_exception(exc)
+        except Exception as unhandled:
+            self.close_limits((type(unhandled), unhandled,
+                               unhandled.__traceback__))
+            raise
+        # Changes of failed request are not committed
+        self.close_limits((type(exc), exc, exc.__traceback__))
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        self.close_limits()
+        return super().finalize_response(request, response, *args, **kwargs)
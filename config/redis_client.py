@@ -0,0 +1,36 @@
+"""
+Shared Redis client for features working with Redis directly
+(throttling, metrics, event streams, leaderboards)
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+@lru_cache(maxsize=None)
+def get_redis():
+    """
+    Returns Redis client connected to REDIS_URL.
+    Client is safe to share between threads and reconnects after fork.
+    """
+    client_class = import_string(settings.REDIS_CLIENT_CLASS)
+    return client_class.from_url(settings.REDIS_URL)
+
+
+def get_async_redis():
+    """
+    Returns new asyncio Redis client connected to REDIS_URL.
+    Client is bound to the event loop it is used in.
+    """
+    client_class = import_string(settings.REDIS_ASYNC_CLIENT_CLASS)
+    return client_class.from_url(settings.REDIS_URL)
+
+
+@receiver(setting_changed)
+def reset_redis(setting, **kwargs):
+    """Reconnects when settings are overridden in tests"""
+    if setting in ('REDIS_URL', 'REDIS_CLIENT_CLASS'):
+        get_redis.cache_clear()
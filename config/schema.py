@@ -0,0 +1,24 @@
+"""
+OpenAPI document of the project API
+"""
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.generators import OpenAPISchemaGenerator
+
+api_info = openapi.Info(
+    title="Snippets API",
+    default_version='v1',
+    description="Test description",
+    terms_of_service="https://www.google.com/policies/terms/",
+    contact=openapi.Contact(email="contact@snippets.local"),
+    license=openapi.License(name="BSD License"),
+)
+
+
+def generate_schema() -> bytes:
+    """
+    Generates OpenAPI document for all public endpoints as JSON
+    """
+    generator = OpenAPISchemaGenerator(info=api_info)
+    schema = generator.get_schema(request=None, public=True)
+    return OpenAPICodecJson(validators=[]).encode(schema)
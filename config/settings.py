@@ -10,11 +10,14 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 
 # Custom libraries for environment variables
 import os
 from dotenv import load_dotenv
+from celery.schedules import crontab
+from kombu import Exchange, Queue
 load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -58,10 +61,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'config.profiling.ProfilingMiddleware',
+    'config.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'config.db_router.ReplicaPinMiddleware',
+    'config.throttling.RateLimitHeadersMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -98,9 +105,33 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('POSTGRES_HOST'),
         'PORT': '5432',
+        # Workers keep connections opened during warmup
+        'CONN_MAX_AGE': int(os.getenv('POSTGRES_CONN_MAX_AGE') or 60),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas (comma separated hosts), share credentials with primary
+REPLICA_DATABASES = []
+for index, host in enumerate(os.getenv('POSTGRES_REPLICA_HOSTS', '').split(',')):
+    if host.strip():
+        alias = f'replica_{index}'
+        DATABASES[alias] = {
+            **DATABASES['default'],
+            'HOST': host.strip(),
+            # Tests read the test database of primary
+            'TEST': {'MIRROR': 'default'},
+        }
+        REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['config.db_router.ReplicaRouter']
+
+# Seconds during which user reads from primary after a write
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS') or 15)
+# Replica lagging more than this (seconds) is skipped
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS') or 5)
+# How often replica lag is measured (seconds)
+REPLICA_LAG_CHECK_INTERVAL = 1
 
 
 # Password validation
@@ -139,8 +170,55 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files (preview images, avatars)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    # Chunks of resumable uploads (courses.uploads), not served to clients
+    'uploads': {
+        'BACKEND': os.getenv('UPLOAD_STORAGE_BACKEND') or
+        'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {'location': BASE_DIR / 'uploads'},
+    },
+}
+
 LOGS_ROOT = BASE_DIR / 'logs'
 
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        # Bounded: rotated at 10 MB, five old files are kept
+        'slow_requests': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': LOGS_ROOT / 'slow_requests.log',
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'requests.slow': {
+            'handlers': ['slow_requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+os.makedirs(LOGS_ROOT, exist_ok=True)
+
+# OpenAPI document built by `generate_schema` command
+OPENAPI_SCHEMA_PATH = BASE_DIR / 'schema' / 'openapi.json'
+SWAGGER_SETTINGS = {'SPEC_URL': 'openapi-schema'}
+REDOC_SETTINGS = {'SPEC_URL': 'openapi-schema'}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -149,18 +227,229 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
+    # MessagePack is negotiated by Accept and Content-Type headers
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'config.encoding.MessagePackRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'config.encoding.MessagePackParser',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
         # For all operations need authorization (comment to view documentation)
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'config.throttling.RoleRateThrottle',
+    ],
+    # '<throttle_scope of view>.<role of user>' or '<throttle_scope of view>'
+    'DEFAULT_THROTTLE_RATES': {
+        'user': '300/min',
+        'user.moderator': '1200/min',
+        'payment_create.member': '10/min',
+        'payment_create.moderator': '30/min',
+        'payment_list.member': '60/min',
+        'payment_list.moderator': '300/min',
+    },
 }
 
+# Response compression: encodings in order of preference,
+# smaller bodies are not compressed, larger ones are compressed as stream
+COMPRESSION_ENCODINGS = ('zstd', 'br', 'gzip')
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_STREAMING_SIZE = 1024 * 1024
+COMPRESSION_CHUNK_SIZE = 64 * 1024
+
+# Max sub-requests of one request to batch endpoint
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS') or 20)
+# Max safe sub-requests of a batch executed at once (threads)
+BATCH_CONCURRENCY = 4
+
 STRIPE_API_KEY = os.getenv('STRIPE_API_KEY')
+# Seconds to cache payment statuses received from STRIPE API
+STRIPE_STATUS_CACHE_TIMEOUT = {'paid': 60 * 60 * 24, 'unprocessed': 30}
+
+# Monthly partitions of payments created ahead of time
+PAYMENT_PARTITIONS_AHEAD = 3
+# Older partitions are archived to compressed files (0 - never)
+PAYMENT_RETENTION_MONTHS = int(os.getenv('PAYMENT_RETENTION_MONTHS') or 36)
+PAYMENT_ARCHIVE_ROOT = os.getenv('PAYMENT_ARCHIVE_ROOT') or \
+    BASE_DIR / 'archive' / 'payments'
+
+# Redis client class (fakeredis.FakeRedis can be used in tests)
+REDIS_CLIENT_CLASS = os.getenv('REDIS_CLIENT_CLASS') or 'redis.Redis'
+REDIS_ASYNC_CLIENT_CLASS = os.getenv('REDIS_ASYNC_CLIENT_CLASS') or \
+    'redis.asyncio.Redis'
+# Redis for throttling and other features using Redis directly
+REDIS_URL = os.getenv('REDIS_URL') or 'redis://redis:6379/2'
+
+# Cache: per-process LRU in front of shared Redis
+CACHES = {
+    'default': {
+        'BACKEND': 'config.cache.TwoTierCache',
+        'LOCATION': os.getenv('REDIS_CACHE_URL') or 'redis://redis:6379/1',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 30,
+            'CLIENT_CLASS': REDIS_CLIENT_CLASS,
+        },
+    }
+}
+
+# Admin lists estimated to have fewer rows are counted exactly
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Seconds clients are asked to wait after statement timeout (503)
+STATEMENT_TIMEOUT_RETRY_AFTER = 30
+# 'raise' - fail requests exceeding query budget of view, 'log' - log them
+QUERY_BUDGET_ACTION = os.getenv('QUERY_BUDGET_ACTION') or \
+    ('raise' if DEBUG else 'log')
+
+# Seconds to keep cached course details and first pages of lists
+PAGE_CACHE_TIMEOUT = 60 * 10
+# Seconds to keep ids of courses and lessons accessible to user (they are
+# dropped on change as well)
+ENTITLEMENT_CACHE_TIMEOUT = 60 * 60
+# Number of courses with most subscribers cached by warmup
+CACHE_WARM_LIMIT = 100
+# Max threads (database connections) used by warmup
+CACHE_WARM_CONCURRENCY = 4
+
+# Subscribers are notified about lesson updates at most once per interval
+COURSE_NOTIFICATION_INTERVAL = timedelta(hours=4)
+# 'instant' - email per update, 'digest' - email per user per window
+NOTIFICATION_MODE = os.getenv('NOTIFICATION_MODE') or 'instant'
+DIGEST_INTERVAL = timedelta(hours=int(os.getenv('DIGEST_INTERVAL_HOURS') or 24))
+# Digest emails sent at once over SMTP connection
+DIGEST_BATCH_SIZE = 100
 
 # Celery settings
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
+# Task modules outside of installed apps
+CELERY_IMPORTS = ('config.tasks',)
+
+# Separate queues, so bulk emails do not starve other tasks.
+# Each queue is consumed by its own worker (see docker-compose.yaml)
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_QUEUES = tuple(
+    Queue(name, Exchange(name), routing_key=name)
+    for name in ('default', 'email', 'payments', 'maintenance')
+)
+CELERY_TASK_ROUTES = {
+    'config.tasks.send_notification': {'queue': 'email'},
+    'config.tasks.send_digests': {'queue': 'email'},
+    'config.tasks.check_login': {'queue': 'maintenance'},
+    'config.tasks.relay_outbox': {'queue': 'maintenance'},
+    'config.tasks.warm_cache': {'queue': 'maintenance'},
+    'config.tasks.maintain_payment_partitions': {'queue': 'maintenance'},
+    'config.tasks.purge_course': {'queue': 'maintenance'},
+    'config.tasks.purge_lesson': {'queue': 'maintenance'},
+    'config.tasks.prune_sync_changes': {'queue': 'maintenance'},
+    'config.tasks.rebuild_leaderboards': {'queue': 'maintenance'},
+    'config.tasks.prune_uploads': {'queue': 'maintenance'},
+    '*payment*': {'queue': 'payments', 'priority': 0},
+}
+# Priorities inside a queue (0 - highest) for Redis broker
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'queue_order_strategy': 'priority',
+    'priority_steps': list(range(10)),
+    'sep': ':',
+}
+CELERY_TASK_DEFAULT_PRIORITY = 5
+# Workers reserve one message per process by default, queues with short
+# tasks raise it with --prefetch-multiplier
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Periodic tasks, synced into django_celery_beat on beat start
+CELERY_BEAT_SCHEDULE = {
+    'relay-outbox': {
+        'task': 'config.tasks.relay_outbox',
+        'schedule': 30.0,
+    },
+    'maintain-payment-partitions': {
+        'task': 'config.tasks.maintain_payment_partitions',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    # Digests are sent by the first run after the end of window
+    'send-digests': {
+        'task': 'config.tasks.send_digests',
+        'schedule': crontab(minute=5),
+    },
+    'prune-sync-changes': {
+        'task': 'config.tasks.prune_sync_changes',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'rebuild-leaderboards': {
+        'task': 'config.tasks.rebuild_leaderboards',
+        'schedule': crontab(hour=4, minute=30),
+    },
+    'prune-uploads': {
+        'task': 'config.tasks.prune_uploads',
+        'schedule': crontab(minute=15),
+    },
+}
+
+# Course events kept in Redis for clients resuming event streams
+EVENT_REPLAY_SIZE = 10000
+# Seconds between heartbeats of idle event streams
+SSE_HEARTBEAT_SECONDS = 15
+# Milliseconds clients wait before reconnecting to event stream
+SSE_RETRY_MILLISECONDS = 3000
+# Events queued for slow client before its stream is closed
+SSE_QUEUE_SIZE = 100
+
+# Changes returned by one request to sync endpoint
+SYNC_PAGE_SIZE = 500
+# Sync cursors expire and tombstones are pruned after this period
+SYNC_RETENTION = timedelta(days=30)
+
+# Rolling windows of course leaderboards in days ('all' - all time)
+LEADERBOARD_WINDOWS = {'day': 1, 'week': 7, 'month': 30}
+# Seconds a window merged from daily leaderboards is reused
+LEADERBOARD_MERGE_SECONDS = 60
+
+# Max size of file of resumable upload and of one of its chunks
+UPLOAD_MAX_SIZE = 50 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+# Unfinished uploads are deleted after this period
+UPLOAD_EXPIRY = timedelta(days=1)
+
+# Rows deleted per transaction by background deletion of courses
+PURGE_CHUNK_SIZE = 1000
+
+# Outbox events sent to broker at once
+OUTBOX_BATCH_SIZE = 100
+# How long sent outbox events are kept for deduplication
+OUTBOX_RETENTION = timedelta(days=1)
+
+# Tasks running longer are logged with arguments (celery.slow_tasks logger)
+SLOW_TASK_SECONDS = float(os.getenv('SLOW_TASK_SECONDS') or 10)
+# Requests running longer are logged with SQL fingerprints (requests.slow)
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS') or 1)
+# Share of requests profiled without token (0 - only requests with token)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE') or 0)
+# Seconds between stack samples of profiled request
+PROFILE_INTERVAL = 0.005
+# Seconds profiling tokens (`profile_token` command) are accepted
+PROFILE_TOKEN_MAX_AGE = 24 * 60 * 60
+# Profiles are written here, the oldest are removed over the limit
+PROFILES_ROOT = LOGS_ROOT / 'profiles'
+PROFILE_MAX_FILES = 200
+# Token required by metrics endpoint (empty - endpoint is open)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Max emails per second sent by email worker (token bucket)
+EMAIL_RATE_LIMIT = os.getenv('EMAIL_RATE_LIMIT') or '10/s'
+CELERY_TASK_ANNOTATIONS = {
+    'config.tasks.send_notification': {'rate_limit': EMAIL_RATE_LIMIT},
+}
 
 # Mailing service settings
 EMAIL_HOST = os.getenv('EMAIL_HOST')                    # using smtp.gmail.com
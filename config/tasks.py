@@ -1,13 +1,20 @@
 import datetime
+import logging
 
 from celery import shared_task
 from django.conf import settings
 from django.core.mail import send_mail
 
+from config.celery import app
+from courses import caching, deletion, leaderboards, notifications, \
+    outbox, partitions, sync, uploads
+from courses.models import Subscription
 from users.models import User
 
+logger = logging.getLogger(__name__)
 
-@shared_task
+
+@shared_task(ignore_result=True)
 def send_notification(course_title: str, email: str) -> None:
     """
     Sends notification to the subscriber of the course
@@ -20,7 +27,86 @@ def send_notification(course_title: str, email: str) -> None:
     )
 
 
-@shared_task
+@shared_task(acks_late=True, ignore_result=True)
+def notify_subscribers(course_id: int) -> None:
+    """
+    Sends notifications to all subscribers of the updated course
+    """
+    subscription_list = Subscription.objects.filter(
+        course_id=course_id
+    ).select_related('course', 'user')
+    # Send all messages over one broker connection
+    with app.producer_or_acquire() as producer:
+        for subscription in subscription_list:
+            send_notification.apply_async(
+                (subscription.course.name, subscription.user.email),
+                producer=producer,
+            )
+
+
+@shared_task(acks_late=True, ignore_result=True)
+def send_digests() -> None:
+    """
+    Sends digests of course updates of the last window (digest mode)
+    """
+    sent = notifications.send_digests()
+    logger.info('%s digests sent', sent)
+
+
+@shared_task(acks_late=True, ignore_result=True)
+def relay_outbox() -> None:
+    """
+    Sends outbox events missed by the relay of web processes
+    """
+    outbox.relay()
+    outbox.prune()
+
+
+@shared_task(ignore_result=True)
+def warm_cache(limit: int = None) -> None:
+    """
+    Precomputes cached pages of hot courses, e.g. after deploy
+    """
+    keys, seconds = caching.warm(limit=limit)
+    logger.info('Warmed %s cache keys in %.2f s', keys, seconds)
+
+
+@shared_task(acks_late=True, ignore_result=True)
+def maintain_payment_partitions() -> None:
+    """
+    Creates partitions of payments for next months, archives expired ones
+    """
+    partitions.maintain()
+
+
+@shared_task(bind=True, acks_late=True)
+def purge_course(self, course_id: int) -> int:
+    """
+    Deletes course marked for deletion with lessons, payments and
+    subscriptions, reporting progress in task state
+    """
+    return deletion.purge_course(course_id, progress=_progress(self))
+
+
+@shared_task(bind=True, acks_late=True)
+def purge_lesson(self, lesson_id: int) -> int:
+    """
+    Deletes lesson marked for deletion with its payments
+    """
+    return deletion.purge_lesson(lesson_id, progress=_progress(self))
+
+
+def _progress(task):
+    """Reports number of rows deleted by task so far"""
+    def progress(model, deleted):
+        task.update_state(state='PROGRESS',
+                          meta={'model': model, 'deleted': deleted})
+        logger.info('%s[%s]: %s %s rows deleted', task.name,
+                    task.request.id, deleted, model)
+    return progress
+
+
+@shared_task(acks_late=True, ignore_result=True)
 def check_login():
     """
     Checks when user was logged last time
@@ -43,3 +129,29 @@ def check_login():
                 user.is_active = False
                 user.save()
 
+
+@shared_task(acks_late=True, ignore_result=True)
+def prune_sync_changes() -> None:
+    """
+    Deletes tombstones of delta sync older than accepted cursors
+    """
+    pruned = sync.prune()
+    logger.info('Pruned %s sync tombstones', pruned)
+
+
+@shared_task(acks_late=True, ignore_result=True)
+def rebuild_leaderboards() -> None:
+    """
+    Recomputes course leaderboards from the database
+    """
+    written = leaderboards.rebuild()
+    logger.info('Rebuilt %s leaderboard sets', written)
+
+
+@shared_task(acks_late=True, ignore_result=True)
+def prune_uploads() -> None:
+    """
+    Deletes expired uploads with their chunks
+    """
+    pruned = uploads.prune()
+    logger.info('Pruned %s uploads', pruned)
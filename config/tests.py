@@ -0,0 +1,919 @@
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from unittest import mock
+
+import brotli
+import msgpack
+import redis
+import zstandard
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from config import batch, celery, compression, db_router, metrics, \
+    profiling, query_limits
+from config.cache import TwoTierCache
+from config.redis_client import get_redis
+from config.tasks import check_login, notify_subscribers, send_notification
+from config.views import load_schema
+from courses import outbox, services
+from courses.models import Course, Lesson, Payment
+from courses.views import PaymentListAPIView
+from users.models import User
+
+
+@override_settings(REPLICA_DATABASES=['replica_0', 'replica_1'])
+class ReplicaRouterTest(TestCase):
+
+    def setUp(self) -> None:
+        """Set up router and clean state for each test"""
+        self.router = db_router.ReplicaRouter()
+        self.user = User.objects.create(email='test@gmail.com')
+        cache.clear()
+
+    def test_reads_go_to_primary_by_default(self):
+        """Testing that reads outside of replica block use primary"""
+        self.assertEqual(self.router.db_for_read(Course), 'default')
+        self.assertEqual(self.router.db_for_write(Course), 'default')
+
+    def test_reads_go_to_replica(self):
+        """Testing that reads inside replica block use replica"""
+        with mock.patch.object(db_router, 'replica_lag', return_value=0):
+            with db_router.replica_reads():
+                self.assertIn(self.router.db_for_read(Course),
+                              ['replica_0', 'replica_1'])
+                # Writes always use primary
+                self.assertEqual(self.router.db_for_write(Course), 'default')
+        self.assertEqual(self.router.db_for_read(Course), 'default')
+
+    def test_lagging_replica_is_skipped(self):
+        """Testing fallback to primary when replicas lag behind"""
+        lags = {'replica_0': 60, 'replica_1': None}
+        with mock.patch.object(db_router, 'replica_lag', side_effect=lags.get):
+            with db_router.replica_reads():
+                self.assertEqual(self.router.db_for_read(Course), 'default')
+
+        lags['replica_1'] = 1
+        with mock.patch.object(db_router, 'replica_lag', side_effect=lags.get):
+            with db_router.replica_reads():
+                self.assertEqual(self.router.db_for_read(Course), 'replica_1')
+
+    def test_migrations_skip_replicas(self):
+        """Testing that replicas are not migrated"""
+        self.assertTrue(self.router.allow_migrate('default', 'courses'))
+        self.assertFalse(self.router.allow_migrate('replica_0', 'courses'))
+
+
+class ReplicaStickinessTest(APITestCase):
+
+    def setUp(self) -> None:
+        """Set up initial objects for each test"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.course = Course.objects.create(name='test course',
+                                            description='course description',
+                                            owner=self.user)
+        cache.clear()
+
+    def test_write_pins_user_to_primary(self):
+        """Testing read-your-writes after course update"""
+        self.client.force_authenticate(self.user)
+        self.assertFalse(db_router.is_pinned(self.user))
+
+        response = self.client.patch(
+            reverse('courses:courses-detail', kwargs={'pk': self.course.id}),
+            data={'name': 'test course updated'}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(db_router.is_pinned(self.user))
+
+    def test_read_does_not_pin_user(self):
+        """Testing that safe requests do not pin user"""
+        self.client.force_authenticate(self.user)
+        self.client.get(reverse('courses:courses-list'))
+        self.assertFalse(db_router.is_pinned(self.user))
+
+
+# Replica of tests: another connection to the test database of primary.
+# Registered before the test runner sets up databases.
+REPLICA = 'replica_test'
+connections.settings[REPLICA] = {
+    **connections['default'].settings_dict,
+    'TEST': {**connections['default'].settings_dict['TEST'],
+             'MIRROR': 'default'},
+}
+
+
+@override_settings(REPLICA_DATABASES=[REPLICA])
+class ReplicaQueryTest(APITransactionTestCase):
+    databases = {'default', REPLICA}
+
+    def setUp(self) -> None:
+        """Set up initial objects for each test"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.course = Course.objects.create(name='test course',
+                                            description='course description',
+                                            owner=self.user)
+        Payment.objects.create(course=self.course, user=self.user,
+                               amount=100, type='card')
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def get_payments(self):
+        """Returns payments and SQL executed by primary and replica"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[REPLICA]) as replica, \
+                mock.patch.object(services, 'get_payment_status',
+                                  return_value='paid'):
+            response = self.client.get(reverse('courses:payments-list'))
+        self.assertEqual(response.status_code, 200)
+        return (response.json(),
+                [query['sql'] for query in primary],
+                [query['sql'] for query in replica])
+
+    def test_reads_and_writes(self):
+        """Testing that reads use the replica and writes the primary"""
+        payments, primary, replica = self.get_payments()
+
+        self.assertEqual(len(payments), 1)
+        self.assertTrue(any('courses_payment' in sql for sql in replica))
+        self.assertFalse(any('courses_payment' in sql for sql in primary))
+
+        # Relay thread of outbox events would lock SQLite tables
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[REPLICA]) as replica, \
+                mock.patch.object(outbox, 'wake_relay'):
+            response = self.client.patch(
+                reverse('courses:courses-detail',
+                        kwargs={'pk': self.course.id}),
+                data={'name': 'test course updated'}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any(query['sql'].startswith('UPDATE')
+                            for query in primary))
+        self.assertEqual(len(replica), 0)
+
+        # Writer reads own writes from the primary
+        payments, primary, replica = self.get_payments()
+        self.assertEqual(len(payments), 1)
+        self.assertTrue(any('courses_payment' in sql for sql in primary))
+        self.assertEqual(replica, [])
+
+    def test_failed_request(self):
+        """Testing that replica is released when view raises an error"""
+        with mock.patch.object(PaymentListAPIView, 'list',
+                               side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            self.client.get(reverse('courses:payments-list'))
+        self.assertEqual(db_router.current_read_alias(), 'default')
+
+
+class TwoTierCacheTest(TestCase):
+
+    def create_cache(self, **options):
+        """Creates cache backend connected to shared fake Redis"""
+        return TwoTierCache('redis://fake:6379/15', {
+            'OPTIONS': {'CLIENT_CLASS': 'fakeredis.FakeRedis', **options},
+        })
+
+    def setUp(self) -> None:
+        """Set up two processes sharing the same Redis"""
+        self.cache = self.create_cache()
+        self.other_cache = self.create_cache()
+        self.cache.clear()
+
+    def test_tiers(self):
+        """Testing that values are read from L1, then from L2"""
+        self.cache.set('course', {'name': 'test course'})
+
+        self.assertEqual(self.cache.get('course'), {'name': 'test course'})
+        self.assertEqual(self.other_cache.get('course'),
+                         {'name': 'test course'})
+        self.assertEqual(self.other_cache.get('course'),
+                         {'name': 'test course'})
+        self.assertIsNone(self.cache.get('missing'))
+
+        self.assertEqual(self.cache.stats()['l1_hits'], 1)
+        self.assertEqual(self.cache.stats()['l2_misses'], 1)
+        self.assertEqual(self.other_cache.stats()['l1_hit_ratio'], 0.5)
+        self.assertEqual(self.other_cache.stats()['l2_hit_ratio'], 1.0)
+
+    def test_invalidation(self):
+        """Testing that writes drop stale L1 entries of other processes"""
+        self.cache.set('role', 'member')
+        self.assertEqual(self.other_cache.get('role'), 'member')
+
+        self.cache.set('role', 'moderator')
+        # Invalidation is delivered asynchronously
+        for _ in range(50):
+            if self.other_cache.get('role') == 'moderator':
+                break
+            time.sleep(0.02)
+        self.assertEqual(self.other_cache.get('role'), 'moderator')
+
+        self.cache.delete('role')
+        for _ in range(50):
+            if self.other_cache.get('role') is None:
+                break
+            time.sleep(0.02)
+        self.assertIsNone(self.other_cache.get('role'))
+
+    def test_eviction(self):
+        """Testing that L1 is bounded"""
+        cache = self.create_cache(L1_MAX_ENTRIES=2)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+
+        self.assertEqual(cache.stats()['l1_size'], 2)
+        self.assertEqual(cache.stats()['l1_evictions'], 1)
+        # Evicted entry is still available in L2
+        self.assertEqual(cache.get('a'), 'a')
+
+    def test_incr(self):
+        """Testing atomic counters"""
+        self.cache.set('hits', 1)
+        self.assertEqual(self.cache.incr('hits', 2), 3)
+        self.assertEqual(self.other_cache.get('hits'), 3)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        # Missing counter is not created
+        self.assertIsNone(self.other_cache.get('missing'))
+        self.assertEqual(self.cache.decr('hits'), 2)
+
+    def test_incr_redis_unavailable(self):
+        """Testing that counters fail as missing keys while Redis is down"""
+        self.cache.set('hits', 1)
+        with mock.patch.object(self.cache, '_incr_existing',
+                               side_effect=redis.ConnectionError), \
+                self.assertLogs('config.cache', 'WARNING'), \
+                self.assertRaises(ValueError):
+            self.cache.incr('hits')
+        # Stale value is not served from L1
+        self.assertEqual(self.cache.get('hits'), 1)
+        self.assertEqual(self.cache.stats()['l1_hits'], 0)
+
+
+@override_settings(
+    REDIS_CLIENT_CLASS='fakeredis.FakeRedis',
+    REDIS_URL='redis://fake:6379/14',
+    REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {
+            'user': '100/min',
+            'payment_list.member': '2/min',
+            'payment_list.moderator': '5/min',
+        },
+    },
+)
+class ThrottlingTest(APITestCase):
+
+    def setUp(self) -> None:
+        """Set up users and clean Redis for each test"""
+        self.user_member = User.objects.create(email='test@gmail.com')
+        self.user_moderator = User.objects.create(email='test2@gmail.com',
+                                                  role='moderator')
+        get_redis().flushdb()
+
+    def test_limit_per_role(self):
+        """Testing that limit depends on role of user"""
+        self.client.force_authenticate(self.user_member)
+        for remaining in (1, 0):
+            response = self.client.get(reverse('courses:payments-list'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-RateLimit-Limit'], '2')
+            self.assertEqual(response['X-RateLimit-Remaining'],
+                             str(remaining))
+
+        response = self.client.get(reverse('courses:payments-list'))
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(0 < int(response['Retry-After']) <= 60)
+
+        # Moderator has own limit
+        self.client.force_authenticate(self.user_moderator)
+        response = self.client.get(reverse('courses:payments-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-RateLimit-Remaining'], '4')
+
+    def test_limit_per_view(self):
+        """Testing that views without scope use default limit"""
+        self.client.force_authenticate(self.user_member)
+        for _ in range(3):
+            response = self.client.get(reverse('courses:lesson-list'))
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-RateLimit-Limit'], '100')
+
+    def test_script_loaded_once(self):
+        """Testing that requests call the loaded script by its hash"""
+        get_redis().script_flush()
+        self.client.force_authenticate(self.user_moderator)
+        with mock.patch.object(get_redis(), 'script_load',
+                               wraps=get_redis().script_load) as load, \
+                mock.patch.object(get_redis(), 'register_script') as register:
+            for _ in range(3):
+                response = self.client.get(reverse('courses:lesson-list'))
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(load.call_count, 1)
+        register.assert_not_called()
+        self.assertEqual(response['X-RateLimit-Remaining'], '97')
+
+
+@override_settings(REDIS_CLIENT_CLASS='fakeredis.FakeRedis',
+                   REDIS_URL='redis://fake:6379/13')
+@mock.patch.object(metrics, 'COLLECTORS', [])
+class MetricsTest(TestCase):
+
+    def setUp(self) -> None:
+        """Clean recorded metrics for each test"""
+        metrics.reset()
+
+    def test_histogram(self):
+        """Testing cumulative buckets of histogram"""
+        for value in (0.003, 0.2, 100):
+            celery.TASK_RUNTIME.observe(value, task='test')
+
+        output = metrics.render()
+        self.assertIn('celery_task_runtime_seconds_bucket'
+                      '{task="test",le="0.005"} 1', output)
+        self.assertIn('celery_task_runtime_seconds_bucket'
+                      '{task="test",le="0.25"} 2', output)
+        self.assertIn('celery_task_runtime_seconds_bucket'
+                      '{task="test",le="+Inf"} 3', output)
+        self.assertIn('celery_task_runtime_seconds_count{task="test"} 3',
+                      output)
+
+    def test_task_signals(self):
+        """Testing that executions of tasks are recorded"""
+        headers = {}
+        celery.task_published(sender='config.tasks.check_login',
+                              headers=headers, routing_key='maintenance')
+        self.assertIn('enqueued_at', headers)
+
+        with self.settings(SLOW_TASK_SECONDS=0), \
+                self.assertLogs('celery.slow_tasks') as logs:
+            check_login.apply()
+        self.assertIn('config.tasks.check_login', logs.output[0])
+
+        output = metrics.render()
+        self.assertIn('celery_tasks_published_total'
+                      '{task="config.tasks.check_login",queue="maintenance"} 1',
+                      output)
+        self.assertIn('celery_task_outcomes_total'
+                      '{task="config.tasks.check_login",state="SUCCESS"} 1',
+                      output)
+        self.assertIn('celery_task_runtime_seconds_count'
+                      '{task="config.tasks.check_login"} 1', output)
+
+    def test_endpoint(self):
+        """Testing metrics endpoint and its token"""
+        collector = mock.Mock(return_value=[
+            (celery.QUEUE_DEPTH, {'queue': 'email'}, 7)
+        ])
+        with mock.patch.object(metrics, 'COLLECTORS', [collector]):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'celery_queue_depth{queue="email"} 7',
+                      response.content)
+
+
+class CeleryRoutingTest(TestCase):
+
+    def route(self, name):
+        route = celery.app.amqp.router.route({}, name)
+        return route['queue'].name, route.get('priority')
+
+    def test_queues(self):
+        """Testing that tasks are routed to queues of their workers"""
+        self.assertEqual(self.route('config.tasks.send_notification'),
+                         ('email', None))
+        self.assertEqual(self.route('config.tasks.send_digests'),
+                         ('email', None))
+        self.assertEqual(self.route('config.tasks.check_login'),
+                         ('maintenance', None))
+        self.assertEqual(self.route('config.tasks.purge_course'),
+                         ('maintenance', None))
+        # Explicit route takes precedence over the payments pattern
+        self.assertEqual(
+            self.route('config.tasks.maintain_payment_partitions'),
+            ('maintenance', None)
+        )
+        self.assertEqual(self.route('courses.tasks.capture_payment'),
+                         ('payments', 0))
+        self.assertEqual(self.route('config.tasks.notify_subscribers'),
+                         ('default', None))
+
+    def test_options(self):
+        """Testing rate limit of emails and acknowledgement options"""
+        self.assertEqual(send_notification.rate_limit,
+                         settings.EMAIL_RATE_LIMIT)
+        self.assertTrue(send_notification.ignore_result)
+        self.assertFalse(send_notification.acks_late)
+        self.assertTrue(check_login.acks_late)
+        self.assertTrue(notify_subscribers.acks_late)
+
+
+class OpenAPISchemaTest(TestCase):
+
+    def setUp(self) -> None:
+        """Set up empty build directory and schema cache for each test"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = pathlib.Path(directory.name) / 'schema' / 'openapi.json'
+        load_schema.cache_clear()
+        self.addCleanup(load_schema.cache_clear)
+
+    def test_generated(self):
+        """Testing schema generated on first request and revalidation"""
+        with self.settings(OPENAPI_SCHEMA_PATH=self.path):
+            response = self.client.get(reverse('openapi-schema'))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('paths', response.json())
+            self.assertIn('no-cache', response['Cache-Control'])
+            etag = response['ETag']
+
+            response = self.client.get(reverse('openapi-schema'),
+                                       HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+
+    def test_prebuilt(self):
+        """Testing that schema built by command is served as is"""
+        with self.settings(OPENAPI_SCHEMA_PATH=self.path):
+            call_command('generate_schema', stdout=mock.Mock())
+            self.assertTrue(self.path.exists())
+            self.path.write_bytes(b'{"prebuilt": true}')
+
+            response = self.client.get(reverse('openapi-schema'))
+            self.assertEqual(response.json(), {'prebuilt': True})
+            etag = response['ETag']
+            response = self.client.get(reverse('openapi-schema'),
+                                       HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(reverse('openapi-schema'),
+                                       HTTP_IF_NONE_MATCH='"stale"')
+            self.assertEqual(response.status_code, 200)
+
+        with self.settings(METRICS_TOKEN='secret'):
+            response = self.client.get(reverse('metrics'))
+            self.assertEqual(response.status_code, 403)
+            response = self.client.get(reverse('metrics'),
+                                       HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+
+    def test_redis_unavailable(self):
+        """Testing that collected metrics are served while Redis is down"""
+        collector = mock.Mock(return_value=[
+            (celery.QUEUE_DEPTH, {'queue': 'email'}, 7)
+        ])
+        client = mock.Mock()
+        client.pipeline.return_value.execute.side_effect = \
+            redis.ConnectionError
+        with mock.patch.object(metrics, 'COLLECTORS', [collector]), \
+                mock.patch.object(metrics, 'get_redis', return_value=client), \
+                self.assertLogs('config.metrics', 'WARNING'):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'celery_queue_depth{queue="email"} 7',
+                      response.content)
+
+
+class CeleryRoutingTest(TestCase):
+
+    def route(self, name):
+        route = celery.app.amqp.router.route({}, name)
+        return route['queue'].name, route.get('priority')
+
+    def test_queues(self):
+        """Testing that tasks are routed to queues of their workers"""
+        self.assertEqual(self.route('config.tasks.send_notification'),
+                         ('email', None))
+        self.assertEqual(self.route('config.tasks.send_digests'),
+                         ('email', None))
+        self.assertEqual(self.route('config.tasks.check_login'),
+                         ('maintenance', None))
+        self.assertEqual(self.route('config.tasks.purge_course'),
+                         ('maintenance', None))
+        # Explicit route takes precedence over the payments pattern
+        self.assertEqual(
+            self.route('config.tasks.maintain_payment_partitions'),
+            ('maintenance', None)
+        )
+        self.assertEqual(self.route('courses.tasks.capture_payment'),
+                         ('payments', 0))
+        self.assertEqual(self.route('config.tasks.notify_subscribers'),
+                         ('default', None))
+
+    def test_options(self):
+        """Testing rate limit of emails and acknowledgement options"""
+        self.assertEqual(send_notification.rate_limit,
+                         settings.EMAIL_RATE_LIMIT)
+        self.assertTrue(send_notification.ignore_result)
+        self.assertFalse(send_notification.acks_late)
+        self.assertTrue(check_login.acks_late)
+        self.assertTrue(notify_subscribers.acks_late)
+
+
+class OpenAPISchemaTest(TestCase):
+
+    def setUp(self) -> None:
+        """Set up empty build directory and schema cache for each test"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = pathlib.Path(directory.name) / 'schema' / 'openapi.json'
+        load_schema.cache_clear()
+        self.addCleanup(load_schema.cache_clear)
+
+    def test_generated(self):
+        """Testing schema generated on first request and revalidation"""
+        with self.settings(OPENAPI_SCHEMA_PATH=self.path):
+            response = self.client.get(reverse('openapi-schema'))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('paths', response.json())
+            self.assertIn('no-cache', response['Cache-Control'])
+            etag = response['ETag']
+
+            response = self.client.get(reverse('openapi-schema'),
+                                       HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+
+    def test_prebuilt(self):
+        """Testing that schema built by command is served as is"""
+        with self.settings(OPENAPI_SCHEMA_PATH=self.path):
+            call_command('generate_schema', stdout=mock.Mock())
+            self.assertTrue(self.path.exists())
+            self.path.write_bytes(b'{"prebuilt": true}')
+
+            response = self.client.get(reverse('openapi-schema'))
+            self.assertEqual(response.json(), {'prebuilt': True})
+            etag = response['ETag']
+            response = self.client.get(reverse('openapi-schema'),
+                                       HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(reverse('openapi-schema'),
+                                       HTTP_IF_NONE_MATCH='"stale"')
+            self.assertEqual(response.status_code, 200)
+
+
+class BatchTest(APITestCase):
+
+    def setUp(self) -> None:
+        """Set up initial objects for each test"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.course = Course.objects.create(name='test course',
+                                            description='course description',
+                                            owner=self.user)
+        cache.clear()
+        token = AccessToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_batch(self):
+        """Testing sub-requests executed in order with one authentication"""
+        authenticate = mock.Mock(wraps=JWTAuthentication().authenticate)
+        with mock.patch.object(JWTAuthentication, 'authenticate',
+                               authenticate):
+            response = self.client.post(reverse('batch'), data={'requests': [
+                {'method': 'POST', 'path': reverse('courses:lesson-create'),
+                 'body': {'name': 'test lesson',
+                          'description': 'lesson description',
+                          'course': self.course.id}},
+                {'path': reverse('courses:lesson-list') + '?page=1'},
+                {'path': reverse('courses:courses-detail',
+                                 kwargs={'pk': self.course.id})},
+                {'path': '/missing/'},
+            ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(authenticate.call_count, 1)
+        created, lessons, course, missing = response.json()['responses']
+        self.assertEqual(created['status'], 201)
+        self.assertEqual(lessons['status'], 200)
+        self.assertEqual(lessons['body']['results'][0]['id'],
+                         created['body']['id'])
+        self.assertEqual(course['body']['name'], 'test course')
+        self.assertEqual(missing['status'], 404)
+        self.assertTrue(Lesson.objects.filter(owner=self.user).exists())
+        # Write of sub-request pins user to primary
+        self.assertTrue(db_router.is_pinned(self.user))
+
+    def test_write_then_read(self):
+        """Testing reads after a write of the same batch use the primary"""
+        with mock.patch.object(db_router, 'choose_replica',
+                               return_value=None) as choose_replica:
+            response = self.client.post(reverse('batch'), data={'requests': [
+                {'path': reverse('courses:lesson-list') + '?page=1'},
+                {'method': 'POST', 'path': reverse('courses:lesson-create'),
+                 'body': {'name': 'test lesson',
+                          'description': 'lesson description',
+                          'course': self.course.id}},
+                {'path': reverse('courses:lesson-list') + '?page=1'},
+            ]}, format='json')
+
+        before, created, after = response.json()['responses']
+        self.assertEqual(created['status'], 201)
+        self.assertEqual(before['body']['results'], [])
+        self.assertEqual(after['body']['results'][0]['id'],
+                         created['body']['id'])
+        # Only the read before the write could use a replica
+        self.assertEqual(choose_replica.call_count, 1)
+
+    def test_validation(self):
+        """Testing limit of batch size and nested batches"""
+        with self.settings(BATCH_MAX_REQUESTS=2):
+            response = self.client.post(reverse('batch'), data={
+                'requests': [{'path': reverse('courses:lesson-list')}] * 3
+            }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(reverse('batch'), data={
+            'requests': [{'path': reverse('batch')}]
+        }, format='json')
+        self.assertEqual(response.json()['responses'][0]['status'], 400)
+        self.assertFalse(db_router.is_pinned(self.user))
+
+    def test_failed_sub_request(self):
+        """Testing that exception of one sub-request becomes its response"""
+        with self.assertLogs('config.batch', 'ERROR'):
+            response = self.client.post(reverse('batch'), data={'requests': [
+                # Course without subscription raises DoesNotExist
+                {'method': 'DELETE',
+                 'path': reverse('courses:unsubscribe',
+                                 kwargs={'pk': self.course.id})},
+                {'path': reverse('courses:courses-detail',
+                                 kwargs={'pk': self.course.id})},
+            ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        failed, course = response.json()['responses']
+        self.assertEqual(failed['status'], 500)
+        self.assertEqual(course['status'], 200)
+        self.assertFalse(db_router.is_pinned(self.user))
+
+    def test_non_api_view(self):
+        """Testing that views needing middleware cannot be batched"""
+        response = self.client.post(reverse('batch'), data={
+            'requests': [{'path': '/admin/'}]
+        }, format='json')
+        self.assertEqual(response.json()['responses'][0]['status'], 400)
+
+
+class BatchConcurrencyTest(APITransactionTestCase):
+
+    def test_concurrent_reads(self):
+        """Testing that safe sub-requests run in worker threads"""
+        user = User.objects.create(email='test@gmail.com')
+        course = Course.objects.create(name='test course',
+                                       description='course description',
+                                       owner=user)
+        cache.clear()
+        self.client.force_authenticate(user)
+
+        with mock.patch('config.batch.in_own_connection',
+                        wraps=batch.in_own_connection) as in_own_connection:
+            response = self.client.post(reverse('batch'), data={'requests': [
+                {'path': reverse('courses:courses-list')},
+                {'path': reverse('courses:courses-detail',
+                                 kwargs={'pk': course.id})},
+                {'path': reverse('courses:payments-list')},
+            ]}, format='json')
+
+        self.assertEqual(in_own_connection.call_count, 3)
+        statuses = [item['status'] for item in response.json()['responses']]
+        self.assertEqual(statuses, [200, 200, 200])
+        self.assertEqual(response.json()['responses'][1]['body']['id'],
+                         course.id)
+
+
+class EncodingTest(APITestCase):
+
+    def setUp(self) -> None:
+        """Set up initial objects for each test"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.course = Course.objects.create(name='test course',
+                                            description='description ' * 500,
+                                            owner=self.user)
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def test_msgpack(self):
+        """Testing MessagePack requests and responses"""
+        response = self.client.post(
+            reverse('courses:courses-list'),
+            data=msgpack.packb({'name': 'test course 2',
+                                'description': 'course description'}),
+            content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['name'],
+                         'test course 2')
+
+        response = self.client.post(reverse('courses:courses-list'),
+                                    data=b'\xc1',
+                                    content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
+
+    def test_choose_encoding(self):
+        """Testing negotiation of content coding"""
+        self.assertEqual(compression.choose_encoding('gzip, br, zstd'),
+                         'zstd')
+        self.assertEqual(compression.choose_encoding('gzip, br;q=0.5'),
+                         'gzip')
+        self.assertEqual(compression.choose_encoding('*, zstd;q=0'), 'br')
+        self.assertIsNone(compression.choose_encoding('identity'))
+        self.assertIsNone(compression.choose_encoding(''))
+
+    def test_compression(self):
+        """Testing compressed, streamed and uncompressed responses"""
+        url = reverse('courses:courses-detail', kwargs={'pk': self.course.id})
+        expected = self.client.get(url).content
+        decompress = {
+            'gzip': lambda data: zlib.decompress(data, 31),
+            'br': brotli.decompress,
+            'zstd': lambda data: zstandard.ZstdDecompressor()
+            .decompressobj().decompress(data),
+        }
+        for encoding, decompress_data in decompress.items():
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+            self.assertEqual(response['Content-Encoding'], encoding)
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertLess(len(response.content), len(expected))
+            self.assertEqual(decompress_data(response.content), expected)
+
+            with self.settings(COMPRESSION_STREAMING_SIZE=1024,
+                               COMPRESSION_CHUNK_SIZE=100):
+                response = self.client.get(url,
+                                           HTTP_ACCEPT_ENCODING=encoding)
+            self.assertTrue(response.streaming)
+            self.assertFalse(response.has_header('Content-Length'))
+            self.assertEqual(
+                decompress_data(b''.join(response.streaming_content)),
+                expected
+            )
+
+        # Small responses are not compressed
+        response = self.client.get(reverse('courses:payments-list'),
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ProfilingTest(APITestCase):
+
+    def setUp(self) -> None:
+        """Set up initial objects and profiles directory for each test"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.course = Course.objects.create(name='test course',
+                                            description='course description',
+                                            owner=self.user)
+        cache.clear()
+        self.client.force_authenticate(self.user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_profile(self):
+        """Testing profile of request with token"""
+        url = reverse('courses:courses-list')
+        with self.settings(PROFILES_ROOT=self.directory):
+            response = self.client.get(url)
+            self.assertFalse(response.has_header('X-Profile-Id'))
+            response = self.client.get(url, HTTP_X_PROFILE='invalid')
+            self.assertFalse(response.has_header('X-Profile-Id'))
+
+            cache.clear()
+            response = self.client.get(
+                url, HTTP_X_PROFILE=profiling.make_token()
+            )
+            self.assertEqual(response.status_code, 200)
+            profile_id = response['X-Profile-Id']
+            with open(os.path.join(self.directory,
+                                   f'{profile_id}.json')) as file:
+                profile = json.load(file)
+            self.assertEqual(profile['path'], url)
+            self.assertEqual(profile['status'], 200)
+            self.assertTrue(profile['queries'])
+            self.assertEqual(profile['call_tree']['name'], 'request')
+            self.assertTrue(os.path.exists(
+                os.path.join(self.directory, f'{profile_id}.folded')
+            ))
+
+            # Oldest profiles are removed over the limit
+            with self.settings(PROFILE_MAX_FILES=1):
+                response = self.client.get(
+                    url, {'_profile': profiling.make_token()}
+                )
+            self.assertEqual(sorted(os.listdir(self.directory)), [
+                f'{response["X-Profile-Id"]}.folded',
+                f'{response["X-Profile-Id"]}.json',
+            ])
+
+    def test_sampler(self):
+        """Testing stack samples and call tree"""
+        def slow_call():
+            time.sleep(0.1)
+
+        with profiling.StackSampler(threading.get_ident(), sys._getframe(),
+                                    0.005) as sampler:
+            slow_call()
+        self.assertTrue(sampler.stacks)
+        tree = profiling.call_tree(sampler.stacks)
+        self.assertEqual(tree['samples'], sum(sampler.stacks.values()))
+        self.assertTrue(tree['children'][0]['name'].startswith('slow_call'))
+
+    def test_slow_request(self):
+        """Testing slow requests logged with SQL fingerprints"""
+        with self.settings(SLOW_REQUEST_SECONDS=0), \
+                self.assertLogs('requests.slow') as logs:
+            self.client.get(reverse('courses:courses-list'))
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['queries'],
+                         sum(item['count'] for item in entry['fingerprints']))
+
+        with self.assertNoLogs('requests.slow'):
+            self.client.get(reverse('courses:courses-list'))
+
+    def test_fingerprint(self):
+        """Testing values removed from SQL"""
+        self.assertEqual(
+            profiling.fingerprint(
+                "SELECT * FROM t WHERE a = 'x''y' AND b IN (1, 2, 3)\n"
+                "LIMIT 10"
+            ),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) LIMIT ?'
+        )
+        self.assertEqual(profiling.fingerprint('id IN (%s, %s)'),
+                         'id IN (...)')
+
+    def test_external_call(self):
+        """Testing external calls recorded in profiles"""
+        with mock.patch('courses.services.get_stripe') as get_stripe, \
+                self.settings(PROFILES_ROOT=self.directory):
+            get_stripe.return_value.PaymentIntent.retrieve.return_value = {
+                'amount': 100, 'amount_received': 100,
+            }
+            record = profiling.Record()
+            token = profiling._record.set(record)
+            try:
+                services.get_payment_status('pi_test')
+            finally:
+                profiling._record.reset(token)
+        self.assertEqual([name for name, _ in record.external],
+                         ['stripe.PaymentIntent.retrieve'])
+
+
+class QueryLimitTest(APITestCase):
+
+    def setUp(self) -> None:
+        """Set up initial objects for each test"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.client.force_authenticate(self.user)
+        self.url = reverse('courses:payments-list')
+
+    def test_query_budget(self):
+        """Testing requests exceeding query budget"""
+        with mock.patch.object(PaymentListAPIView, 'query_budget', 0):
+            with self.settings(QUERY_BUDGET_ACTION='raise'), \
+                    self.assertRaises(query_limits.QueryBudgetExceeded):
+                self.client.get(self.url)
+
+            with self.settings(QUERY_BUDGET_ACTION='log'), \
+                    self.assertLogs('config.query_limits') as logs:
+                response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(logs.records), 1)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_statement_timeout(self):
+        """Testing cancelled statements answered with 503"""
+        error = OperationalError('canceling statement due to statement '
+                                 'timeout')
+        # Database driver error wrapped by Django
+        error.__cause__ = type('QueryCanceled', (Exception,),
+                               {'pgcode': query_limits.QUERY_CANCELED})()
+        with mock.patch.object(PaymentListAPIView, 'list',
+                               side_effect=error), \
+                mock.patch.object(query_limits.STATEMENT_TIMEOUTS,
+                                  'inc') as inc:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'],
+                         str(settings.STATEMENT_TIMEOUT_RETRY_AFTER))
+        self.assertEqual(response.json()['detail'],
+                         query_limits.StatementTimeout.default_detail)
+        inc.assert_called_once_with(view='PaymentListAPIView', action='get')
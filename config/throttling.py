@@ -0,0 +1,124 @@
+"""
+DRF throttling backed by Redis sliding window.
+
+Rates are looked up in DEFAULT_THROTTLE_RATES by '<scope>.<role>' first and
+by '<scope>' then, where scope is `throttle_scope` of view ('user' if not
+set) and role is role of user ('anon' for anonymous users).
+"""
+import logging
+import math
+import time
+import uuid
+
+import redis
+from redis.commands.core import Script
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from config.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Checks and records request in one atomic round trip.
+# Returns {allowed, remaining requests, milliseconds until window frees}
+SLIDING_WINDOW = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+if count < limit then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], window)
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return {1, limit - count - 1, oldest[2] + window - now}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, 0, oldest[2] + window - now}
+"""
+# Hashed once, called by SHA on the shared client (loaded on first miss)
+sliding_window = Script(None, SLIDING_WINDOW.encode())
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+class RoleRateThrottle(BaseThrottle):
+    """
+    Limits requests of each user (or IP address for anonymous users)
+    per view scope, with different rates per role
+    """
+    default_scope = 'user'
+
+    def __init__(self):
+        self.retry_after = None
+
+    def get_rate(self, request, view):
+        """Returns (scope, rate) for request"""
+        scope = getattr(view, 'throttle_scope', None) or self.default_scope
+        role = getattr(request.user, 'role', 'anon')
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        return scope, rates.get(f'{scope}.{role}', rates.get(scope))
+
+    @staticmethod
+    def parse_rate(rate):
+        """Returns (number of requests, window in seconds) for '10/min'"""
+        num, period = rate.split('/')
+        return int(num), DURATIONS[period[0]]
+
+    def allow_request(self, request, view):
+        scope, rate = self.get_rate(request, view)
+        if rate is None:
+            return True
+        limit, duration = self.parse_rate(rate)
+
+        if request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        now = int(time.time() * 1000)
+        try:
+            allowed, remaining, reset = sliding_window(
+                keys=[f'throttle:{scope}:{ident}'],
+                args=[now, duration * 1000, limit, f'{now}:{uuid.uuid4().hex[:8]}'],
+                client=get_redis(),
+            )
+        except redis.RedisError:
+            # Do not fail requests when Redis is unavailable
+            logger.warning('Throttling is unavailable', exc_info=True)
+            return True
+
+        reset = max(int(reset), 0) / 1000
+        self.retry_after = reset
+        self.record_headers(request, limit, remaining, reset)
+        return bool(allowed)
+
+    @staticmethod
+    def record_headers(request, limit, remaining, reset):
+        """Keeps the most restrictive limit for RateLimitHeadersMiddleware"""
+        current = getattr(request._request, 'rate_limit', None)
+        if current is None or remaining < current['remaining']:
+            request._request.rate_limit = {
+                'limit': limit, 'remaining': remaining, 'reset': reset,
+            }
+
+    def wait(self):
+        # Used by DRF for Retry-After header
+        return self.retry_after
+
+
+class RateLimitHeadersMiddleware:
+    """
+    Adds rate limit state recorded by throttles to response headers
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit is not None:
+            response['X-RateLimit-Limit'] = rate_limit['limit']
+            response['X-RateLimit-Remaining'] = rate_limit['remaining']
+            response['X-RateLimit-Reset'] = math.ceil(rate_limit['reset'])
+        return response
@@ -14,21 +14,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
-from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
+from config.batch import BatchAPIView
+from config.schema import api_info
+from config.views import metrics_view, openapi_schema
+
+# Documentation pages only, they load OpenAPI document from 'openapi-schema'
 schema_view = get_schema_view(
-   openapi.Info(
-      title="Snippets API",
-      default_version='v1',
-      description="Test description",
-      terms_of_service="https://www.google.com/policies/terms/",
-      contact=openapi.Contact(email="contact@snippets.local"),
-      license=openapi.License(name="BSD License"),
-   ),
+   api_info,
    public=True,
    permission_classes=(permissions.AllowAny,),
 )
@@ -38,9 +37,12 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('users.urls', namespace='users')),
     path('', include('courses.urls', namespace='courses')),
+    path('batch/', BatchAPIView.as_view(), name='batch'),
+    path('metrics', metrics_view, name='metrics'),
 
     # Add documentation
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('openapi.json', openapi_schema, name='openapi-schema'),
+    path('swagger/', schema_view.with_ui('swagger', cache_timeout=60 * 60), name='schema-swagger-ui'),
+    path('redoc/', schema_view.with_ui('redoc', cache_timeout=60 * 60), name='schema-redoc'),
 
-]
+] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,52 @@
+import hashlib
+import hmac
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_safe
+
+from config import metrics
+
+
+@lru_cache(maxsize=None)
+def load_schema():
+    """
+    Returns OpenAPI document built by `generate_schema` command and its ETag.
+    Document is generated once per process if it was not built.
+    """
+    try:
+        content = settings.OPENAPI_SCHEMA_PATH.read_bytes()
+    except FileNotFoundError:
+        from config.schema import generate_schema
+        content = generate_schema()
+    return content, hashlib.sha256(content).hexdigest()
+
+
+@require_safe
+@condition(etag_func=lambda request: load_schema()[1])
+def openapi_schema(request):
+    """
+    Serves precomputed OpenAPI document for Swagger UI and Redoc
+    """
+    content, _ = load_schema()
+    response = HttpResponse(content, content_type='application/json')
+    # Clients revalidate with ETag and get 304 if schema is unchanged
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+@require_safe
+def metrics_view(request):
+    """
+    Serves metrics of web and worker processes in Prometheus text format.
+    Requires `Authorization: Bearer <METRICS_TOKEN>` if token is set.
+    """
+    if settings.METRICS_TOKEN:
+        expected = f'Bearer {settings.METRICS_TOKEN}'
+        if not hmac.compare_digest(
+                request.headers.get('Authorization', ''), expected):
+            return HttpResponseForbidden()
+    return HttpResponse(metrics.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,60 @@
+"""
+Work done by server processes before they serve the first request
+"""
+import logging
+
+from django.db import DatabaseError, connections
+from django.urls import get_resolver
+
+from config.views import load_schema
+
+logger = logging.getLogger(__name__)
+
+
+def _iter_views(patterns):
+    """Yields DRF view classes of all URL patterns"""
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            yield from _iter_views(pattern.url_patterns)
+        else:
+            view_class = getattr(pattern.callback, 'cls', None)
+            if view_class is not None:
+                yield view_class
+
+
+def preload():
+    """
+    Builds state that does not depend on connections: URL resolvers,
+    serializers and OpenAPI document. Called in server master before fork,
+    so workers share it copy-on-write.
+    """
+    resolver = get_resolver()
+    # Populates reverse lookup dictionaries of all namespaces
+    resolver.reverse_dict
+    for namespace in resolver.namespace_dict.values():
+        namespace[1].reverse_dict
+
+    for view_class in set(_iter_views(resolver.url_patterns)):
+        serializer_class = getattr(view_class, 'serializer_class', None)
+        if serializer_class is not None:
+            # Builds fields, validators and related metadata of serializer
+            serializer_class().fields
+
+    load_schema()
+    # Connections must not be shared with forked workers
+    connections.close_all()
+
+
+def warm_worker():
+    """
+    Opens database connections of WSGI worker before it accepts requests.
+    Connections are thread-local: they serve requests of sync workers,
+    which run in the main thread. Under ASGI every request runs in a thread
+    of its own (ThreadSensitiveContext of Django), so the hook is not used.
+    """
+    for alias in connections:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            logger.warning('Database %s is unavailable during warmup', alias,
+                           exc_info=True)
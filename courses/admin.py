@@ -1,3 +1,117 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db import transaction
+from django.utils import timezone
 
-# Register your models here.
+from courses import caching, entitlements, leaderboards, outbox
+from courses.counters import recompute_counters
+from courses.models import Course, Lesson, Payment, Subscription
+from courses.paginators import EstimatedCountPaginator
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Admin of tables too large for default admin: estimated counts, no
+    count of unfiltered table, autocomplete instead of FK dropdowns
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+    def get_actions(self, request):
+        # Default deletion loads every related object for confirmation
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+
+@admin.register(Course)
+class CourseAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'owner', 'lesson_count', 'subscriber_count',
+                    'revenue_total', 'updated_at')
+    list_select_related = ('owner',)
+    search_fields = ('name',)
+    autocomplete_fields = ('owner',)
+    # Counters are maintained by courses.counters
+    readonly_fields = ('lesson_count', 'subscriber_count', 'revenue_total',
+                       'updated_at', 'deleted_at')
+    actions = ('mark_deleted', 'recompute')
+
+    @admin.action(description='Delete selected courses in background')
+    @transaction.atomic
+    def mark_deleted(self, request, queryset):
+        """Hides courses with one UPDATE, deletes them as API does"""
+        rows = list(queryset.values_list('pk', 'owner_id'))
+        Course.objects.filter(pk__in=[pk for pk, _ in rows]) \
+            .update(deleted_at=timezone.now())
+        outbox.publish_many('config.tasks.purge_course',
+                            [(pk,) for pk, _ in rows])
+        keys = {caching.course_page_key(caching.ALL),
+                caching.lesson_page_key(caching.ALL)}
+        for pk, owner_id in rows:
+            keys.update((caching.course_key(pk),
+                         caching.course_page_key(owner_id)))
+        caching.invalidate(*keys)
+        # Owners, subscribers and buyers lose access without signals
+        entitlements.invalidate_courses([pk for pk, _ in rows])
+        leaderboards.remove([pk for pk, _ in rows])
+        self.message_user(request, f'{len(rows)} courses will be deleted.',
+                          messages.SUCCESS)
+
+    @admin.action(description='Recompute counters of selected courses')
+    def recompute(self, request, queryset):
+        updated = recompute_counters(queryset)
+        self.message_user(request, f'Counters of {updated} courses are '
+                                   f'recomputed.', messages.SUCCESS)
+
+
+@admin.register(Lesson)
+class LessonAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'course', 'owner')
+    list_select_related = ('course', 'owner')
+    search_fields = ('name',)
+    autocomplete_fields = ('course', 'owner')
+    readonly_fields = ('deleted_at',)
+    actions = ('mark_deleted',)
+
+    @admin.action(description='Delete selected lessons in background')
+    @transaction.atomic
+    def mark_deleted(self, request, queryset):
+        """Hides lessons with one UPDATE, deletes them as API does"""
+        rows = list(queryset.values_list('pk', 'course_id', 'owner_id',
+                                         'course__owner_id'))
+        Lesson.objects.filter(pk__in=[row[0] for row in rows]) \
+            .update(deleted_at=timezone.now())
+        # Hidden lessons are not counted
+        recompute_counters(
+            Course.objects.filter(pk__in={row[1] for row in rows})
+        )
+        outbox.publish_many('config.tasks.purge_lesson',
+                            [(row[0],) for row in rows])
+        keys = {caching.course_page_key(caching.ALL),
+                caching.lesson_page_key(caching.ALL)}
+        for _, course_id, owner_id, course_owner_id in rows:
+            keys.update((caching.course_key(course_id),
+                         caching.course_page_key(course_owner_id),
+                         caching.lesson_page_key(owner_id)))
+        caching.invalidate(*keys)
+        entitlements.invalidate_lessons([row[0] for row in rows])
+        self.message_user(request, f'{len(rows)} lessons will be deleted.',
+                          messages.SUCCESS)
+
+
+@admin.register(Payment)
+class PaymentAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'course', 'lesson', 'amount', 'type',
+                    'date_paid')
+    list_select_related = ('user', 'course', 'lesson')
+    search_fields = ('payment_id',)
+    autocomplete_fields = ('user', 'course', 'lesson')
+    # Ordered by date_paid index, without sorting by other columns
+    sortable_by = ('date_paid',)
+
+
+@admin.register(Subscription)
+class SubscriptionAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'course', 'created_at')
+    list_select_related = ('user', 'course')
+    autocomplete_fields = ('user', 'course')
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CoursesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'courses'
+
+    def ready(self):
+        # Connect signal receivers
+        from courses import (  # noqa: F401
+            caching, counters, entitlements, events, leaderboards,
+        )
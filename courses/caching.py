@@ -0,0 +1,263 @@
+"""
+Cached API representations of hot pages: course details and first pages
+of course and lesson lists per owner ('all' - list of moderators).
+
+Entries are built from the primary database, stored under versioned keys
+(see config.cache) and dropped after commit of any change that affects
+them. They can be precomputed in bulk by :func:`warm`
+(``manage.py warm_cache``).
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from config import db_router
+from config.cache import delete_versions, versioned_keys
+from courses.models import Course, Lesson, Payment, Subscription
+from courses.paginators import DefaultPaginator
+from courses.serializers import CourseSerializer, LessonSerializer
+
+# Owner of pages visible to moderators
+ALL = 'all'
+
+
+def course_key(course_id):
+    return f'course:{course_id}'
+
+
+def course_page_key(owner_id):
+    return f'courses:page1:{owner_id}'
+
+
+def lesson_page_key(owner_id):
+    return f'lessons:page1:{owner_id}'
+
+
+# Representations are built without request, so they are the same for
+# every user and host. File fields contain relative URLs, made absolute
+# per request by absolute_urls().
+URL_FIELDS = ('preview',)
+
+def serialize_courses(courses):
+    """Returns {cache key: representation} of course details"""
+    return {course_key(course.pk): CourseSerializer(course).data
+            for course in courses}
+
+
+def _course_queryset(owner_id):
+    queryset = Course.objects.prefetch_related('lessons')
+    if owner_id != ALL:
+        queryset = queryset.filter(owner_id=owner_id)
+    return queryset
+
+
+def _lesson_queryset(owner_id):
+    queryset = Lesson.objects.all()
+    if owner_id != ALL:
+        queryset = queryset.filter(owner_id=owner_id)
+    return queryset
+
+
+def _first_page(queryset, serializer_class):
+    """Same queries as DefaultPaginator does for the first page"""
+    count = queryset.count()
+    results = serializer_class(queryset[:DefaultPaginator.page_size],
+                               many=True).data
+    return {'count': count, 'results': results}
+
+
+def absolute_urls(request, data):
+    """Returns copy of cached representation with absolute file URLs"""
+    if isinstance(data, list):
+        return [absolute_urls(request, item) for item in data]
+    if isinstance(data, dict):
+        return {
+            field: request.build_absolute_uri(value)
+            if field in URL_FIELDS and value else absolute_urls(request, value)
+            for field, value in data.items()
+        }
+    return data
+
+
+def _versioned(key):
+    return versioned_keys([key], settings.PAGE_CACHE_TIMEOUT)[key]
+
+
+def _get_or_build(key, build):
+    """
+    Returns cached entry, building it on miss from the primary: replicas
+    may not have the write that dropped the previous entry yet
+    """
+    versioned = _versioned(key)
+    data = cache.get(versioned)
+    if data is None:
+        with db_router.primary_reads():
+            data = build()
+        cache.set(versioned, data, settings.PAGE_CACHE_TIMEOUT)
+    return data
+
+
+def get_cached(key):
+    """Returns current entry of key or None"""
+    return cache.get(_versioned(key))
+
+
+def _serialize_course(course):
+    if course._state.db != 'default':
+        # Loaded from a replica
+        course = Course.objects.get(pk=course.pk)
+    return CourseSerializer(course).data
+
+
+def get_course(course):
+    """Returns cached representation of course, caching it on miss"""
+    return _get_or_build(course_key(course.pk),
+                         lambda: _serialize_course(course))
+
+
+def get_cached_course(course_id):
+    """Returns cached representation of course or None"""
+    return get_cached(course_key(course_id))
+
+
+def get_course_page(owner_id):
+    """Returns first page of courses of owner"""
+    return _get_or_build(
+        course_page_key(owner_id),
+        lambda: _first_page(_course_queryset(owner_id), CourseSerializer)
+    )
+
+
+def get_lesson_page(owner_id):
+    """Returns first page of lessons of owner"""
+    return _get_or_build(
+        lesson_page_key(owner_id),
+        lambda: _first_page(_lesson_queryset(owner_id), LessonSerializer)
+    )
+
+
+# Invalidation
+
+def invalidate(*keys):
+    """
+    Drops versions of keys after commit, so entries built by concurrent
+    requests from rows that are about to change are never read
+    """
+    transaction.on_commit(lambda: delete_versions(keys))
+
+
+def _course_owner(course_id):
+    return Course.objects.filter(pk=course_id) \
+        .values_list('owner_id', flat=True).first()
+
+
+def _invalidate_course(course_id, owner_id):
+    invalidate(course_key(course_id), course_page_key(owner_id),
+                course_page_key(ALL))
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _invalidate_course(instance.pk, instance.owner_id)
+    if instance.deleted_at is not None:
+        # Lessons of deleted course are hidden as well
+        owner_ids = Lesson.all_objects.filter(course_id=instance.pk) \
+            .values_list('owner_id', flat=True).distinct()
+        invalidate(lesson_page_key(ALL),
+                    *(lesson_page_key(owner_id) for owner_id in owner_ids))
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def lesson_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Courses contain their lessons
+    _invalidate_course(instance.course_id, _course_owner(instance.course_id))
+    # Lesson moved to another course (see courses.counters)
+    moved_from = getattr(instance, '_moved_from_course_id', None)
+    if moved_from is not None:
+        _invalidate_course(moved_from, _course_owner(moved_from))
+    invalidate(lesson_page_key(instance.owner_id), lesson_page_key(ALL))
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def counters_changed(sender, instance, raw=False, **kwargs):
+    # Counters of course are changed by courses.counters
+    if not raw and instance.course_id is not None:
+        _invalidate_course(instance.course_id,
+                           _course_owner(instance.course_id))
+
+
+# Warmup
+
+def _warm_courses(course_ids):
+    courses = Course.objects.filter(pk__in=course_ids) \
+        .prefetch_related('lessons')
+    return _set_many(serialize_courses(courses))
+
+
+def _warm_pages(owner_id):
+    return _set_many({
+        course_page_key(owner_id): _first_page(_course_queryset(owner_id),
+                                               CourseSerializer),
+        lesson_page_key(owner_id): _first_page(_lesson_queryset(owner_id),
+                                               LessonSerializer),
+    })
+
+
+def _set_many(data):
+    """Stores {key: entry} under current versions, returns number of keys"""
+    keys = versioned_keys(list(data), settings.PAGE_CACHE_TIMEOUT)
+    cache.set_many({keys[key]: entry for key, entry in data.items()},
+                   settings.PAGE_CACHE_TIMEOUT)
+    return len(data)
+
+
+def _run(job, *args):
+    try:
+        return job(*args)
+    finally:
+        # Connections of this worker thread only
+        connections.close_all()
+
+
+def warm(limit=None, concurrency=None, batch_size=50):
+    """
+    Caches details of courses with most subscribers, first pages of their
+    owners and first pages of moderators.
+    Returns number of cached keys and seconds spent.
+    """
+    limit = limit or settings.CACHE_WARM_LIMIT
+    concurrency = concurrency or settings.CACHE_WARM_CONCURRENCY
+    start = time.perf_counter()
+
+    hot = list(Course.objects.order_by('-subscriber_count', 'pk')
+               .values_list('pk', 'owner_id')[:limit])
+    course_ids = [pk for pk, _ in hot]
+    owner_ids = {owner_id for _, owner_id in hot if owner_id is not None}
+
+    # Thread pool bounds number of simultaneous database queries
+    with ThreadPoolExecutor(max_workers=concurrency,
+                            thread_name_prefix='cache-warmup') as executor:
+        futures = [
+            executor.submit(_run, _warm_courses,
+                            course_ids[i:i + batch_size])
+            for i in range(0, len(course_ids), batch_size)
+        ]
+        futures += [executor.submit(_run, _warm_pages, owner_id)
+                    for owner_id in [ALL, *owner_ids]]
+        keys = sum(future.result() for future in futures)
+
+    return keys, time.perf_counter() - start
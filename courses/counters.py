@@ -0,0 +1,99 @@
+"""
+Maintains denormalized counters of :model:`courses.Course` with atomic
+F() updates on creation and deletion of lessons, subscriptions and payments,
+and on moves of lessons to other courses.
+
+Revenue counts payments for the course itself: purchases of single lessons
+have no course and are not included (see `Course.revenue_total`).
+"""
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_init, post_save, \
+    pre_save
+from django.dispatch import receiver
+
+from courses.models import Course, Lesson, Payment, Subscription
+
+
+def _change(course_id, **deltas):
+    """Adds deltas to course counters in a single UPDATE"""
+    if course_id is None:
+        return
+    Course.objects.filter(pk=course_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+
+
+@receiver(post_init, sender=Lesson)
+def lesson_loaded(sender, instance, **kwargs):
+    # Course of the stored row, without loading deferred field
+    instance._stored_course_id = instance.__dict__.get('course_id')
+
+
+@receiver(pre_save, sender=Lesson)
+def lesson_saving(sender, instance, raw=False, **kwargs):
+    # Course the lesson leaves, read by post_save receivers (courses.caching)
+    stored_course_id = instance._stored_course_id
+    instance._moved_from_course_id = None
+    if not instance._state.adding and stored_course_id is not None and \
+            stored_course_id != instance.course_id:
+        instance._moved_from_course_id = stored_course_id
+    instance._stored_course_id = instance.course_id
+
+
+@receiver(post_save, sender=Lesson)
+def lesson_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        _change(instance.course_id, lesson_count=1)
+    elif instance._moved_from_course_id is not None and \
+            instance.deleted_at is None:
+        _change(instance._moved_from_course_id, lesson_count=-1)
+        _change(instance.course_id, lesson_count=1)
+
+
+@receiver(post_delete, sender=Lesson)
+def lesson_deleted(sender, instance, **kwargs):
+    _change(instance.course_id, lesson_count=-1)
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        _change(instance.course_id, subscriber_count=1)
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(sender, instance, **kwargs):
+    _change(instance.course_id, subscriber_count=-1)
+
+
+@receiver(post_save, sender=Payment)
+def payment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        _change(instance.course_id, revenue_total=instance.amount)
+
+
+@receiver(post_delete, sender=Payment)
+def payment_deleted(sender, instance, **kwargs):
+    _change(instance.course_id, revenue_total=-instance.amount)
+
+
+def recompute_counters(queryset):
+    """
+    Recomputes counters of courses in queryset with one UPDATE statement.
+    Returns number of updated courses.
+    """
+    lessons = Lesson.objects.filter(course=OuterRef('pk')).order_by() \
+        .values('course').annotate(total=Count('pk')).values('total')
+    subscribers = Subscription.objects.filter(course=OuterRef('pk')) \
+        .order_by().values('course').annotate(total=Count('pk')) \
+        .values('total')
+    revenue = Payment.objects.filter(course=OuterRef('pk')).order_by() \
+        .values('course').annotate(total=Sum('amount')).values('total')
+    return queryset.order_by().update(
+        lesson_count=Coalesce(Subquery(lessons), 0),
+        subscriber_count=Coalesce(Subquery(subscribers), 0),
+        revenue_total=Coalesce(Subquery(revenue), 0),
+    )
@@ -0,0 +1,104 @@
+"""
+Background deletion of courses and lessons.
+
+Views only mark objects deleted (they are hidden by default managers at
+once); Celery tasks remove related rows in keyset chunks, each chunk in
+its own short transaction, so locks are held briefly and memory does not
+depend on number of rows.
+
+Rows are deleted without signals: counters of the course are recomputed
+once at the end instead of per row, entitlements of subscribers and buyers
+and leaderboards are updated after each chunk of their rows.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from courses import entitlements, leaderboards
+from courses.counters import recompute_counters
+from courses.models import Course, CourseUpdateEvent, Lesson, Payment, \
+    Subscription
+
+
+def _delete_in_chunks(queryset, chunk_size, progress, deleted_for=None):
+    """
+    Deletes rows of queryset, returns number of deleted rows.
+    deleted_for(user ids) replaces post_delete receivers of subscriptions
+    and payments, it is called in transaction of every chunk.
+    """
+    model = queryset.model
+    fields = ('pk', 'user_id') if deleted_for else ('pk',)
+    deleted = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            rows = list(queryset.filter(pk__gt=last_pk).order_by('pk')
+                        .values_list(*fields)[:chunk_size])
+            if not rows:
+                return deleted
+            deleted += model._base_manager \
+                .filter(pk__in=[row[0] for row in rows]) \
+                ._raw_delete(DEFAULT_DB_ALIAS)
+            if deleted_for:
+                deleted_for({row[1] for row in rows})
+        last_pk = rows[-1][0]
+        progress(model._meta.label, deleted)
+
+
+def _purge(steps, chunk_size, progress):
+    """Deletes rows of (queryset, deleted_for or None) steps in order"""
+    chunk_size = chunk_size or settings.PURGE_CHUNK_SIZE
+    progress = progress or (lambda model, deleted: None)
+    return sum(_delete_in_chunks(queryset, chunk_size, progress, deleted_for)
+               for queryset, deleted_for in steps)
+
+
+def _users_of_course(course_id):
+    def deleted_for(user_ids):
+        entitlements.invalidate_users(user_ids)
+        # Scores are not decreased, the course leaves leaderboards
+        leaderboards.remove([course_id])
+    return deleted_for
+
+
+def purge_course(course_id, chunk_size=None, progress=None):
+    """
+    Deletes course marked for deletion with its subscriptions, payments,
+    lessons and update events of digests. progress(model label, deleted
+    rows) is called after every chunk. Returns total number of deleted
+    rows.
+    """
+    course = Course.all_objects.filter(pk=course_id,
+                                       deleted_at__isnull=False)
+    if not course.exists():
+        return 0
+    # Payments reference lessons, so they are deleted first
+    deleted_for = _users_of_course(course_id)
+    return _purge((
+        (Subscription.objects.filter(course_id=course_id), deleted_for),
+        (Payment.objects.filter(course_id=course_id), deleted_for),
+        (Payment.objects.filter(lesson__course_id=course_id),
+         entitlements.invalidate_users),
+        (Lesson.all_objects.filter(course_id=course_id), None),
+        (CourseUpdateEvent.objects.filter(course_id=course_id), None),
+        (course, None),
+    ), chunk_size, progress)
+
+
+def purge_lesson(lesson_id, chunk_size=None, progress=None):
+    """
+    Deletes lesson marked for deletion with its payments.
+    Returns total number of deleted rows.
+    """
+    lesson = Lesson.all_objects.filter(pk=lesson_id,
+                                       deleted_at__isnull=False)
+    course_id = lesson.values_list('course_id', flat=True).first()
+    if course_id is None:
+        return 0
+    deleted = _purge((
+        (Payment.objects.filter(lesson_id=lesson_id),
+         entitlements.invalidate_users),
+        (lesson, None),
+    ), chunk_size, progress)
+    # Lesson is no longer counted (payments for lessons are not revenue)
+    recompute_counters(Course.objects.filter(pk=course_id))
+    return deleted
@@ -0,0 +1,169 @@
+"""
+Courses and lessons of a user: subscribed and purchased. Owners are
+checked on loaded objects (see courses.permissions), so a change of owner
+never leaves a stale grant.
+
+Ids are loaded from the primary with one query, cached per user as
+compact arrays under a versioned key (ENTITLEMENT_CACHE_TIMEOUT, see
+config.cache) and kept on the request for the rest of it, so views check
+access without queries. Cached entitlements are dropped after commit of
+any change of them.
+"""
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import CharField, Value
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from config import db_router
+from config.cache import delete_versions, versioned_keys
+from courses.models import Course, Lesson, Payment, Subscription
+
+SUBSCRIBED_COURSES = 'subscribed_courses'
+PURCHASED_COURSES = 'purchased_courses'
+PURCHASED_LESSONS = 'purchased_lessons'
+KINDS = (SUBSCRIBED_COURSES, PURCHASED_COURSES, PURCHASED_LESSONS)
+
+
+def entitlements_key(user_id):
+    return f'entitlements:{user_id}'
+
+
+class Entitlements:
+    """Sets of ids by kind of access"""
+
+    def __init__(self, ids=None):
+        ids = ids or {}
+        for kind in KINDS:
+            setattr(self, kind, frozenset(ids.get(kind, ())))
+
+    def is_subscribed(self, course_id):
+        return course_id in self.subscribed_courses
+
+    def has_purchased(self, course_id):
+        return course_id in self.purchased_courses
+
+
+def _kind(queryset, kind, field):
+    return queryset.order_by() \
+        .annotate(kind=Value(kind, output_field=CharField())) \
+        .values_list('kind', field)
+
+
+def load(user_id):
+    """Returns {kind: array of ids} of user read with one UNION query"""
+    purchases = Payment.objects.filter(user_id=user_id)
+    queries = (
+        _kind(Subscription.objects.filter(user_id=user_id,
+                                          course__deleted_at__isnull=True),
+              SUBSCRIBED_COURSES, 'course_id'),
+        _kind(purchases.filter(course__isnull=False,
+                               course__deleted_at__isnull=True),
+              PURCHASED_COURSES, 'course_id'),
+        _kind(purchases.filter(lesson__isnull=False,
+                               lesson__deleted_at__isnull=True,
+                               lesson__course__deleted_at__isnull=True),
+              PURCHASED_LESSONS, 'lesson_id'),
+    )
+    ids = {kind: array('q') for kind in KINDS}
+    for kind, object_id in queries[0].union(*queries[1:], all=True):
+        ids[kind].append(object_id)
+    return ids
+
+
+def for_user(user):
+    """Returns entitlements of user"""
+    if not user.is_authenticated:
+        return Entitlements()
+    key = entitlements_key(user.pk)
+    versioned = versioned_keys([key], settings.ENTITLEMENT_CACHE_TIMEOUT)[key]
+    ids = cache.get(versioned)
+    if ids is None:
+        # Replicas may not have the change that dropped previous entry yet
+        with db_router.primary_reads():
+            ids = load(user.pk)
+        cache.set(versioned, ids, settings.ENTITLEMENT_CACHE_TIMEOUT)
+    return Entitlements(ids)
+
+
+def for_request(request):
+    """Returns entitlements of request user, loaded once per request"""
+    entitlements = getattr(request, '_entitlements', None)
+    if entitlements is None:
+        entitlements = request._entitlements = for_user(request.user)
+    return entitlements
+
+
+# Invalidation
+
+def _invalidate(*user_ids):
+    """Drops entitlements after commit (see courses.caching)"""
+    keys = [entitlements_key(user_id) for user_id in user_ids
+            if user_id is not None]
+    if keys:
+        transaction.on_commit(lambda: delete_versions(keys))
+
+
+def _course_users(course_ids):
+    """Subscribers and buyers of courses and their lessons"""
+    return Subscription.objects.filter(course_id__in=course_ids) \
+        .order_by().values_list('user_id', flat=True).union(
+            Payment.objects.filter(course_id__in=course_ids)
+            .order_by().values_list('user_id', flat=True),
+            Payment.objects.filter(lesson__course_id__in=course_ids)
+            .order_by().values_list('user_id', flat=True),
+        )
+
+
+def _lesson_users(lesson_ids):
+    """Buyers of lessons"""
+    return Payment.objects.filter(lesson_id__in=lesson_ids).order_by() \
+        .values_list('user_id', flat=True)
+
+
+def invalidate_users(user_ids):
+    """
+    Drops entitlements of users after commit, for rows deleted without
+    signals (see courses.deletion)
+    """
+    _invalidate(*user_ids)
+
+
+def invalidate_courses(course_ids):
+    """
+    Drops entitlements of users of courses after commit, for changes made
+    without signals (bulk updates of admin)
+    """
+    _invalidate(*_course_users(course_ids))
+
+
+def invalidate_lessons(lesson_ids):
+    """Drops entitlements of users of lessons after commit (bulk updates)"""
+    _invalidate(*_lesson_users(lesson_ids))
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_changed(sender, instance, raw=False, **kwargs):
+    if not raw and instance.deleted_at is not None:
+        # Subscribers and buyers lose access to deleted course
+        invalidate_courses([instance.pk])
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def lesson_changed(sender, instance, raw=False, **kwargs):
+    if not raw and instance.deleted_at is not None:
+        invalidate_lessons([instance.pk])
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def access_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _invalidate(instance.user_id)
@@ -0,0 +1,121 @@
+"""
+Events of courses delivered to subscribers by Server-Sent Events
+(see courses.stream).
+
+Events are appended to a capped Redis stream, which gives them ordered
+ids and serves as replay buffer for reconnecting clients, and published
+to the pub/sub channel of the course, so the web process holding the
+subscriber's connection delivers them at once. Both happen after commit.
+"""
+import json
+import logging
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from config.redis_client import get_redis
+from courses.models import Course, Lesson, Subscription
+
+logger = logging.getLogger(__name__)
+
+STREAM = 'events:stream'
+
+
+def course_channel(course_id):
+    return f'events:course:{course_id}'
+
+
+def user_channel(user_id):
+    """Channel of control messages of user's connections"""
+    return f'events:user:{user_id}'
+
+
+def parse_id(event_id):
+    """Returns stream id as comparable tuple, None if id is invalid"""
+    milliseconds, _, sequence = str(event_id).partition('-')
+    try:
+        return int(milliseconds), int(sequence or 0)
+    except ValueError:
+        return None
+
+
+def _send(course_id, event):
+    try:
+        client = get_redis()
+        event_id = client.xadd(STREAM, {'event': json.dumps(event)},
+                               maxlen=settings.EVENT_REPLAY_SIZE,
+                               approximate=True)
+        client.publish(course_channel(course_id),
+                       json.dumps({'id': event_id.decode(), **event}))
+    except redis.RedisError:
+        # Clients still see changes in API responses
+        logger.warning('Event %s of course %s is not sent', event['type'],
+                       course_id, exc_info=True)
+
+
+def publish(event_type, course_id, **data):
+    """Sends event to subscribers of course once transaction commits"""
+    event = {'type': event_type, 'course': course_id, **data}
+    transaction.on_commit(lambda: _send(course_id, event))
+
+
+def replay(last_id, course_ids, count=None):
+    """
+    Returns (events after last_id of given courses, complete), where
+    complete is False if older events were already evicted from buffer
+    """
+    client = get_redis()
+    oldest = client.xrange(STREAM, count=1)
+    complete = not oldest or \
+        parse_id(oldest[0][0].decode()) <= parse_id(last_id)
+    events = []
+    entries = client.xrange(STREAM, min=f'({last_id}', max='+',
+                            count=count or settings.EVENT_REPLAY_SIZE)
+    for event_id, fields in entries:
+        event = json.loads(fields[b'event'])
+        if event['course'] in course_ids:
+            events.append({'id': event_id.decode(), **event})
+    return events, complete
+
+
+@receiver(post_save, sender=Course)
+def course_saved(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    if instance.deleted_at is not None:
+        publish('course.deleted', instance.pk)
+    else:
+        publish('course.updated', instance.pk)
+
+
+@receiver(post_save, sender=Lesson)
+def lesson_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        event_type = 'lesson.created'
+    elif instance.deleted_at is not None:
+        event_type = 'lesson.deleted'
+    else:
+        event_type = 'lesson.updated'
+    publish(event_type, instance.course_id, lesson=instance.pk)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def subscriptions_changed(sender, instance, raw=False, **kwargs):
+    """Makes open connections of user reload subscribed courses"""
+    if raw or instance.user_id is None:
+        return
+
+    def send():
+        try:
+            get_redis().publish(user_channel(instance.user_id),
+                                json.dumps({'type': 'subscriptions'}))
+        except redis.RedisError:
+            logger.warning('Subscriptions of user %s are not reloaded',
+                           instance.user_id, exc_info=True)
+    transaction.on_commit(send)
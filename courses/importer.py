@@ -0,0 +1,342 @@
+"""
+Bulk import of legacy data into PostgreSQL.
+
+Input rows are streamed into a temporary staging table with ``COPY``,
+foreign keys are resolved with joins and rows are upserted into the real
+tables with one ``INSERT ... SELECT`` per file. Users are matched by email,
+other objects keep their legacy ids. Partitions of months of imported
+payments are created before the insert (see courses.partitions).
+"""
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+from dataclasses import dataclass
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from courses import partitions
+from courses.counters import recompute_counters
+from courses.models import Course, Lesson, Payment, Subscription
+from users.models import User
+
+
+@dataclass
+class Entity:
+    """Description of one importable file"""
+    # Columns of staging table (all text) in input order
+    columns: tuple
+    # INSERT ... SELECT from staging table {staging}
+    upsert: str
+    # Models whose primary keys come from input
+    sequences: tuple = ()
+    # Staging column with ids of courses whose counters change
+    course_column: str = None
+    # Staging column with dates of monthly partitions
+    partition_column: str = None
+    # DELETE of rows whose partition key changes, RETURNING their course ids
+    delete_moved: str = None
+
+
+TABLES = {
+    'user': User._meta.db_table,
+    'course': Course._meta.db_table,
+    'lesson': Lesson._meta.db_table,
+    'payment': Payment._meta.db_table,
+    'subscription': Subscription._meta.db_table,
+}
+
+ENTITIES = {
+    'users': Entity(
+        columns=('email', 'password', 'first_name', 'last_name', 'phone',
+                 'city', 'role', 'is_active', 'date_joined'),
+        # Staff flags are never imported. Credentials, role and activity of
+        # existing accounts are kept, only their profile is updated.
+        upsert="""
+            INSERT INTO {user} (email, password, first_name, last_name,
+                                phone, city, role, is_active, is_staff,
+                                is_superuser, date_joined)
+            SELECT DISTINCT ON (s.email)
+                s.email, s.password, COALESCE(s.first_name, ''),
+                COALESCE(s.last_name, ''), s.phone, s.city,
+                COALESCE(s.role, 'member'),
+                COALESCE(s.is_active::boolean, true), false, false,
+                COALESCE(s.date_joined::timestamptz, now())
+            FROM {staging} s
+            WHERE s.email IS NOT NULL
+            ORDER BY s.email, s.line DESC
+            ON CONFLICT (email) DO UPDATE SET
+                first_name = EXCLUDED.first_name,
+                last_name = EXCLUDED.last_name,
+                phone = EXCLUDED.phone,
+                city = EXCLUDED.city
+        """,
+    ),
+    'courses': Entity(
+        columns=('id', 'name', 'description', 'preview', 'owner_email',
+                 'updated_at'),
+        upsert="""
+            INSERT INTO {course} (id, name, description, preview, owner_id,
+                                  updated_at, lesson_count, subscriber_count,
+                                  revenue_total)
+            SELECT DISTINCT ON (s.id::bigint)
+                s.id::bigint, s.name, COALESCE(s.description, ''),
+                s.preview, u.id, s.updated_at::timestamptz, 0, 0, 0
+            FROM {staging} s
+            LEFT JOIN {user} u ON u.email = s.owner_email
+            WHERE s.id IS NOT NULL
+            ORDER BY s.id::bigint, s.line DESC
+            ON CONFLICT (id) DO UPDATE SET
+                name = EXCLUDED.name,
+                description = EXCLUDED.description,
+                preview = EXCLUDED.preview,
+                owner_id = EXCLUDED.owner_id,
+                updated_at = EXCLUDED.updated_at
+        """,
+        sequences=(Course,),
+        course_column='id',
+    ),
+    'lessons': Entity(
+        columns=('id', 'name', 'description', 'preview', 'video_url',
+                 'course_id', 'owner_email'),
+        upsert="""
+            INSERT INTO {lesson} (id, name, description, preview, video_url,
+                                  course_id, owner_id)
+            SELECT DISTINCT ON (s.id::bigint)
+                s.id::bigint, s.name, COALESCE(s.description, ''),
+                s.preview, s.video_url, c.id, u.id
+            FROM {staging} s
+            JOIN {course} c ON c.id = s.course_id::bigint
+            LEFT JOIN {user} u ON u.email = s.owner_email
+            WHERE s.id IS NOT NULL
+            ORDER BY s.id::bigint, s.line DESC
+            ON CONFLICT (id) DO UPDATE SET
+                name = EXCLUDED.name,
+                description = EXCLUDED.description,
+                preview = EXCLUDED.preview,
+                video_url = EXCLUDED.video_url,
+                course_id = EXCLUDED.course_id,
+                owner_id = EXCLUDED.owner_id
+        """,
+        sequences=(Lesson,),
+        course_column='course_id',
+    ),
+    'subscriptions': Entity(
+        columns=('course_id', 'user_email'),
+        # Subscriptions have no unique constraint, existing are skipped
+        upsert="""
+            INSERT INTO {subscription} (course_id, user_id)
+            SELECT DISTINCT c.id, u.id
+            FROM {staging} s
+            JOIN {course} c ON c.id = s.course_id::bigint
+            JOIN {user} u ON u.email = s.user_email
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {subscription} x
+                WHERE x.course_id = c.id AND x.user_id = u.id
+            )
+        """,
+        course_column='course_id',
+    ),
+    'payments': Entity(
+        columns=('id', 'user_email', 'date_paid', 'course_id', 'lesson_id',
+                 'amount', 'type', 'payment_id'),
+        upsert="""
+            INSERT INTO {payment} (id, user_id, date_paid, course_id,
+                                   lesson_id, amount, type, payment_id)
+            SELECT DISTINCT ON (s.id::bigint)
+                s.id::bigint, u.id, s.date_paid::timestamptz, c.id, l.id,
+                s.amount::integer, s.type, s.payment_id
+            FROM {staging} s
+            LEFT JOIN {user} u ON u.email = s.user_email
+            LEFT JOIN {course} c ON c.id = s.course_id::bigint
+            LEFT JOIN {lesson} l ON l.id = s.lesson_id::bigint
+            WHERE s.id IS NOT NULL AND s.amount IS NOT NULL
+                AND s.date_paid IS NOT NULL
+            ORDER BY s.id::bigint, s.line DESC
+            -- Primary key includes partition key (see courses.partitions)
+            ON CONFLICT (id, date_paid) DO UPDATE SET
+                user_id = EXCLUDED.user_id,
+                course_id = EXCLUDED.course_id,
+                lesson_id = EXCLUDED.lesson_id,
+                amount = EXCLUDED.amount,
+                type = EXCLUDED.type,
+                payment_id = EXCLUDED.payment_id
+        """,
+        sequences=(Payment,),
+        course_column='course_id',
+        partition_column='date_paid',
+        # Unique constraint includes date_paid: payment with corrected date
+        # would be inserted again instead of updated
+        delete_moved="""
+            DELETE FROM {payment} p USING {staging} s
+            WHERE p.id = s.id::bigint
+                AND p.date_paid <> s.date_paid::timestamptz
+            RETURNING p.course_id
+        """,
+    ),
+}
+
+
+# Reading input
+
+def read_rows(file, format):
+    """Yields input rows as dictionaries, one at a time"""
+    if format == 'csv':
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _text(value):
+    """Converts input value to text of staging column"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+class CopyStream:
+    """
+    File-like object producing CSV for COPY from an iterator of rows,
+    so only a small buffer is kept in memory
+    """
+
+    def __init__(self, rows, columns):
+        self._rows = rows
+        self._columns = columns
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._pending = ''
+        self.count = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            # Empty unquoted values are NULL for COPY
+            self._writer.writerow(
+                ['' if value is None else value for value in
+                 (_text(row.get(column)) for column in self._columns)]
+            )
+            self.count += 1
+            if self._buffer.tell() >= 65536:
+                self._flush()
+        self._flush()
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def _flush(self):
+        self._pending += self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+
+# Password hashing
+
+def _init_worker(settings_module):
+    # Workers started with 'spawn' have no configured settings
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def _hash(password):
+    # Empty passwords become unusable
+    return make_password(password or None)
+
+
+def hash_passwords(rows, pool, batch_size, chunksize=1):
+    """
+    Replaces plain text passwords with hashes, computing them in
+    the process pool one bounded batch at a time. Column password_hash
+    is taken as is.
+    """
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        plain = [row for row in batch if not row.get('password_hash')]
+        hashes = pool.map(_hash, [row.get('password') for row in plain],
+                          chunksize=chunksize)
+        for row, password in zip(plain, hashes):
+            row['password'] = password
+        for row in batch:
+            if row.get('password_hash'):
+                row['password'] = row['password_hash']
+            yield row
+
+
+def create_pool(processes):
+    return multiprocessing.Pool(
+        processes, initializer=_init_worker,
+        initargs=(os.environ.get('DJANGO_SETTINGS_MODULE'),)
+    )
+
+
+# Loading
+
+def load(name, rows):
+    """
+    Loads rows of entity, must be called inside a transaction.
+    Returns numbers of read and written rows.
+    """
+    entity = ENTITIES[name]
+    staging = f'import_{name}'
+    stream = CopyStream(iter(rows), entity.columns)
+    with connection.cursor() as cursor:
+        columns = ', '.join(f'{column} text' for column in entity.columns)
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE {staging} '
+            f'(line bigserial, {columns}) ON COMMIT DROP'
+        )
+        cursor.cursor.copy_expert(
+            f'COPY {staging} ({", ".join(entity.columns)}) '
+            f'FROM STDIN WITH (FORMAT csv)',
+            stream,
+        )
+        cursor.execute(f'ANALYZE {staging}')
+        if entity.partition_column and partitions.is_partitioned():
+            # Historical rows would all go to the default partition
+            cursor.execute(
+                f"SELECT DISTINCT date_trunc('month', "
+                f"{entity.partition_column}::timestamptz AT TIME ZONE 'UTC')"
+                f"::date FROM {staging} "
+                f"WHERE {entity.partition_column} IS NOT NULL"
+            )
+            partitions.add_partitions(row[0] for row in cursor.fetchall())
+        moved_courses = set()
+        if entity.delete_moved:
+            cursor.execute(entity.delete_moved.format(staging=staging,
+                                                      **TABLES))
+            moved_courses = {row[0] for row in cursor.fetchall()} - {None}
+        cursor.execute(entity.upsert.format(staging=staging, **TABLES))
+        written = cursor.rowcount
+
+        # Legacy ids were inserted bypassing sequences
+        for sql in connection.ops.sequence_reset_sql(no_style(),
+                                                     entity.sequences):
+            cursor.execute(sql)
+
+    if entity.course_column:
+        # Counters are not maintained by signals during import
+        recompute_counters(Course.objects.filter(Q(pk__in=RawSQL(
+            f'SELECT DISTINCT {entity.course_column}::bigint '
+            f'FROM {staging}', []
+        )) | Q(pk__in=moved_courses)))
+    with connection.cursor() as cursor:
+        # Entity can be loaded again in the same transaction
+        cursor.execute(f'DROP TABLE {staging}')
+    return stream.count, written
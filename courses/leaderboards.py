@@ -0,0 +1,249 @@
+"""
+Leaderboards of courses by subscribers and revenue, kept in Redis
+sorted sets (course id -> score).
+
+Subscriptions and payments are added to the all-time set and to the set
+of their day once transaction commits. Rolling windows are unions of the
+sets of their days (LEADERBOARD_WINDOWS), merged on first read and reused
+for LEADERBOARD_MERGE_SECONDS. Subscriber windows count net new
+subscriptions: an unsubscription is subtracted from the day of its
+subscription. Revenue counts purchases of courses only, as
+`Course.revenue_total` does: payments for single lessons are left out.
+
+Deleted courses leave all sets once deletion commits. Changes made
+without signals (bulk import) and lost updates are fixed by periodic
+`rebuild` from the database.
+"""
+import datetime
+import logging
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from config.redis_client import get_redis
+from courses.models import Course, Payment, Subscription
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBERS = 'subscribers'
+REVENUE = 'revenue'
+BOARDS = (SUBSCRIBERS, REVENUE)
+ALL_TIME = 'all'
+
+
+def all_time_key(board):
+    return f'leaderboard:{board}:{ALL_TIME}'
+
+
+def day_key(board, day):
+    return f'leaderboard:{board}:day:{day:%Y%m%d}'
+
+
+def window_key(board, window, day):
+    """Key of window set merged on day"""
+    return f'leaderboard:{board}:{window}:{day:%Y%m%d}'
+
+
+def retention_days():
+    """Days of the longest window, older daily sets expire"""
+    return max(settings.LEADERBOARD_WINDOWS.values())
+
+
+def windows():
+    return (*settings.LEADERBOARD_WINDOWS, ALL_TIME)
+
+
+def _expire_at(day):
+    """Timestamp when daily set leaves the longest window"""
+    end = datetime.datetime.combine(
+        day + datetime.timedelta(days=retention_days() + 1),
+        datetime.time(), tzinfo=timezone.get_current_timezone()
+    )
+    return int(end.timestamp())
+
+
+def _add(board, course_id, amount, moment):
+    if course_id is None:
+        return
+    keys = [all_time_key(board)]
+    day = timezone.localdate(moment) if moment else None
+    oldest = timezone.localdate() - \
+        datetime.timedelta(days=retention_days() - 1)
+    if day is not None and day >= oldest:
+        keys.append(day_key(board, day))
+    try:
+        pipeline = get_redis().pipeline()
+        for key in keys:
+            pipeline.zincrby(key, amount, course_id)
+            # Courses without subscribers leave leaderboard
+            pipeline.zremrangebyscore(key, '-inf', 0)
+        if len(keys) > 1:
+            pipeline.expireat(keys[1], _expire_at(day))
+        pipeline.execute()
+    except redis.RedisError:
+        # Leaderboard is fixed by the next rebuild
+        logger.warning('Leaderboard %s of course %s is not updated', board,
+                       course_id, exc_info=True)
+
+
+def add(board, course_id, amount, moment=None):
+    """Adds amount to score of course once transaction commits"""
+    transaction.on_commit(lambda: _add(board, course_id, amount, moment))
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        add(SUBSCRIBERS, instance.course_id, 1, instance.created_at)
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(sender, instance, **kwargs):
+    add(SUBSCRIBERS, instance.course_id, -1, instance.created_at)
+
+
+@receiver(post_save, sender=Payment)
+def payment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        add(REVENUE, instance.course_id, instance.amount, instance.date_paid)
+
+
+@receiver(post_delete, sender=Payment)
+def payment_deleted(sender, instance, **kwargs):
+    add(REVENUE, instance.course_id, -instance.amount, instance.date_paid)
+
+
+def _remove(course_ids):
+    today = timezone.localdate()
+    keys = [all_time_key(board) for board in BOARDS]
+    for board in BOARDS:
+        keys += [day_key(board, today - datetime.timedelta(days=n))
+                 for n in range(retention_days())]
+        keys += [window_key(board, window, today)
+                 for window in settings.LEADERBOARD_WINDOWS]
+    try:
+        pipeline = get_redis().pipeline()
+        for key in keys:
+            pipeline.zrem(key, *course_ids)
+        pipeline.execute()
+    except redis.RedisError:
+        logger.warning('Courses %s are not removed from leaderboards',
+                       course_ids, exc_info=True)
+
+
+def remove(course_ids):
+    """Removes courses from all sets once transaction commits"""
+    course_ids = list(course_ids)
+    if course_ids:
+        transaction.on_commit(lambda: _remove(course_ids))
+
+
+@receiver(post_save, sender=Course)
+def course_saved(sender, instance, raw=False, **kwargs):
+    # Deleted courses are hidden at once (see courses.deletion)
+    if not raw and instance.deleted_at is not None:
+        remove([instance.pk])
+
+
+def rebuild():
+    """
+    Replaces all-time and daily sets with scores computed by the
+    database. Returns number of written sets.
+    """
+    today = timezone.localdate()
+    oldest = today - datetime.timedelta(days=retention_days() - 1)
+    sources = {
+        SUBSCRIBERS: (Subscription.objects, 'created_at', Count('pk')),
+        REVENUE: (Payment.objects, 'date_paid', Sum('amount')),
+    }
+
+    sets = {}
+    for board, (manager, date_field, total) in sources.items():
+        # Soft-deleted courses are not shown, lesson payments have no course
+        queryset = manager.filter(course__isnull=False,
+                                  course__deleted_at__isnull=True).order_by()
+        sets[all_time_key(board)] = {
+            row['course']: row['total']
+            for row in queryset.values('course').annotate(total=total)
+        }
+        day = oldest
+        while day <= today:
+            sets[day_key(board, day)] = {}
+            day += datetime.timedelta(days=1)
+        rows = queryset.filter(**{f'{date_field}__date__gte': oldest}) \
+            .annotate(day=TruncDate(date_field)) \
+            .values('course', 'day').annotate(total=total)
+        for row in rows:
+            sets[day_key(board, row['day'])][row['course']] = row['total']
+
+    # Replaced at once, readers never see partially written sets
+    pipeline = get_redis().pipeline(transaction=True)
+    for key, scores in sets.items():
+        pipeline.delete(key)
+        scores = {course: score for course, score in scores.items()
+                  if score > 0}
+        if scores:
+            pipeline.zadd(key, scores)
+            if ':day:' in key:
+                day = datetime.datetime.strptime(key.rsplit(':', 1)[1],
+                                                 '%Y%m%d').date()
+                pipeline.expireat(key, _expire_at(day))
+    pipeline.execute()
+    return len(sets)
+
+
+class Leaderboard:
+    """
+    Courses of leaderboard window sorted by score, as sequence of
+    (course id, score) read page by page by paginators
+    """
+
+    def __init__(self, board, window):
+        self.board = board
+        self.window = window
+        self._key = None
+
+    @property
+    def key(self):
+        if self._key is None:
+            self._key = self.merge()
+        return self._key
+
+    def merge(self):
+        """Returns key of the window set, merging daily sets if needed"""
+        if self.window == ALL_TIME:
+            return all_time_key(self.board)
+        today = timezone.localdate()
+        key = window_key(self.board, self.window, today)
+        client = get_redis()
+        if not client.exists(key):
+            days = [day_key(self.board, today - datetime.timedelta(days=n))
+                    for n in range(settings.LEADERBOARD_WINDOWS[self.window])]
+            pipeline = client.pipeline(transaction=True)
+            pipeline.zunionstore(key, days)
+            pipeline.expire(key, settings.LEADERBOARD_MERGE_SECONDS)
+            pipeline.execute()
+        return key
+
+    def count(self):
+        return get_redis().zcard(self.key)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError('Leaderboard supports only slices')
+        start = index.start or 0
+        stop = self.count() if index.stop is None else index.stop
+        if stop <= start:
+            return []
+        return [(int(member), score) for member, score in
+                get_redis().zrevrange(self.key, start, stop - 1,
+                                      withscores=True)]
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from config.schema import generate_schema
+
+
+class Command(BaseCommand):
+    """
+    Generates OpenAPI document at build time, so it is not regenerated
+    on requests to documentation
+    """
+    help = 'Generates OpenAPI document into OPENAPI_SCHEMA_PATH'
+
+    def handle(self, *args, **options):
+        path = settings.OPENAPI_SCHEMA_PATH
+        path.parent.mkdir(parents=True, exist_ok=True)
+        content = generate_schema()
+        path.write_bytes(content)
+        self.stdout.write(f'OpenAPI document ({len(content)} bytes) saved to {path}')
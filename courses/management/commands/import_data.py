@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from courses import importer
+
+
+class Command(BaseCommand):
+    """
+    Imports users, courses, lessons, subscriptions or payments of legacy
+    system from CSV or NDJSON file (one JSON object per line).
+
+    Files should be imported in order: users, courses, lessons, then
+    subscriptions and payments. Related users are referenced by email
+    (owner_email, user_email), other objects - by legacy ids. Existing
+    users keep their password, role and activity, only profile fields are
+    updated.
+    """
+    help = 'Bulk imports legacy data with PostgreSQL COPY'
+
+    def add_arguments(self, parser):
+        parser.add_argument('entity', choices=tuple(importer.ENTITIES))
+        parser.add_argument('path', help='Input file, "-" for stdin')
+        parser.add_argument('--format', choices=('csv', 'ndjson'),
+                            help='Input format (default: by file extension)')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help='Processes hashing passwords of users')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Passwords hashed at once')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('import_data requires PostgreSQL')
+
+        path = options['path']
+        format = options['format']
+        if format is None:
+            format = 'csv' if path.endswith('.csv') else 'ndjson'
+
+        start = time.perf_counter()
+        pool = None
+        if path == '-':
+            file = sys.stdin
+        else:
+            file = open(path, newline='', encoding='utf-8')
+        try:
+            rows = importer.read_rows(file, format)
+            if options['entity'] == 'users':
+                pool = importer.create_pool(options['processes'])
+                rows = importer.hash_passwords(
+                    rows, pool, options['batch_size'],
+                    chunksize=max(options['batch_size']
+                                  // (options['processes'] * 4), 1),
+                )
+            with transaction.atomic():
+                read, written = importer.load(options['entity'], rows)
+        finally:
+            if pool is not None:
+                pool.terminate()
+            if file is not sys.stdin:
+                file.close()
+
+        self.stdout.write(
+            f'{read} rows read, {written} written, '
+            f'{read - written} skipped (duplicates or unknown references) '
+            f'in {time.perf_counter() - start:.2f} s'
+        )
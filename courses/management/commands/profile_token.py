@@ -0,0 +1,14 @@
+from django.core.management import BaseCommand
+
+from config import profiling
+
+
+class Command(BaseCommand):
+    """
+    Prints token profiling requests that carry it in X-Profile header
+    or _profile query parameter
+    """
+    help = 'Creates token for request profiling'
+
+    def handle(self, *args, **options):
+        self.stdout.write(profiling.make_token())
@@ -0,0 +1,30 @@
+from django.core.management import BaseCommand
+
+from courses.counters import recompute_counters
+from courses.models import Course
+
+
+class Command(BaseCommand):
+    """
+    Recomputes lesson, subscriber and revenue counters of courses
+    from related tables, in batches of courses
+    """
+    help = 'Recomputes denormalized counters of courses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of courses updated per statement')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        last_pk = 0
+        while True:
+            # Keyset pagination keeps each UPDATE short
+            pks = list(Course.objects.filter(pk__gt=last_pk).order_by('pk')
+                       .values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            updated += recompute_counters(Course.objects.filter(pk__in=pks))
+            last_pk = pks[-1]
+        self.stdout.write(f'Counters of {updated} courses recomputed')
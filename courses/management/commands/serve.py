@@ -0,0 +1,81 @@
+import multiprocessing
+
+from django.core.management import BaseCommand, CommandError
+
+from config import warmup
+
+
+class Command(BaseCommand):
+    """
+    Runs the project under gunicorn.
+
+    Application and URLconf are loaded in the master process before fork,
+    so memory is shared between workers copy-on-write. WSGI workers open
+    their database connections before accepting requests. ASGI workers do
+    not: Django runs every request there in a new thread with its own
+    connections, so connections of the worker would never be used.
+
+    `kill -HUP <master pid>` replaces workers gracefully: old workers finish
+    in-flight requests (up to --graceful-timeout seconds). As application is
+    preloaded, new code is picked up by `kill -USR2 <master pid>` followed
+    by `kill -QUIT <old master pid>`.
+    """
+    help = 'Runs the project under gunicorn with preloaded and warmed up workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interface', choices=('wsgi', 'asgi'),
+                            default='wsgi',
+                            help='Serve config/wsgi.py or config/asgi.py')
+        parser.add_argument('--bind', default='0.0.0.0:8000')
+        parser.add_argument('--workers', type=int,
+                            default=multiprocessing.cpu_count() * 2 + 1)
+        parser.add_argument('--graceful-timeout', type=int, default=30)
+        parser.add_argument('--max-requests', type=int, default=0,
+                            help='Restart worker after this many requests '
+                                 '(0 - never)')
+        parser.add_argument('--no-warmup', action='store_false',
+                            dest='warmup',
+                            help='Skip warmup (used by benchmarks)')
+
+    def handle(self, *args, **options):
+        try:
+            from gunicorn.app.base import BaseApplication
+        except ImportError:
+            raise CommandError('gunicorn is not installed')
+
+        if options['interface'] == 'asgi':
+            from config.asgi import application
+            worker_class = 'uvicorn.workers.UvicornWorker'
+        else:
+            from config.wsgi import application
+            worker_class = 'sync'
+
+        def post_worker_init(worker):
+            warmup.warm_worker()
+
+        config = {
+            'bind': options['bind'],
+            'workers': options['workers'],
+            'worker_class': worker_class,
+            'graceful_timeout': options['graceful_timeout'],
+            'max_requests': options['max_requests'],
+            'max_requests_jitter': options['max_requests'] // 10,
+            'preload_app': True,
+        }
+        # Connections are thread-local, only sync workers reuse them
+        if options['warmup'] and options['interface'] == 'wsgi':
+            config['post_worker_init'] = post_worker_init
+
+        class Application(BaseApplication):
+
+            def load_config(self):
+                for key, value in config.items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                # Executed once in master because of preload_app
+                if options['warmup']:
+                    warmup.preload()
+                return application
+
+        Application().run()
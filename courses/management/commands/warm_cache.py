@@ -0,0 +1,22 @@
+from django.core.management import BaseCommand
+
+from courses import caching
+
+
+class Command(BaseCommand):
+    """
+    Caches details of courses with most subscribers and first pages of
+    course and lesson lists of their owners and moderators
+    """
+    help = 'Precomputes cached pages of hot courses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int,
+                            help='Number of courses (CACHE_WARM_LIMIT)')
+        parser.add_argument('--concurrency', type=int,
+                            help='Number of threads (CACHE_WARM_CONCURRENCY)')
+
+    def handle(self, *args, **options):
+        keys, seconds = caching.warm(limit=options['limit'],
+                                     concurrency=options['concurrency'])
+        self.stdout.write(f'Warmed {keys} cache keys in {seconds:.2f} s')
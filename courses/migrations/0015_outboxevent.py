@@ -0,0 +1,30 @@
+# Generated by Django 4.2.4 on 2026-10-19 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0014_remove_lesson_updated_at_course_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_key', models.CharField(max_length=255, unique=True, verbose_name='event_key')),
+                ('task_name', models.CharField(max_length=255, verbose_name='task_name')),
+                ('args', models.JSONField(default=list, verbose_name='args')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created_at')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='sent_at')),
+            ],
+            options={
+                'verbose_name': 'outbox event',
+                'verbose_name_plural': 'outbox events',
+                'ordering': ('pk',),
+                'indexes': [models.Index(condition=models.Q(('sent_at__isnull', True)), fields=['id'], name='outbox_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.4 on 2026-10-19 19:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    """Computes counters of existing courses"""
+    Course = apps.get_model('courses', 'Course')
+    Lesson = apps.get_model('courses', 'Lesson')
+    Subscription = apps.get_model('courses', 'Subscription')
+    Payment = apps.get_model('courses', 'Payment')
+
+    lessons = Lesson.objects.filter(course=OuterRef('pk')).order_by() \
+        .values('course').annotate(total=Count('pk')).values('total')
+    subscribers = Subscription.objects.filter(course=OuterRef('pk')) \
+        .order_by().values('course').annotate(total=Count('pk')) \
+        .values('total')
+    revenue = Payment.objects.filter(course=OuterRef('pk')).order_by() \
+        .values('course').annotate(total=Sum('amount')).values('total')
+    Course.objects.update(
+        lesson_count=Coalesce(Subquery(lessons), 0),
+        subscriber_count=Coalesce(Subquery(subscribers), 0),
+        revenue_total=Coalesce(Subquery(revenue), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0015_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='lesson_count',
+            field=models.IntegerField(default=0, verbose_name='lesson_count'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='revenue_total',
+            field=models.BigIntegerField(default=0, verbose_name='revenue_total'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='subscriber_count',
+            field=models.IntegerField(default=0, verbose_name='subscriber_count'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,113 @@
+import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+
+TABLE = 'courses_payment'
+# Partitions created ahead of the current month
+MONTHS_AHEAD = 3
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def rebuild(schema_editor, partitioned):
+    """
+    Recreates payment table as partitioned by month of date_paid (primary
+    key includes partition key) or as a plain table, keeping rows, indexes,
+    foreign keys and id sequence.
+
+    Table is locked while rows are copied.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        # Indexes and foreign keys are recreated with the same names
+        cursor.execute(
+            'SELECT indexdef FROM pg_indexes '
+            'WHERE tablename = %s AND indexname <> %s',
+            [TABLE, f'{TABLE}_pkey']
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [TABLE]
+        )
+        foreign_keys = cursor.fetchall()
+
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {TABLE}_old')
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {TABLE}_old INCLUDING CONSTRAINTS)'
+            + (' PARTITION BY RANGE (date_paid)' if partitioned else '')
+        )
+
+        if partitioned:
+            cursor.execute(f'SELECT min(date_paid) FROM {TABLE}_old')
+            first = cursor.fetchone()[0] or timezone.now()
+            month = first.astimezone(datetime.timezone.utc).date() \
+                .replace(day=1)
+            last = add_months(
+                timezone.now().astimezone(datetime.timezone.utc).date()
+                .replace(day=1),
+                MONTHS_AHEAD
+            )
+            while month <= last:
+                cursor.execute(
+                    f"CREATE TABLE {TABLE}_y{month.year:04d}m{month.month:02d} "
+                    f"PARTITION OF {TABLE} FOR VALUES "
+                    f"FROM ('{month.isoformat()} 00:00+00') "
+                    f"TO ('{add_months(month, 1).isoformat()} 00:00+00')"
+                )
+                month = add_months(month, 1)
+            cursor.execute(
+                f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT'
+            )
+
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {TABLE}_old')
+        cursor.execute(f'DROP TABLE {TABLE}_old')
+
+        primary_key = '(id, date_paid)' if partitioned else '(id)'
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey '
+                       f'PRIMARY KEY {primary_key}')
+        for sql in indexes:
+            cursor.execute(sql)
+        for name, definition in foreign_keys:
+            cursor.execute(
+                f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}'
+            )
+
+        # Identity columns are not supported by partitioned tables
+        cursor.execute(f'CREATE SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id')
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id "
+                       f"SET DEFAULT nextval('{TABLE}_id_seq')")
+        cursor.execute(f"SELECT setval('{TABLE}_id_seq', "
+                       f"COALESCE(max(id), 0) + 1, false) FROM {TABLE}")
+
+
+def partition(apps, schema_editor):
+    rebuild(schema_editor, partitioned=True)
+
+
+def unpartition(apps, schema_editor):
+    rebuild(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0016_course_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['-date_paid'],
+                               name='payment_date_paid_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.4 on 2026-10-19 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0017_partition_payment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='deleted_at'),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='deleted_at'),
+        ),
+    ]
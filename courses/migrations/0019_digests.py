@@ -0,0 +1,45 @@
+# Generated by Django 4.2.4 on 2026-10-19 18:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('courses', '0018_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DigestDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_end', models.DateTimeField(verbose_name='window_end')),
+                ('sent_at', models.DateTimeField(auto_now_add=True, verbose_name='sent_at')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='digest_deliveries', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'digest delivery',
+                'verbose_name_plural': 'digest deliveries',
+            },
+        ),
+        migrations.CreateModel(
+            name='CourseUpdateEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='created_at')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='update_events', to='courses.course', verbose_name='course')),
+            ],
+            options={
+                'verbose_name': 'course update event',
+                'verbose_name_plural': 'course update events',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='digestdelivery',
+            constraint=models.UniqueConstraint(fields=('user', 'window_end'), name='digest_delivery_unique'),
+        ),
+    ]
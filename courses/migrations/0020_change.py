@@ -0,0 +1,112 @@
+# Generated by Django 4.2.4 on 2026-10-19 19:07
+
+from django.db import migrations, models
+
+# Model name in changes, table, column of user allowed to see object
+SYNCED = (
+    ('course', 'courses_course', 'owner_id'),
+    ('lesson', 'courses_lesson', 'owner_id'),
+    ('subscription', 'courses_subscription', 'user_id'),
+)
+
+PG_FUNCTION = """
+CREATE FUNCTION courses_record_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    data jsonb;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        data := to_jsonb(OLD);
+    ELSE
+        data := to_jsonb(NEW);
+    END IF;
+    INSERT INTO courses_change
+        (model, object_id, owner_id, deleted, xid, seq, changed_at)
+    VALUES (
+        TG_ARGV[0], (data ->> 'id')::bigint, (data ->> TG_ARGV[1])::bigint,
+        TG_OP = 'DELETE' OR data ->> 'deleted_at' IS NOT NULL,
+        txid_current(), nextval('courses_change_seq'), now()
+    )
+    ON CONFLICT (model, object_id) DO UPDATE SET
+        owner_id = EXCLUDED.owner_id, deleted = EXCLUDED.deleted,
+        xid = EXCLUDED.xid, seq = EXCLUDED.seq,
+        changed_at = EXCLUDED.changed_at;
+    RETURN NULL;
+END
+$$
+"""
+
+def deleted_expression(model, row):
+    return 'false' if model == 'subscription' else \
+        f'{row}.deleted_at IS NOT NULL'
+
+
+def create_triggers(apps, schema_editor):
+    """
+    Records changes of existing and future rows of synced tables
+    (PostgreSQL only)
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE SEQUENCE courses_change_seq')
+        cursor.execute(PG_FUNCTION)
+        for model, table, owner in SYNCED:
+            cursor.execute(
+                f"INSERT INTO courses_change (model, object_id, owner_id, "
+                f"deleted, xid, seq, changed_at) "
+                f"SELECT '{model}', id, {owner}, "
+                f"{deleted_expression(model, table)}, txid_current(), "
+                f"nextval('courses_change_seq'), now() FROM {table}"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER {table}_change "
+                f"AFTER INSERT OR UPDATE OR DELETE ON {table} "
+                f"FOR EACH ROW EXECUTE PROCEDURE "
+                f"courses_record_change('{model}', '{owner}')"
+            )
+
+
+def drop_triggers(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for model, table, owner in SYNCED:
+            cursor.execute(f'DROP TRIGGER {table}_change ON {table}')
+        cursor.execute('DROP FUNCTION courses_record_change()')
+        cursor.execute('DROP SEQUENCE courses_change_seq')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0019_digests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=20, verbose_name='model')),
+                ('object_id', models.BigIntegerField(verbose_name='object id')),
+                ('owner_id', models.BigIntegerField(blank=True, null=True, verbose_name='owner id')),
+                ('deleted', models.BooleanField(default=False, verbose_name='deleted')),
+                ('xid', models.BigIntegerField(verbose_name='transaction id')),
+                ('seq', models.BigIntegerField(verbose_name='sequence number')),
+                ('changed_at', models.DateTimeField(verbose_name='changed_at')),
+            ],
+            options={
+                'verbose_name': 'change',
+                'verbose_name_plural': 'changes',
+                'indexes': [models.Index(fields=['xid', 'seq'], name='change_position_idx'), models.Index(fields=['owner_id', 'xid', 'seq'], name='change_owner_position_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='change',
+            constraint=models.UniqueConstraint(fields=('model', 'object_id'), name='change_object_unique'),
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.4 on 2026-10-19 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0020_change'),
+    ]
+
+    operations = [
+        # auto_now_add has no effect in database, column is added as plain
+        # nullable one
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.AddField(
+                    model_name='subscription',
+                    name='created_at',
+                    field=models.DateTimeField(blank=True, null=True,
+                                               verbose_name='created_at'),
+                ),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='subscription',
+                    name='created_at',
+                    field=models.DateTimeField(auto_now_add=True, blank=True,
+                                               null=True,
+                                               verbose_name='created_at'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.4 on 2026-10-19 19:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('courses', '0021_subscription_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('target', models.CharField(choices=[('course', 'course'), ('lesson', 'lesson')], max_length=10, verbose_name='target')),
+                ('object_id', models.BigIntegerField(verbose_name='object id')),
+                ('filename', models.CharField(max_length=255, verbose_name='filename')),
+                ('size', models.BigIntegerField(verbose_name='size')),
+                ('sha256', models.CharField(max_length=64, verbose_name='sha256')),
+                ('offset', models.BigIntegerField(default=0, verbose_name='offset')),
+                ('chunks', models.JSONField(default=list, verbose_name='chunks')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created_at')),
+                ('completed_at', models.DateTimeField(blank=True, null=True, verbose_name='completed_at')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='owner')),
+            ],
+            options={
+                'verbose_name': 'upload',
+                'verbose_name_plural': 'uploads',
+            },
+        ),
+    ]
@@ -0,0 +1,111 @@
+# Generated by Django 4.2.4 on 2026-10-19 21:40
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+# Previous owner gets a tombstone when object changes owner
+PG_FUNCTION = """
+CREATE OR REPLACE FUNCTION courses_record_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    data jsonb;
+    old_owner bigint;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        data := to_jsonb(OLD);
+    ELSE
+        data := to_jsonb(NEW);
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        old_owner := (to_jsonb(OLD) ->> TG_ARGV[1])::bigint;
+        IF old_owner IS DISTINCT FROM (data ->> TG_ARGV[1])::bigint THEN
+            INSERT INTO courses_change
+                (model, object_id, owner_id, deleted, xid, seq, changed_at)
+            VALUES (
+                TG_ARGV[0], (data ->> 'id')::bigint, old_owner, true,
+                txid_current(), nextval('courses_change_seq'), now()
+            )
+            ON CONFLICT (model, object_id, COALESCE(owner_id, 0))
+            DO UPDATE SET
+                deleted = true, xid = EXCLUDED.xid, seq = EXCLUDED.seq,
+                changed_at = EXCLUDED.changed_at;
+        END IF;
+    END IF;
+    INSERT INTO courses_change
+        (model, object_id, owner_id, deleted, xid, seq, changed_at)
+    VALUES (
+        TG_ARGV[0], (data ->> 'id')::bigint, (data ->> TG_ARGV[1])::bigint,
+        TG_OP = 'DELETE' OR data ->> 'deleted_at' IS NOT NULL,
+        txid_current(), nextval('courses_change_seq'), now()
+    )
+    ON CONFLICT (model, object_id, COALESCE(owner_id, 0)) DO UPDATE SET
+        deleted = EXCLUDED.deleted, xid = EXCLUDED.xid, seq = EXCLUDED.seq,
+        changed_at = EXCLUDED.changed_at;
+    RETURN NULL;
+END
+$$
+"""
+
+# Function of migration 0020
+PG_FUNCTION_0020 = """
+CREATE OR REPLACE FUNCTION courses_record_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    data jsonb;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        data := to_jsonb(OLD);
+    ELSE
+        data := to_jsonb(NEW);
+    END IF;
+    INSERT INTO courses_change
+        (model, object_id, owner_id, deleted, xid, seq, changed_at)
+    VALUES (
+        TG_ARGV[0], (data ->> 'id')::bigint, (data ->> TG_ARGV[1])::bigint,
+        TG_OP = 'DELETE' OR data ->> 'deleted_at' IS NOT NULL,
+        txid_current(), nextval('courses_change_seq'), now()
+    )
+    ON CONFLICT (model, object_id) DO UPDATE SET
+        owner_id = EXCLUDED.owner_id, deleted = EXCLUDED.deleted,
+        xid = EXCLUDED.xid, seq = EXCLUDED.seq,
+        changed_at = EXCLUDED.changed_at;
+    RETURN NULL;
+END
+$$
+"""
+
+
+def replace_function(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(PG_FUNCTION)
+
+
+def restore_function(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # Only the latest change of each object is kept by migration 0020
+    schema_editor.execute("""
+        DELETE FROM courses_change c USING courses_change newer
+        WHERE newer.model = c.model AND newer.object_id = c.object_id
+            AND (newer.xid, newer.seq) > (c.xid, c.seq)
+    """)
+    schema_editor.execute(PG_FUNCTION_0020)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0022_upload'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='change',
+            name='change_object_unique',
+        ),
+        migrations.AddConstraint(
+            model_name='change',
+            constraint=models.UniqueConstraint(models.F('model'), models.F('object_id'), django.db.models.functions.comparison.Coalesce('owner_id', 0), name='change_object_owner_unique'),
+        ),
+        migrations.RunPython(replace_function, restore_function),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-19 20:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0023_change_owner'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='course',
+            name='revenue_total',
+            field=models.BigIntegerField(default=0, help_text='Sum of payments for the course. Payments for single lessons of the course are not included.', verbose_name='revenue_total'),
+        ),
+    ]
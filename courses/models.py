@@ -1,9 +1,27 @@
+import uuid
+
 from django.conf import settings
 from django.db import models
+from django.db.models.functions import Coalesce
 
 from users.models import NULLABLE, User
 
 
+class CourseManager(models.Manager):
+    """Hides courses marked for deletion"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class LessonManager(models.Manager):
+    """Hides lessons marked for deletion and lessons of deleted courses"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True,
+                                             course__deleted_at__isnull=True)
+
+
 class Course(models.Model):
     """
     Stores a single course entry.
@@ -17,6 +35,21 @@ class Course(models.Model):
                               verbose_name='owner', **NULLABLE)
     # Tracks when lesson was updated
     updated_at = models.DateTimeField(**NULLABLE, verbose_name='updated_time')
+    # Counters maintained on changes of related objects (courses.counters)
+    lesson_count = models.IntegerField(default=0, verbose_name='lesson_count')
+    subscriber_count = models.IntegerField(default=0,
+                                           verbose_name='subscriber_count')
+    revenue_total = models.BigIntegerField(
+        default=0, verbose_name='revenue_total',
+        help_text='Sum of payments for the course. Payments for single '
+                  'lessons of the course are not included.'
+    )
+    # Course is hidden at once and deleted in background (courses.deletion)
+    deleted_at = models.DateTimeField(**NULLABLE, verbose_name='deleted_at')
+
+    objects = CourseManager()
+    # Including courses marked for deletion
+    all_objects = models.Manager()
 
     def __str__(self):
         return f'{self.name}'
@@ -42,6 +75,12 @@ class Lesson(models.Model):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL,
                               on_delete=models.CASCADE, verbose_name='owner',
                               **NULLABLE)
+    # Lesson is hidden at once and deleted in background (courses.deletion)
+    deleted_at = models.DateTimeField(**NULLABLE, verbose_name='deleted_at')
+
+    objects = LessonManager()
+    # Including lessons marked for deletion
+    all_objects = models.Manager()
 
     def __str__(self):
         return f'{self.name}'
@@ -83,6 +122,11 @@ class Payment(models.Model):
         verbose_name = 'payment'
         verbose_name_plural = 'payments'
         ordering = ('-date_paid',)
+        # Table is partitioned by month of date_paid on PostgreSQL
+        # (see courses.partitions)
+        indexes = [
+            models.Index(fields=['-date_paid'], name='payment_date_paid_idx'),
+        ]
 
 
 class Subscription(models.Model):
@@ -95,6 +139,9 @@ class Subscription(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE, verbose_name='user',
                              **NULLABLE)
+    # Empty for subscriptions created before the field was added
+    created_at = models.DateTimeField(auto_now_add=True, **NULLABLE,
+                                      verbose_name='created_at')
 
     def __str__(self):
         return f'{self.user.email} subscribed to {self.course.name}'
@@ -102,3 +149,148 @@ class Subscription(models.Model):
     class Meta:
         verbose_name = 'subscription'
         verbose_name_plural = 'subscriptions'
+
+
+class OutboxEvent(models.Model):
+    """
+    Stores a single Celery task call that is sent to the broker only after
+    the transaction that recorded it commits.
+    """
+    # Events with the same key are recorded only once
+    event_key = models.CharField(max_length=255, unique=True,
+                                 verbose_name='event_key')
+    task_name = models.CharField(max_length=255, verbose_name='task_name')
+    args = models.JSONField(default=list, verbose_name='args')
+    created_at = models.DateTimeField(auto_now_add=True,
+                                      verbose_name='created_at')
+    # Empty until the relay sends event to the broker
+    sent_at = models.DateTimeField(**NULLABLE, verbose_name='sent_at')
+
+    def __str__(self):
+        return f'{self.task_name}{tuple(self.args)}'
+
+    class Meta:
+        verbose_name = 'outbox event'
+        verbose_name_plural = 'outbox events'
+        ordering = ('pk',)
+        indexes = [
+            # Relay scans pending events only
+            models.Index(fields=['id'], name='outbox_pending_idx',
+                         condition=models.Q(sent_at__isnull=True)),
+        ]
+
+
+class CourseUpdateEvent(models.Model):
+    """
+    Stores a single update of :model:`courses.Course` to be included into
+    digests of its subscribers (see courses.notifications).
+    """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE,
+                               verbose_name='course',
+                               related_name='update_events')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True,
+                                      verbose_name='created_at')
+
+    def __str__(self):
+        return f'{self.course_id} updated at {self.created_at}'
+
+    class Meta:
+        verbose_name = 'course update event'
+        verbose_name_plural = 'course update events'
+
+
+class DigestDelivery(models.Model):
+    """
+    Stores a digest sent to :model:`users.User` for a window, so retried
+    digest tasks do not send it again.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE, verbose_name='user',
+                             related_name='digest_deliveries')
+    window_end = models.DateTimeField(verbose_name='window_end')
+    sent_at = models.DateTimeField(auto_now_add=True, verbose_name='sent_at')
+
+    def __str__(self):
+        return f'Digest of {self.user_id} until {self.window_end}'
+
+    class Meta:
+        verbose_name = 'digest delivery'
+        verbose_name_plural = 'digest deliveries'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'window_end'],
+                                    name='digest_delivery_unique'),
+        ]
+
+
+class Change(models.Model):
+    """
+    Stores the last change of :model:`courses.Course`,
+    :model:`courses.Lesson` or :model:`courses.Subscription` for each of
+    its owners, for delta sync (see courses.sync). Rows are written by
+    database triggers (migrations 0020, 0023); rows of deleted objects and
+    of previous owners are tombstones.
+    """
+    model = models.CharField(max_length=20, verbose_name='model')
+    object_id = models.BigIntegerField(verbose_name='object id')
+    # Owner of course or lesson, user of subscription
+    owner_id = models.BigIntegerField(verbose_name='owner id', **NULLABLE)
+    deleted = models.BooleanField(default=False, verbose_name='deleted')
+    # Position of change: transaction id, then sequence number
+    xid = models.BigIntegerField(verbose_name='transaction id')
+    seq = models.BigIntegerField(verbose_name='sequence number')
+    changed_at = models.DateTimeField(verbose_name='changed_at')
+
+    def __str__(self):
+        return f'{self.model} {self.object_id} changed at {self.changed_at}'
+
+    class Meta:
+        verbose_name = 'change'
+        verbose_name_plural = 'changes'
+        constraints = [
+            # Owners are nullable
+            models.UniqueConstraint('model', 'object_id',
+                                    Coalesce('owner_id', 0),
+                                    name='change_object_owner_unique'),
+        ]
+        indexes = [
+            # Range scans of sync: all changes (moderators), changes of owner
+            models.Index(fields=['xid', 'seq'], name='change_position_idx'),
+            models.Index(fields=['owner_id', 'xid', 'seq'],
+                         name='change_owner_position_idx'),
+        ]
+
+
+class Upload(models.Model):
+    """
+    Stores a resumable upload of preview image of :model:`courses.Course`
+    or :model:`courses.Lesson` (see courses.uploads). Chunks are kept in
+    upload storage until the file is assembled and attached.
+    """
+    TARGETS = (('course', 'course'), ('lesson', 'lesson'))
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                              on_delete=models.CASCADE, verbose_name='owner')
+    target = models.CharField(max_length=10, choices=TARGETS,
+                              verbose_name='target')
+    object_id = models.BigIntegerField(verbose_name='object id')
+    filename = models.CharField(max_length=255, verbose_name='filename')
+    size = models.BigIntegerField(verbose_name='size')
+    # Hex digest of the whole file declared by client
+    sha256 = models.CharField(max_length=64, verbose_name='sha256')
+    # Bytes received, start of the next chunk
+    offset = models.BigIntegerField(default=0, verbose_name='offset')
+    # Storage names of received chunks in order
+    chunks = models.JSONField(default=list, verbose_name='chunks')
+    created_at = models.DateTimeField(auto_now_add=True,
+                                      verbose_name='created_at')
+    completed_at = models.DateTimeField(**NULLABLE,
+                                        verbose_name='completed_at')
+
+    def __str__(self):
+        return f'{self.filename} for {self.target} {self.object_id}'
+
+    class Meta:
+        verbose_name = 'upload'
+        verbose_name_plural = 'uploads'
@@ -0,0 +1,99 @@
+"""
+Notifications of subscribers about course updates.
+
+In 'instant' mode every update sends an email to each subscriber
+(config.tasks.notify_subscribers). In 'digest' mode updates are recorded
+as :model:`courses.CourseUpdateEvent` and `send_digests` sends one email
+per user per window listing all updated courses.
+"""
+import datetime
+import itertools
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import get_template
+from django.utils import timezone
+
+from courses import outbox
+from courses.models import CourseUpdateEvent, DigestDelivery, Subscription
+
+
+def course_updated(course_id, event_key=None):
+    """
+    Notifies subscribers of course once the current transaction commits.
+    In instant mode, updates with the same event key notify only once.
+    """
+    if settings.NOTIFICATION_MODE == 'digest':
+        CourseUpdateEvent.objects.create(course_id=course_id)
+    else:
+        outbox.publish('config.tasks.notify_subscribers', course_id,
+                       event_key=event_key)
+
+
+def current_window_end():
+    """Returns end of the last complete digest window"""
+    interval = settings.DIGEST_INTERVAL.total_seconds()
+    now = timezone.now().timestamp()
+    return datetime.datetime.fromtimestamp(now // interval * interval,
+                                           tz=datetime.timezone.utc)
+
+
+def _pending_digests(window_end):
+    """
+    Yields (user id, email, [course names]) of users subscribed to courses
+    updated before the end of window and not sent digest of this window.
+    Rows are grouped by one query and streamed.
+    """
+    rows = (
+        Subscription.objects
+        .filter(course__update_events__created_at__lt=window_end,
+                course__deleted_at__isnull=True,
+                user__is_active=True)
+        .exclude(user__digest_deliveries__window_end=window_end)
+        .values_list('user_id', 'user__email', 'course__name')
+        .distinct()
+        .order_by('user_id', 'course__name')
+    )
+    grouped = itertools.groupby(rows.iterator(chunk_size=2000),
+                                key=lambda row: row[:2])
+    for (user_id, email), courses in grouped:
+        yield user_id, email, [name for _, _, name in courses]
+
+
+def send_digests(window_end=None, batch_size=None):
+    """
+    Sends digests of window over one SMTP connection, recording each
+    batch of deliveries as soon as it is sent. Returns number of emails.
+    """
+    window_end = window_end or current_window_end()
+    batch_size = batch_size or settings.DIGEST_BATCH_SIZE
+    template = get_template('courses/digest_email.txt')
+
+    sent = 0
+    digests = _pending_digests(window_end)
+    with get_connection() as connection:
+        while True:
+            batch = list(itertools.islice(digests, batch_size))
+            if not batch:
+                break
+            connection.send_messages([
+                EmailMessage(
+                    subject='Course Updates',
+                    body=template.render({'courses': courses}),
+                    from_email=settings.EMAIL_HOST_USER,
+                    to=[email],
+                )
+                for _, email, courses in batch
+            ])
+            # Retried task skips users that already got the digest
+            DigestDelivery.objects.bulk_create(
+                [DigestDelivery(user_id=user_id, window_end=window_end)
+                 for user_id, _, _ in batch],
+                ignore_conflicts=True,
+            )
+            sent += len(batch)
+
+    # Events and deliveries of sent windows are no longer needed
+    CourseUpdateEvent.objects.filter(created_at__lt=window_end).delete()
+    DigestDelivery.objects.filter(window_end__lt=window_end).delete()
+    return sent
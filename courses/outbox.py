@@ -0,0 +1,116 @@
+"""
+Transactional outbox for Celery tasks.
+
+Task calls are stored in :model:`courses.OutboxEvent` within the caller's
+transaction and sent to the broker after commit by a background relay
+thread. A periodic sweeper (``config.tasks.relay_outbox``) sends whatever
+the relay missed, e.g. while the broker was unavailable.
+"""
+import logging
+import os
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from config.celery import app
+from courses.models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+
+def publish(task_name, *args, event_key=None):
+    """
+    Records task call in the current transaction.
+    Repeated calls with the same event key are ignored.
+    """
+    OutboxEvent.objects.bulk_create(
+        [OutboxEvent(event_key=event_key or uuid.uuid4().hex,
+                     task_name=task_name, args=list(args))],
+        ignore_conflicts=True,
+    )
+    transaction.on_commit(wake_relay)
+
+
+def publish_many(task_name, args_list):
+    """Records calls of task, one per arguments, with one INSERT"""
+    OutboxEvent.objects.bulk_create(
+        [OutboxEvent(event_key=uuid.uuid4().hex, task_name=task_name,
+                     args=list(args)) for args in args_list]
+    )
+    transaction.on_commit(wake_relay)
+
+
+def relay(batch_size=None):
+    """
+    Sends pending events to the broker over one connection. Each event is
+    marked sent in its own short transaction, so a failure of the broker or
+    of the commit sends again at most the event being sent.
+    Returns number of sent events.
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    sent = 0
+    with app.producer_or_acquire() as producer:
+        while True:
+            pks = list(OutboxEvent.objects.filter(sent_at__isnull=True)
+                       .order_by('pk').values_list('pk', flat=True)
+                       [:batch_size])
+            sent_before = sent
+            for pk in pks:
+                with transaction.atomic():
+                    # Concurrent relays skip events taken by others
+                    event = OutboxEvent.objects \
+                        .select_for_update(skip_locked=True) \
+                        .filter(pk=pk, sent_at__isnull=True).first()
+                    if event is None:
+                        continue
+                    app.send_task(event.task_name, args=event.args,
+                                  producer=producer)
+                    event.sent_at = timezone.now()
+                    event.save(update_fields=['sent_at'])
+                sent += 1
+            if len(pks) < batch_size or sent == sent_before:
+                return sent
+
+
+def prune():
+    """Deletes sent events that no longer need deduplication"""
+    OutboxEvent.objects.filter(
+        sent_at__lt=timezone.now() - settings.OUTBOX_RETENTION
+    ).delete()
+
+
+# Background relay of the current process
+
+_wakeup = threading.Event()
+_relay_lock = threading.Lock()
+_relay_thread = None
+_relay_pid = None
+
+
+def _relay_forever():
+    while True:
+        _wakeup.wait()
+        _wakeup.clear()
+        try:
+            relay()
+        except Exception:
+            logger.warning('Outbox relay failed, events are left to sweeper',
+                           exc_info=True)
+        finally:
+            # Connections of this thread only
+            connections.close_all()
+
+
+def wake_relay():
+    """Asks the relay thread to drain the outbox without blocking caller"""
+    global _relay_thread, _relay_pid
+    with _relay_lock:
+        if _relay_pid != os.getpid() or not _relay_thread.is_alive():
+            _relay_thread = threading.Thread(target=_relay_forever,
+                                             name='outbox-relay', daemon=True)
+            _relay_pid = os.getpid()
+            _relay_thread.start()
+    _wakeup.set()
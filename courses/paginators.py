@@ -1,7 +1,77 @@
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class DefaultPaginator(PageNumberPagination):
     page_size = 5
     page_size_query_param = 'page_size'
     max_page_size = 50
+
+    def get_first_page_response(self, request, page):
+        """Builds response of the first page from cached count and results"""
+        next_link = None
+        if page['count'] > self.page_size:
+            next_link = replace_query_param(request.build_absolute_uri(),
+                                            self.page_query_param, 2)
+        return Response(OrderedDict([
+            ('count', page['count']),
+            ('next', next_link),
+            ('previous', None),
+            ('results', page['results']),
+        ]))
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Admin paginator counting rows of large tables from PostgreSQL
+    statistics instead of COUNT(*): table statistics for unfiltered lists,
+    planner estimate for filtered ones. Small counts are exact.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet) or \
+                connections[queryset.db].vendor != 'postgresql':
+            return super().count
+        if queryset.query.where:
+            estimate = self.planner_estimate(queryset)
+        else:
+            estimate = self.table_estimate(queryset)
+        if estimate < settings.ADMIN_EXACT_COUNT_LIMIT:
+            return super().count
+        return estimate
+
+    @staticmethod
+    def table_estimate(queryset):
+        """Rows of table and its partitions by the last ANALYZE"""
+        table = queryset.model._meta.db_table
+        with connections[queryset.db].cursor() as cursor:
+            # Never analyzed tables have -1 rows
+            cursor.execute(
+                'SELECT COALESCE(SUM(GREATEST(reltuples, 0)), 0) '
+                'FROM pg_class WHERE oid = %s::regclass OR oid IN ('
+                'SELECT inhrelid FROM pg_inherits '
+                'WHERE inhparent = %s::regclass)',
+                [table, table]
+            )
+            return int(cursor.fetchone()[0])
+
+    @staticmethod
+    def planner_estimate(queryset):
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
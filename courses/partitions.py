@@ -0,0 +1,209 @@
+"""
+Maintenance of monthly partitions of :model:`courses.Payment`.
+
+On PostgreSQL the payment table is partitioned by range of ``date_paid``
+(UTC months, see migration 0017). Partitions are created ahead of time;
+partitions older than the retention period are detached, dumped to
+gzip-compressed CSV files and dropped. Rows outside of existing partitions
+go to the default partition; maintenance moves them to partitions of their
+months, and import creates partitions of imported months before loading.
+
+Archived payments are no longer counted by ``repair_course_counters``.
+"""
+import datetime
+import gzip
+import logging
+import os
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from courses.models import Payment
+
+logger = logging.getLogger(__name__)
+
+TABLE = Payment._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_RE = re.compile(rf'^{TABLE}_y(\d{{4}})m(\d{{2}})$')
+
+
+def add_months(month, months):
+    """Returns first day of month shifted by number of months"""
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{TABLE}_y{month.year:04d}m{month.month:02d}'
+
+
+def is_partitioned():
+    """Checks whether payments are stored in partitions"""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass",
+            [TABLE]
+        )
+        return cursor.fetchone()[0]
+
+
+def current_month():
+    return timezone.now().astimezone(datetime.timezone.utc).date() \
+        .replace(day=1)
+
+
+def create_partition(cursor, month):
+    """Creates partition of month unless it exists"""
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} "
+        f"PARTITION OF {TABLE} FOR VALUES "
+        f"FROM ('{month.isoformat()} 00:00+00') "
+        f"TO ('{add_months(month, 1).isoformat()} 00:00+00')"
+    )
+
+
+def partition_tables(cursor):
+    """Names of partition tables, attached or left detached by archival"""
+    cursor.execute(
+        "SELECT tablename FROM pg_tables "
+        "WHERE schemaname = current_schema() AND tablename LIKE %s",
+        [f'{TABLE}_y%']
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def add_partitions(months):
+    """
+    Creates partitions of months, moving their rows out of the default
+    partition. Payments are locked until the transaction commits.
+    Returns names of created partitions.
+    """
+    with connection.cursor() as cursor:
+        existing = set(partition_tables(cursor))
+    missing = sorted({month for month in months
+                      if partition_name(month) not in existing})
+    if not missing:
+        return []
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Do not queue behind long queries while holding the lock
+        cursor.execute("SET LOCAL lock_timeout = '5s'")
+        # Default partition cannot hold rows of a new partition
+        cursor.execute(
+            f'ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}'
+        )
+        cursor.execute('SET LOCAL lock_timeout = DEFAULT')
+        for month in missing:
+            create_partition(cursor, month)
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+                f"WHERE date_paid >= %s AND date_paid < %s RETURNING *) "
+                f"INSERT INTO {TABLE} SELECT * FROM moved",
+                [f'{month.isoformat()} 00:00+00',
+                 f'{add_months(month, 1).isoformat()} 00:00+00']
+            )
+        cursor.execute(
+            f'ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT'
+        )
+        # Foreign keys of moved rows are checked now: partitions with
+        # pending checks cannot be archived in the same transaction
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+    return [partition_name(month) for month in missing]
+
+
+def default_months():
+    """Months of rows in the default partition"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', date_paid AT TIME ZONE "
+            f"'UTC')::date FROM {DEFAULT_PARTITION}"
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def ensure_partitions(months_ahead=None):
+    """Creates partitions of current and next months"""
+    if months_ahead is None:
+        months_ahead = settings.PAYMENT_PARTITIONS_AHEAD
+    month = current_month()
+    return add_partitions(add_months(month, shift)
+                          for shift in range(months_ahead + 1))
+
+
+def old_partitions(retain_months):
+    """
+    Returns names of partition tables (attached or left detached by
+    interrupted archival) older than retention period
+    """
+    cutoff = add_months(current_month(), -retain_months)
+    with connection.cursor() as cursor:
+        names = partition_tables(cursor)
+
+    partitions = []
+    for name in sorted(names):
+        match = PARTITION_RE.match(name)
+        if match:
+            month = datetime.date(int(match[1]), int(match[2]), 1)
+            if month < cutoff:
+                partitions.append(name)
+    return partitions
+
+
+def archive_partition(name, archive_dir):
+    """
+    Detaches partition, dumps it to gzip-compressed CSV and drops it.
+    Returns path of archive.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_inherits WHERE inhrelid = %s::regclass",
+            [name]
+        )
+        if cursor.fetchone():
+            # Do not queue behind long queries while holding the lock
+            cursor.execute("SET LOCAL lock_timeout = '5s'")
+            cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f'{name}.csv.gz')
+    with connection.cursor() as cursor:
+        # File is complete on disk before table is dropped
+        with open(f'{path}.tmp', 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as file:
+                cursor.cursor.copy_expert(
+                    f'COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)', file
+                )
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(f'{path}.tmp', path)
+        cursor.execute(f'DROP TABLE {name}')
+    return path
+
+
+def maintain(months_ahead=None, retain_months=None, archive_dir=None):
+    """
+    Creates future partitions, moves rows of the default partition to
+    partitions of their months and archives expired partitions.
+    Returns paths of created archives.
+    """
+    if not is_partitioned():
+        return []
+    if retain_months is None:
+        retain_months = settings.PAYMENT_RETENTION_MONTHS
+    archive_dir = archive_dir or settings.PAYMENT_ARCHIVE_ROOT
+
+    ensure_partitions(months_ahead)
+    for name in add_partitions(default_months()):
+        logger.info('Payment partition %s split from default', name)
+    archives = []
+    if retain_months:
+        for name in old_partitions(retain_months):
+            archives.append(archive_partition(name, archive_dir))
+            logger.info('Payment partition %s archived to %s', name,
+                        archives[-1])
+    return archives
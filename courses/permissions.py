@@ -14,4 +14,5 @@ class IsOwner(BasePermission):
     message = "You are not an owner of this entity"
 
     def has_object_permission(self, request, view, obj):
-        return request.user == obj.owner
+        # Compares ids, owner is not loaded
+        return obj.owner_id == request.user.pk
@@ -1,13 +1,48 @@
+import os
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.validators import validate_image_file_extension
+from django.utils.text import get_valid_filename
 from rest_framework import serializers
-from rest_framework.fields import IntegerField
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.serializers import raise_errors_on_nested_writes
+from rest_framework.utils import model_meta
 
-from courses.models import Lesson, Course, Payment, Subscription
+from courses.models import Lesson, Course, Payment, Subscription, Upload
 from courses.validators import validate_url
+from users.models import UserRoles
 
-from courses import services
+from courses import entitlements, services
 
 
-class LessonSerializer(serializers.ModelSerializer):
+class UpdateFieldsMixin:
+    """
+    Saves only changed fields on update, instead of the whole row
+    """
+
+    def update(self, instance, validated_data):
+        raise_errors_on_nested_writes('update', self, validated_data)
+        info = model_meta.get_field_info(instance)
+
+        update_fields = []
+        m2m_fields = []
+        for attr, value in validated_data.items():
+            if attr in info.relations and info.relations[attr].to_many:
+                m2m_fields.append((attr, value))
+            else:
+                setattr(instance, attr, value)
+                update_fields.append(attr)
+        instance.save(update_fields=update_fields)
+
+        for attr, value in m2m_fields:
+            getattr(instance, attr).set(value)
+
+        return instance
+
+
+class LessonSerializer(UpdateFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for :model:`courses.Lesson`
     """
@@ -16,21 +51,35 @@ class LessonSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Lesson
-        fields = '__all__'
+        # Lessons marked for deletion are not shown at all
+        exclude = ('deleted_at',)
 
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(UpdateFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for :model:`courses.Course`
     """
-    # Number of lessons in the course
-    lesson_count = IntegerField(source='lesson_set.count', required=False)
     # List of lessons in the course
     lessons = LessonSerializer(many=True, required=False)
 
     class Meta:
         model = Course
-        fields = '__all__'
+        # Courses marked for deletion are not shown at all
+        exclude = ('deleted_at',)
+        # Counters are maintained by courses.counters
+        read_only_fields = ('lesson_count', 'subscriber_count',
+                            'revenue_total')
+
+
+class CourseSyncSerializer(serializers.ModelSerializer):
+    """
+    Serializer for :model:`courses.Course` in delta sync,
+    lessons are synced separately
+    """
+
+    class Meta:
+        model = Course
+        exclude = ('deleted_at',)
 
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -49,6 +98,9 @@ class PaymentSerializer(serializers.ModelSerializer):
             amount=validated_data['amount'],
             type=validated_data['type'],
             payment_id=services.create_payment(validated_data['amount']),
+            # Passed by view to serializer.save()
+            user=validated_data.get('user'),
+            course=validated_data.get('course'),
         )
         payment.save()
         return payment
@@ -83,13 +135,11 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class CourseSubSerializer(serializers.ModelSerializer):
+class CourseSubSerializer(UpdateFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for course :model:`courses.Course`
     That includes subscription field for user
     """
-    # Number of lessons in the course
-    lesson_count = IntegerField(source='lesson_set.count', required=False)
     # List of lessons in the course
     lessons = LessonSerializer(many=True, required=False)
     # Subscription status
@@ -97,12 +147,55 @@ class CourseSubSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Course
-        fields = '__all__'
+        # Courses marked for deletion are not shown at all
+        exclude = ('deleted_at',)
+        # Counters are maintained by courses.counters
+        read_only_fields = ('lesson_count', 'subscriber_count',
+                            'revenue_total')
 
     def get_is_subscribed(self, instance):
         request = self.context['request']
-        subscription = Subscription.objects.filter(user=request.user,
-                                                   course=instance)
-        if subscription:
-            return True
-        return False
\ No newline at end of file
+        return entitlements.for_request(request).is_subscribed(instance.pk)
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    """
+    Serializer for :model:`courses.Upload`
+    """
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$')
+
+    class Meta:
+        model = Upload
+        exclude = ('owner', 'chunks')
+        read_only_fields = ('offset', 'completed_at')
+
+    def validate_filename(self, value):
+        try:
+            value = get_valid_filename(os.path.basename(value))
+        except SuspiciousFileOperation:
+            raise serializers.ValidationError('Invalid filename.')
+        validate_image_file_extension(File(None, value))
+        return value
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Size must be from 1 to {settings.UPLOAD_MAX_SIZE} bytes.'
+            )
+        return value
+
+    def validate_sha256(self, value):
+        return value.lower()
+
+    def validate(self, attrs):
+        user = self.context['request'].user
+        model = Course if attrs['target'] == 'course' else Lesson
+        instance = model.objects.filter(pk=attrs['object_id']).first()
+        if instance is None:
+            raise serializers.ValidationError(
+                {'object_id': f'{attrs["target"].capitalize()} not found.'}
+            )
+        # Previews are changed by those who can update the object
+        if user.role != UserRoles.MODERATOR and instance.owner_id != user.pk:
+            raise PermissionDenied()
+        return attrs
@@ -1,22 +1,46 @@
-import stripe   # library to handle payments
 from django.conf import settings
+from django.core.cache import cache
 
+from config.profiling import external_call
 
-def create_payment(amount):
+
+def get_stripe():
+    """
+    Returns STRIPE library (to handle payments) configured with API key.
+    It is imported on first use, as it slows down start of every process.
+    """
+    import stripe
     stripe.api_key = settings.STRIPE_API_KEY
-    response = stripe.PaymentIntent.create(
-                    amount=amount,
-                    currency="usd",
-                    automatic_payment_methods={"enabled": True},
-                )
+    return stripe
+
+
+def create_payment(amount):
+    stripe = get_stripe()
+    with external_call('stripe.PaymentIntent.create'):
+        response = stripe.PaymentIntent.create(
+                        amount=amount,
+                        currency="usd",
+                        automatic_payment_methods={"enabled": True},
+                    )
     return response['id']
 
 
 def get_payment_status(payment_id):
-    stripe.api_key = settings.STRIPE_API_KEY
-    response = stripe.PaymentIntent.retrieve(
-                    payment_id,
-                )
+    # Statuses are cached to avoid STRIPE API round trip on each read
+    cache_key = f'stripe-status:{payment_id}'
+    status = cache.get(cache_key)
+    if status is not None:
+        return status
+
+    stripe = get_stripe()
+    with external_call('stripe.PaymentIntent.retrieve'):
+        response = stripe.PaymentIntent.retrieve(
+                        payment_id,
+                    )
     if response['amount'] - response['amount_received'] == 0:
-        return 'paid'
-    return 'unprocessed'
+        status = 'paid'
+    else:
+        status = 'unprocessed'
+    cache.set(cache_key, status,
+              settings.STRIPE_STATUS_CACHE_TIMEOUT[status])
+    return status
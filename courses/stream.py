@@ -0,0 +1,255 @@
+"""
+Server-Sent Events stream of course events (see courses.events).
+
+    GET /events/?token=<access token>
+    Authorization: Bearer <access token>    (instead of token parameter)
+    Last-Event-ID: <id of last received event>
+
+A plain ASGI application mounted by config/asgi.py (the project must be
+served with `serve --interface asgi`). An idle connection costs a
+coroutine and a queue: database is used only while connecting, and each
+process listens to Redis over one pub/sub connection shared by all
+streams.
+
+Clients resume after reconnect from Last-Event-ID (sent by EventSource
+automatically). If the replay buffer does not reach back to it, a `reset`
+event asks the client to reload data. Streams that cannot keep up are
+closed and resume the same way.
+"""
+import asyncio
+import json
+import logging
+import weakref
+from collections import defaultdict
+from contextlib import suppress
+from urllib.parse import parse_qs
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from config.batch import in_own_connection
+from config.redis_client import get_async_redis
+from courses import events
+from courses.models import Subscription
+
+logger = logging.getLogger(__name__)
+
+HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    # Disable buffering of nginx
+    (b'x-accel-buffering', b'no'),
+]
+
+
+class Listener:
+    """Queue of messages of one stream"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue(settings.SSE_QUEUE_SIZE)
+        self.closed = False
+
+    def deliver(self, data):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self):
+        """Ends stream after queued messages"""
+        self.closed = True
+        # Wakes up waiting stream (full queue does not wait)
+        with suppress(asyncio.QueueFull):
+            self.queue.put_nowait(None)
+
+
+class Hub:
+    """
+    Pub/sub connection of event loop, subscribed to channels of all
+    listeners of the loop
+    """
+
+    def __init__(self):
+        self.pubsub = get_async_redis().pubsub()
+        self.listeners = defaultdict(set)
+        self.task = None
+
+    async def add(self, channels, listener):
+        new = [channel for channel in channels if not self.listeners[channel]]
+        for channel in channels:
+            self.listeners[channel].add(listener)
+        if new:
+            await self.pubsub.subscribe(*new)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.listen())
+
+    async def remove(self, channels, listener):
+        unused = []
+        for channel in channels:
+            self.listeners[channel].discard(listener)
+            if not self.listeners[channel]:
+                del self.listeners[channel]
+                unused.append(channel)
+        if unused:
+            await self.pubsub.unsubscribe(*unused)
+
+    async def listen(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+            except redis.RedisError:
+                logger.warning('Event stream connection failed',
+                               exc_info=True)
+                # Messages may be lost: streams resume from replay buffer
+                for listeners in self.listeners.values():
+                    for listener in listeners:
+                        listener.close()
+                await asyncio.sleep(1)
+                continue
+            if message is None:
+                continue
+            channel = message['channel'].decode()
+            for listener in self.listeners.get(channel, ()):
+                listener.deliver(message['data'])
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_hub():
+    loop = asyncio.get_running_loop()
+    if loop not in _hubs:
+        _hubs[loop] = Hub()
+    return _hubs[loop]
+
+
+def format_event(event):
+    lines = [f'event: {event["type"]}', f'data: {json.dumps(event)}']
+    if 'id' in event:
+        lines.insert(0, f'id: {event["id"]}')
+    return '\n'.join(lines) + '\n\n'
+
+
+@sync_to_async(thread_sensitive=False)
+@in_own_connection
+def authenticate(token):
+    """Returns id of user of access token, None if token is invalid"""
+    authentication = JWTAuthentication()
+    try:
+        user = authentication.get_user(
+            authentication.get_validated_token(token)
+        )
+    except APIException:
+        return None
+    return user.pk if user.is_active else None
+
+
+@sync_to_async(thread_sensitive=False)
+@in_own_connection
+def subscribed_courses(user_id):
+    return set(Subscription.objects.filter(user_id=user_id)
+               .values_list('course_id', flat=True))
+
+
+def channels_of(user_id, course_ids):
+    return {events.user_channel(user_id)} | \
+        {events.course_channel(course_id) for course_id in course_ids}
+
+
+async def stream(user_id, last_id, send):
+    """Sends events of subscribed courses until cancelled"""
+    async def write(text):
+        await send({'type': 'http.response.body', 'body': text.encode(),
+                    'more_body': True})
+
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': HEADERS})
+    hub = get_hub()
+    listener = Listener()
+    course_ids = await subscribed_courses(user_id)
+    channels = channels_of(user_id, course_ids)
+    await hub.add(channels, listener)
+    try:
+        await write(f'retry: {settings.SSE_RETRY_MILLISECONDS}\n\n')
+        if last_id:
+            replayed, complete = await sync_to_async(
+                events.replay, thread_sensitive=False
+            )(last_id, course_ids)
+            if not complete:
+                await write(format_event({'type': 'reset'}))
+            for event in replayed:
+                await write(format_event(event))
+                last_id = event['id']
+
+        while not (listener.closed and listener.queue.empty()):
+            try:
+                data = await asyncio.wait_for(
+                    listener.queue.get(), settings.SSE_HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                # Keeps proxies and clients from closing idle connection
+                await write(': ping\n\n')
+                continue
+            if data is None:
+                continue
+            event = json.loads(data)
+            if event['type'] == 'subscriptions':
+                course_ids = await subscribed_courses(user_id)
+                new_channels = channels_of(user_id, course_ids)
+                await hub.add(new_channels - channels, listener)
+                await hub.remove(channels - new_channels, listener)
+                channels = new_channels
+            elif last_id is None or \
+                    events.parse_id(event['id']) > events.parse_id(last_id):
+                # Skips events already sent from replay buffer
+                await write(format_event(event))
+                last_id = event['id']
+    finally:
+        await hub.remove(channels, listener)
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def application(scope, receive, send):
+    """ASGI application of event stream"""
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+               for name, value in scope['headers']}
+    query = parse_qs(scope['query_string'].decode('latin-1'))
+
+    token = query.get('token', [None])[0]
+    scheme, _, credentials = headers.get('authorization', '').partition(' ')
+    if scheme.lower() == 'bearer':
+        token = credentials
+    user_id = await authenticate(token) if token else None
+    if user_id is None:
+        await send({'type': 'http.response.start', 'status': 401,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': json.dumps(
+            {'detail': 'Given token not valid or not provided'}
+        ).encode()})
+        return
+
+    last_id = headers.get('last-event-id')
+    if last_id and events.parse_id(last_id) is None:
+        last_id = None
+
+    # Stream is cancelled as soon as client disconnects
+    streaming = asyncio.create_task(stream(user_id, last_id, send))
+    disconnect = asyncio.create_task(wait_disconnect(receive))
+    await asyncio.wait({streaming, disconnect},
+                       return_when=asyncio.FIRST_COMPLETED)
+    for task in (streaming, disconnect):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
@@ -0,0 +1,144 @@
+"""
+Delta sync of courses, lessons and subscriptions for offline clients.
+
+Every change is recorded in :model:`courses.Change` by database triggers
+at a position (transaction id, sequence number). Sequence number alone is
+not enough: a transaction can commit after another one that got a later
+number, and a client which has passed the later number would miss the
+change. So sync returns only changes of finished transactions (ids below
+the oldest running one), and the final cursor of a sync stops there.
+
+This makes one long write transaction hold back the cursors of every
+client until it finishes: changes committed after it started are not
+returned meanwhile (they are not lost). Maintenance writes in short
+transactions for this reason (see courses.deletion), and sync itself must
+run outside of write transactions, whose own changes it does not return.
+Changes are recorded on PostgreSQL only.
+
+Objects are represented as in API (serializers of views), objects that
+are deleted or hidden (e.g. lessons of deleted courses) as tombstones.
+An object that changes owner gets a tombstone for the previous owner.
+Clients drop lessons of deleted courses themselves.
+"""
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from courses.models import Change, Course, Lesson, Subscription
+from courses.serializers import CourseSyncSerializer, LessonSerializer, \
+    SubscriptionSerializer
+from users.models import UserRoles
+
+SALT = 'courses.sync'
+
+# Objects of changes by model
+SOURCES = {
+    'course': (Course.objects, CourseSyncSerializer),
+    'lesson': (Lesson.objects, LessonSerializer),
+    'subscription': (Subscription.objects, SubscriptionSerializer),
+}
+
+
+class CursorExpired(APIException):
+    """Tombstones after cursor may be pruned already"""
+    status_code = status.HTTP_410_GONE
+    default_detail = 'Cursor expired, sync from the beginning.'
+    default_code = 'cursor_expired'
+
+
+def dump_cursor(position):
+    return signing.dumps(list(position), salt=SALT)
+
+
+def load_cursor(cursor):
+    """Returns position of cursor, start of changes for empty cursor"""
+    if not cursor:
+        return 0, 0
+    try:
+        xid, seq = signing.loads(cursor, salt=SALT,
+                                 max_age=settings.SYNC_RETENTION)
+        return int(xid), int(seq)
+    except signing.SignatureExpired:
+        raise CursorExpired()
+    except (signing.BadSignature, TypeError, ValueError):
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+
+
+def horizon():
+    """
+    Returns id of the oldest running transaction, including the current
+    one, None on databases without recorded changes
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT txid_snapshot_xmin(txid_current_snapshot())')
+        return cursor.fetchone()[0]
+
+
+def visible_changes(user):
+    """Changes of objects listed to user by views"""
+    if user.role == UserRoles.MODERATOR:
+        return Change.objects.filter(Q(model__in=('course', 'lesson'))
+                                     | Q(owner_id=user.pk))
+    return Change.objects.filter(owner_id=user.pk)
+
+
+def changes_since(user, cursor=None, limit=None):
+    """
+    Returns (changed objects, next cursor, whether more changes are
+    available now) after cursor
+    """
+    limit = limit or settings.SYNC_PAGE_SIZE
+    xid, seq = load_cursor(cursor)
+    end = horizon()
+
+    # Range scan of (xid, seq) index after cursor
+    queryset = visible_changes(user) \
+        .filter(xid__gte=xid).filter(Q(xid__gt=xid) | Q(seq__gt=seq))
+    if end is not None:
+        queryset = queryset.filter(xid__lt=end)
+    rows = list(queryset.order_by('xid', 'seq')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if rows and (has_more or end is None):
+        position = rows[-1].xid, rows[-1].seq
+    elif end is not None:
+        # Later changes belong to running or future transactions
+        position = max((end, 0), (xid, seq))
+    else:
+        position = xid, seq
+
+    objects = {}
+    for model, (manager, serializer_class) in SOURCES.items():
+        ids = [row.object_id for row in rows
+               if row.model == model and not row.deleted]
+        if ids:
+            serializer = serializer_class(manager.filter(pk__in=ids),
+                                          many=True)
+            objects[model] = {item['id']: item for item in serializer.data}
+
+    changes = []
+    for row in rows:
+        # Tombstone of previous owner may share page with the object
+        data = None if row.deleted else \
+            objects.get(row.model, {}).get(row.object_id)
+        changes.append({'type': row.model, 'id': row.object_id,
+                        'deleted': data is None, 'data': data})
+    return changes, dump_cursor(position), has_more
+
+
+def prune(retention=None):
+    """
+    Deletes tombstones older than accepted cursors.
+    Returns number of deleted tombstones.
+    """
+    retention = retention or settings.SYNC_RETENTION
+    return Change.objects.filter(
+        deleted=True, changed_at__lt=timezone.now() - retention
+    ).delete()[0]
@@ -1,8 +1,38 @@
+import asyncio
+import datetime
+import gzip
+import hashlib
+import os
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+import fakeredis
+import fakeredis.aioredis
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase, \
+    APITransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
 
-from courses.models import Course, Lesson
+from config import db_router
+from config.cache import version_key, versioned_keys
+from courses import caching, deletion, entitlements, events, importer, \
+    leaderboards, notifications, outbox, partitions, stream, sync
+from courses.models import Change, Course, CourseUpdateEvent, \
+    DigestDelivery, Lesson, OutboxEvent, Payment, Subscription, Upload
+from courses.paginators import EstimatedCountPaginator
 from users.models import User
 
 
@@ -31,6 +61,8 @@ class LessonTest(APITestCase):
 
     def setUp(self) -> None:
         """Set up initial objects for each test"""
+        # Cached pages of previous tests
+        cache.clear()
         # Create MEMBER user
         self.create_member()
         # Create MODERATOR user
@@ -169,3 +201,1686 @@ class LessonTest(APITestCase):
         )
 
 
+@mock.patch.object(outbox, 'wake_relay')
+class OutboxTest(TestCase):
+
+    def test_publish_in_transaction(self, wake_relay):
+        """Testing that events are recorded only if transaction commits"""
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                outbox.publish('config.tasks.notify_subscribers', 1)
+        wake_relay.assert_called_once()
+
+        try:
+            with transaction.atomic():
+                outbox.publish('config.tasks.notify_subscribers', 2)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+
+        self.assertEqual(
+            list(OutboxEvent.objects.values_list('args', flat=True)),
+            [[1]]
+        )
+
+    def test_deduplication(self, wake_relay):
+        """Testing that events with the same key are recorded once"""
+        for _ in range(2):
+            outbox.publish('config.tasks.notify_subscribers', 1,
+                           event_key='course-updated:1')
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+
+    @mock.patch.object(outbox.app, 'send_task')
+    def test_relay(self, send_task, wake_relay):
+        """Testing that relay sends pending events in batches"""
+        for course_id in range(5):
+            outbox.publish('config.tasks.notify_subscribers', course_id)
+
+        self.assertEqual(outbox.relay(batch_size=2), 5)
+        self.assertEqual(send_task.call_count, 5)
+        self.assertFalse(
+            OutboxEvent.objects.filter(sent_at__isnull=True).exists()
+        )
+        # Sent events are not sent again
+        self.assertEqual(outbox.relay(), 0)
+
+    @mock.patch.object(outbox.app, 'send_task')
+    def test_relay_failure(self, send_task, wake_relay):
+        """Testing that events sent before failure of broker are kept"""
+        for course_id in range(5):
+            outbox.publish('config.tasks.notify_subscribers', course_id)
+        send_task.side_effect = [None, None, OSError('broker is down')]
+
+        with self.assertRaises(OSError):
+            outbox.relay(batch_size=5)
+        self.assertEqual(OutboxEvent.objects.filter(sent_at__isnull=True)
+                         .count(), 3)
+
+        send_task.reset_mock(side_effect=True)
+        self.assertEqual(outbox.relay(), 3)
+        self.assertEqual(
+            [call.kwargs['args'][0] for call in send_task.call_args_list],
+            [2, 3, 4]
+        )
+
+
+class CourseCountersTest(TestCase):
+
+    def setUp(self) -> None:
+        """Set up initial objects for each test"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.course = Course.objects.create(
+            name='test course',
+            description='course description'
+        )
+
+    def test_counters(self):
+        """Testing that counters follow related objects"""
+        lesson = Lesson.objects.create(name='test lesson',
+                                       description='lesson description',
+                                       course=self.course)
+        subscription = Subscription.objects.create(course=self.course,
+                                                   user=self.user)
+        payment = Payment.objects.create(course=self.course, user=self.user,
+                                         amount=100, type='card')
+        self.course.refresh_from_db()
+        self.assertEqual(
+            (self.course.lesson_count, self.course.subscriber_count,
+             self.course.revenue_total),
+            (1, 1, 100)
+        )
+
+        lesson.delete()
+        subscription.delete()
+        payment.delete()
+        self.course.refresh_from_db()
+        self.assertEqual(
+            (self.course.lesson_count, self.course.subscriber_count,
+             self.course.revenue_total),
+            (0, 0, 0)
+        )
+
+    @mock.patch.object(outbox, 'wake_relay')
+    def test_move_lesson(self, wake_relay):
+        """Testing that lesson counts follow lesson to another course"""
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.course.owner = self.user
+        self.course.save()
+        other_course = Course.objects.create(name='test course 2',
+                                             description='course description',
+                                             owner=self.user)
+        lesson = Lesson.objects.create(name='test lesson',
+                                       description='lesson description',
+                                       course=self.course, owner=self.user)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('courses:courses-detail', args=[self.course.pk])
+        self.assertEqual(client.get(url).json()['lesson_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(
+                reverse('courses:lesson-update', args=[lesson.pk]),
+                {'course': other_course.pk}
+            )
+        self.assertEqual(response.status_code, 200)
+        # Saving again does not move it twice
+        lesson = Lesson.objects.get(pk=lesson.pk)
+        lesson.save()
+
+        self.course.refresh_from_db()
+        other_course.refresh_from_db()
+        self.assertEqual(self.course.lesson_count, 0)
+        self.assertEqual(other_course.lesson_count, 1)
+        # Cached representation of the previous course is dropped
+        self.assertEqual(client.get(url).json()['lesson_count'], 0)
+
+    def test_repair(self):
+        """Testing recomputation of drifted counters"""
+        Lesson.objects.create(name='test lesson',
+                              description='lesson description',
+                              course=self.course)
+        Course.objects.update(lesson_count=10, subscriber_count=5,
+                              revenue_total=3)
+
+        call_command('repair_course_counters', stdout=mock.Mock())
+
+        self.course.refresh_from_db()
+        self.assertEqual(
+            (self.course.lesson_count, self.course.subscriber_count,
+             self.course.revenue_total),
+            (1, 0, 0)
+        )
+
+
+class WritePathTest(APITestCase):
+
+    def setUp(self) -> None:
+        """Set up initial objects for each test"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.course = Course.objects.create(name='test course',
+                                            description='course description',
+                                            owner=self.user)
+        self.lesson = Lesson.objects.create(name='test lesson',
+                                            description='lesson description',
+                                            course=self.course,
+                                            owner=self.user)
+        self.client.force_authenticate(self.user)
+
+    def count_writes(self, request):
+        """Returns number of INSERT and UPDATE statements per table"""
+        with CaptureQueriesContext(connection) as context:
+            response = request()
+        self.assertLess(response.status_code, 300, response.content)
+
+        writes = {}
+        for query in context.captured_queries:
+            words = query['sql'].replace('"', '').split()
+            if words[0] == 'INSERT':
+                table = words[words.index('INTO') + 1]
+            elif words[0] == 'UPDATE':
+                table = words[1]
+            else:
+                continue
+            writes[table] = writes.get(table, 0) + 1
+        return writes
+
+    def test_create_course(self):
+        """Testing that course is created with one INSERT"""
+        writes = self.count_writes(lambda: self.client.post(
+            reverse('courses:courses-list'),
+            data={'name': 'test course2', 'description': 'description'}
+        ))
+        self.assertEqual(writes, {'courses_course': 1})
+        self.assertTrue(Course.objects.filter(name='test course2',
+                                              owner=self.user).exists())
+
+    def test_create_lesson(self):
+        """Testing that lesson is created with one INSERT"""
+        writes = self.count_writes(lambda: self.client.post(
+            reverse('courses:lesson-create'),
+            data={'name': 'test lesson2', 'description': 'description',
+                  'course': self.course.id}
+        ))
+        # Course row is touched by lesson counter only
+        self.assertEqual(writes, {'courses_lesson': 1, 'courses_course': 1})
+        self.assertTrue(Lesson.objects.filter(name='test lesson2',
+                                              owner=self.user).exists())
+
+    def test_subscribe(self):
+        """Testing that subscription is created with one INSERT"""
+        writes = self.count_writes(lambda: self.client.post(
+            reverse('courses:subscribe'),
+            data={'course': self.course.id}
+        ))
+        self.assertEqual(writes,
+                         {'courses_subscription': 1, 'courses_course': 1})
+        self.assertTrue(Subscription.objects.filter(user=self.user).exists())
+
+    @mock.patch('courses.services.get_payment_status', return_value='paid')
+    @mock.patch('courses.services.create_payment', return_value='pi_test')
+    def test_create_payment(self, create_payment, get_payment_status):
+        """Testing that payment is created with one INSERT"""
+        writes = self.count_writes(lambda: self.client.post(
+            reverse('courses:payment-create', kwargs={'pk': self.course.id}),
+            data={'amount': 100, 'type': 'card'}
+        ))
+        self.assertEqual(writes, {'courses_payment': 1, 'courses_course': 1})
+        self.assertTrue(Payment.objects.filter(user=self.user,
+                                               course=self.course).exists())
+
+    def test_update_lesson(self):
+        """Testing that lesson update saves lesson and course once"""
+        writes = self.count_writes(lambda: self.client.patch(
+            reverse('courses:lesson-update', kwargs={'pk': self.lesson.id}),
+            data={'name': 'test lesson updated'}
+        ))
+        self.assertEqual(writes, {'courses_lesson': 1, 'courses_course': 1,
+                                  'courses_outboxevent': 1})
+        self.course.refresh_from_db()
+        self.assertIsNotNone(self.course.updated_at)
+
+    def test_update_course(self):
+        """Testing that course update saves changed fields once"""
+        with CaptureQueriesContext(connection) as context:
+            self.client.patch(
+                reverse('courses:courses-detail',
+                        kwargs={'pk': self.course.id}),
+                data={'name': 'test course updated'}
+            )
+        updates = [query['sql'] for query in context.captured_queries
+                   if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        # Only changed column is written
+        self.assertNotIn('description', updates[0])
+
+
+class PageCacheTest(APITestCase):
+
+    def setUp(self) -> None:
+        """Set up initial objects and clean cache for each test"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.course = Course.objects.create(name='test course',
+                                            description='course description',
+                                            owner=self.user)
+        Lesson.objects.create(name='test lesson',
+                              description='lesson description',
+                              course=self.course, owner=self.user)
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def test_cached_pages(self):
+        """Testing that cached pages are served without queries"""
+        response = self.client.get(reverse('courses:lesson-list'))
+        self.assertEqual(response.json()['count'], 1)
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('courses:lesson-list'))
+        self.assertEqual(cached.json(), response.json())
+
+        response = self.client.get(
+            reverse('courses:courses-detail', kwargs={'pk': self.course.id})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['is_subscribed'])
+        self.assertEqual(len(response.json()['lessons']), 1)
+
+    def test_invalidation(self):
+        """Testing that changes drop cached pages after commit"""
+        self.client.get(reverse('courses:lesson-list'))
+        self.client.get(
+            reverse('courses:courses-detail', kwargs={'pk': self.course.id})
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Lesson.objects.create(name='test lesson2',
+                                  description='lesson description',
+                                  course=self.course, owner=self.user)
+
+        response = self.client.get(reverse('courses:lesson-list'))
+        self.assertEqual(response.json()['count'], 2)
+        response = self.client.get(
+            reverse('courses:courses-detail', kwargs={'pk': self.course.id})
+        )
+        self.assertEqual(response.json()['lesson_count'], 2)
+
+    def test_permissions(self):
+        """Testing that cached course is not shown to other users"""
+        self.client.get(
+            reverse('courses:courses-detail', kwargs={'pk': self.course.id})
+        )
+        self.client.force_authenticate(
+            User.objects.create(email='test2@gmail.com')
+        )
+        response = self.client.get(
+            reverse('courses:courses-detail', kwargs={'pk': self.course.id})
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_stale_entry(self):
+        """Testing that entry built before a write is not read after it"""
+        key = caching.course_key(self.course.pk)
+        # Version seen by a request that reads the course before the write
+        stale_key = versioned_keys([key], settings.PAGE_CACHE_TIMEOUT)[key]
+        stale = {'id': self.course.pk, 'name': 'test course',
+                 'owner': self.user.pk}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Course.objects.filter(pk=self.course.pk).update(name='new name')
+            caching.invalidate(key)
+        # The request stores its entry after invalidation
+        cache.set(stale_key, stale, settings.PAGE_CACHE_TIMEOUT)
+
+        response = self.client.get(
+            reverse('courses:courses-detail', kwargs={'pk': self.course.id})
+        )
+        self.assertEqual(response.json()['name'], 'new name')
+
+    def test_primary_reads(self):
+        """Testing that entries are built from the primary"""
+        # Alias of replica is not configured, reading it would fail
+        with mock.patch.object(db_router, 'choose_replica',
+                               return_value='lagging'):
+            response = self.client.get(reverse('courses:lesson-list'))
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_absolute_urls(self):
+        """Testing that cached file URLs are absolute for each request"""
+        Course.objects.filter(pk=self.course.pk).update(
+            preview='courses/preview.png'
+        )
+        url = reverse('courses:courses-detail', kwargs={'pk': self.course.id})
+        for _ in range(2):
+            response = self.client.get(url)
+            self.assertEqual(response.json()['preview'],
+                             'http://testserver/media/courses/preview.png')
+        with self.settings(ALLOWED_HOSTS=['example.com']):
+            response = self.client.get(url, HTTP_HOST='example.com')
+        self.assertEqual(response.json()['preview'],
+                         'http://example.com/media/courses/preview.png')
+
+        response = self.client.get(reverse('courses:courses-list'))
+        self.assertEqual(response.json()['results'][0]['preview'],
+                         'http://testserver/media/courses/preview.png')
+
+
+class CacheWarmupTest(TransactionTestCase):
+
+    def test_warm_cache(self):
+        """Testing that warmup caches hot courses and pages of owners"""
+        user = User.objects.create(email='test@gmail.com')
+        courses = [
+            Course.objects.create(name=f'test course {i}',
+                                  description='course description',
+                                  owner=user)
+            for i in range(3)
+        ]
+        Subscription.objects.create(course=courses[2], user=user)
+        cache.clear()
+
+        out = StringIO()
+        with self.settings(CACHE_WARM_LIMIT=2):
+            call_command('warm_cache', '--concurrency', '2', stdout=out)
+
+        # 2 courses, pages of owner and of moderators
+        self.assertIn('Warmed 6 cache keys', out.getvalue())
+        self.assertEqual(
+            caching.get_cached(caching.course_key(courses[2].pk))['name'],
+            'test course 2'
+        )
+        self.assertIsNone(
+            caching.get_cached(caching.course_key(courses[1].pk))
+        )
+        self.assertEqual(
+            caching.get_cached(caching.course_page_key(user.pk))['count'], 3
+        )
+        self.assertEqual(
+            caching.get_cached(caching.lesson_page_key(caching.ALL))['count'],
+            0
+        )
+
+
+class ServeCommandTest(TestCase):
+
+    def serve(self, *args):
+        """Runs serve command, returns gunicorn application not started"""
+        from gunicorn.app.base import BaseApplication
+
+        with mock.patch.object(BaseApplication, 'run', autospec=True) as run:
+            call_command('serve', *args)
+        return run.call_args.args[0]
+
+    def test_wsgi(self):
+        """Testing preloaded WSGI application with warmed up workers"""
+        app = self.serve('--workers', '3', '--max-requests', '1000')
+
+        self.assertTrue(app.cfg.preload_app)
+        self.assertEqual(app.cfg.workers, 3)
+        self.assertEqual(app.cfg.max_requests_jitter, 100)
+        self.assertEqual(app.cfg.settings['worker_class'].get(), 'sync')
+        with mock.patch('config.warmup.warm_worker') as warm_worker:
+            app.cfg.post_worker_init(mock.Mock())
+        warm_worker.assert_called_once()
+        with mock.patch('config.warmup.preload') as preload:
+            from config.wsgi import application
+            self.assertIs(app.load(), application)
+        preload.assert_called_once()
+
+    def test_asgi(self):
+        """Testing that ASGI workers are not warmed up"""
+        app = self.serve('--interface', 'asgi')
+
+        self.assertEqual(app.cfg.settings['worker_class'].get(),
+                         'uvicorn.workers.UvicornWorker')
+        with mock.patch('config.warmup.warm_worker') as warm_worker:
+            app.cfg.post_worker_init(mock.Mock())
+        warm_worker.assert_not_called()
+
+    def test_no_warmup(self):
+        """Testing that warmup can be skipped"""
+        app = self.serve('--no-warmup')
+
+        with mock.patch('config.warmup.warm_worker') as warm_worker, \
+                mock.patch('config.warmup.preload') as preload:
+            app.cfg.post_worker_init(mock.Mock())
+            app.load()
+        warm_worker.assert_not_called()
+        preload.assert_not_called()
+
+
+class ImportDataTest(TestCase):
+
+    def test_copy_stream(self):
+        """Testing conversion of CSV and NDJSON rows for COPY"""
+        rows = importer.read_rows(StringIO(
+            '{"email": "test@gmail.com", "is_active": false}\n'
+            '\n'
+            '{"email": "test2@gmail.com", "city": "Paris, France"}\n'
+        ), 'ndjson')
+        stream = importer.CopyStream(rows, ('email', 'city', 'is_active'))
+        self.assertEqual(stream.read(10), 'test@gmail')
+        self.assertEqual(stream.read(),
+                         '.com,,false\r\n'
+                         'test2@gmail.com,"Paris, France",\r\n')
+        self.assertEqual(stream.read(), '')
+        self.assertEqual(stream.count, 2)
+
+        rows = importer.read_rows(StringIO('id,name\n1,test course\n'),
+                                  'csv')
+        self.assertEqual(list(rows), [{'id': '1', 'name': 'test course'}])
+
+    def test_hash_passwords(self):
+        """Testing password hashing in process pool"""
+        rows = [{'email': 'test@gmail.com', 'password': 'test'},
+                {'email': 'test2@gmail.com', 'password_hash': 'md5$legacy'},
+                {'email': 'test3@gmail.com', 'password': ''}]
+        with importer.create_pool(2) as pool:
+            rows = list(importer.hash_passwords(rows, pool, batch_size=2))
+
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(check_password('test', rows[0]['password']))
+        self.assertEqual(rows[1]['password'], 'md5$legacy')
+        # Unusable password
+        self.assertTrue(rows[2]['password'].startswith('!'))
+
+    def partition_tables(self):
+        with connection.cursor() as cursor:
+            return partitions.partition_tables(cursor)
+
+    def write(self, directory, name, content):
+        path = os.path.join(directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY of PostgreSQL')
+    def test_import(self):
+        """Testing import of all entities with upserts and counters"""
+        owner = User.objects.create(email='owner@gmail.com', city='Rome')
+        owner.set_password('old')
+        owner.save()
+        course = Course.objects.create(name='old course',
+                                       description='course description',
+                                       owner=owner)
+        paid_at = timezone.now().isoformat()
+        with tempfile.TemporaryDirectory() as directory:
+            files = {
+                'users': self.write(directory, 'users.csv', (
+                    'email,password,city,role\n'
+                    'owner@gmail.com,secret,Paris,moderator\n'
+                    'test@gmail.com,test,,moderator\n'
+                    'test2@gmail.com,,,\n'
+                )),
+                'courses': self.write(directory, 'courses.ndjson', (
+                    f'{{"id": {course.pk}, "name": "updated course", '
+                    f'"owner_email": "owner@gmail.com"}}\n'
+                    f'{{"id": {course.pk + 100}, "name": "new course", '
+                    f'"owner_email": "test@gmail.com"}}\n'
+                )),
+                'lessons': self.write(directory, 'lessons.csv', (
+                    'id,name,course_id,owner_email\n'
+                    f'500,test lesson,{course.pk},owner@gmail.com\n'
+                    f'501,test lesson 2,{course.pk},owner@gmail.com\n'
+                    # Unknown course is skipped
+                    f'502,test lesson 3,{course.pk + 999},owner@gmail.com\n'
+                )),
+                'subscriptions': self.write(directory, 'subscriptions.csv', (
+                    'course_id,user_email\n'
+                    f'{course.pk},test@gmail.com\n'
+                    f'{course.pk},test@gmail.com\n'
+                    f'{course.pk},test2@gmail.com\n'
+                )),
+                'payments': self.write(directory, 'payments.csv', (
+                    'id,user_email,date_paid,course_id,lesson_id,amount,type\n'
+                    f'700,test@gmail.com,{paid_at},{course.pk},,100,card\n'
+                    f'701,test2@gmail.com,{paid_at},{course.pk},,250,cash\n'
+                    f'702,test2@gmail.com,{paid_at},,500,30,card\n'
+                    # Month without partition
+                    f'703,test2@gmail.com,2019-05-10T12:00:00+00:00,,,40,card\n'
+                )),
+            }
+            for entity, path in files.items():
+                call_command('import_data', entity, path, processes=1,
+                             stdout=StringIO())
+
+        self.assertEqual(User.objects.count(), 3)
+        owner.refresh_from_db()
+        # Upserted by email, keeps id, credentials and role
+        self.assertEqual(owner.city, 'Paris')
+        self.assertTrue(owner.check_password('old'))
+        self.assertEqual(owner.role, 'member')
+        self.assertEqual(User.objects.get(email='test@gmail.com').role,
+                         'moderator')
+        self.assertFalse(User.objects.get(email='test2@gmail.com')
+                         .has_usable_password())
+
+        course.refresh_from_db()
+        self.assertEqual(course.name, 'updated course')
+        self.assertEqual(Course.objects.get(pk=course.pk + 100).owner.email,
+                         'test@gmail.com')
+        self.assertEqual(
+            set(Lesson.objects.values_list('pk', flat=True)), {500, 501}
+        )
+        self.assertEqual(Subscription.objects.count(), 2)
+        self.assertEqual(Payment.objects.count(), 4)
+        self.assertEqual(Payment.objects.get(pk=702).lesson_id, 500)
+        # Historical payment got partition of its month
+        self.assertIn('courses_payment_y2019m05', self.partition_tables())
+        self.assertEqual(partitions.default_months(), [])
+        # Counters are recomputed after import
+        self.assertEqual((course.lesson_count, course.subscriber_count,
+                          course.revenue_total), (2, 2, 350))
+
+        # Payment with corrected date is moved, not duplicated
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write(directory, 'payments.csv', (
+                'id,user_email,date_paid,course_id,lesson_id,amount,type\n'
+                f'701,test2@gmail.com,2019-05-11T12:00:00+00:00,'
+                f'{course.pk + 100},,250,cash\n'
+            ))
+            call_command('import_data', 'payments', path, processes=1,
+                         stdout=StringIO())
+        self.assertEqual(Payment.objects.filter(pk=701).count(), 1)
+        self.assertEqual(Payment.objects.get(pk=701).date_paid.day, 11)
+        # Counters of the previous course are recomputed as well
+        course.refresh_from_db()
+        self.assertEqual(course.revenue_total, 100)
+        self.assertEqual(Course.objects.get(pk=course.pk + 100).revenue_total,
+                         250)
+
+        # Sequences continue after legacy ids
+        self.assertGreater(
+            Course.objects.create(name='test course',
+                                  description='course description',
+                                  owner=owner).pk, course.pk + 100
+        )
+        self.assertGreater(
+            Lesson.objects.create(name='test lesson',
+                                  description='lesson description',
+                                  course=course, owner=owner).pk, 501
+        )
+        self.assertGreater(
+            Payment.objects.create(user=owner, amount=10, type='card').pk,
+            703
+        )
+
+    def test_requires_postgresql(self):
+        """Testing that import is refused on other databases"""
+        if connection.vendor == 'postgresql':
+            self.skipTest('PostgreSQL is used')
+        with self.assertRaises(CommandError):
+            call_command('import_data', 'users', 'users.csv')
+
+
+class PaymentPartitionTest(APITestCase):
+
+    def test_add_months(self):
+        """Testing month arithmetic of partition bounds"""
+        month = datetime.date(2026, 11, 1)
+        self.assertEqual(partitions.add_months(month, 2),
+                         datetime.date(2027, 1, 1))
+        self.assertEqual(partitions.add_months(month, -11),
+                         datetime.date(2025, 12, 1))
+        self.assertEqual(partitions.partition_name(month),
+                         'courses_payment_y2026m11')
+
+    def partition_of(self, payment):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT tableoid::regclass::text FROM courses_payment '
+                'WHERE id = %s', [payment.pk]
+            )
+            return cursor.fetchone()[0]
+
+    @skipUnless(connection.vendor == 'postgresql', 'Partitions of PostgreSQL')
+    def test_maintain(self):
+        """Testing split of default partition and archival of old months"""
+        user = User.objects.create(email='test@gmail.com')
+        old, kept = [Payment.objects.create(user=user, amount=amount,
+                                            type='card')
+                     for amount in (100, 200)]
+        for payment, month in ((old, datetime.date(2019, 5, 1)),
+                               (kept, partitions.add_months(
+                                   partitions.current_month(), -6))):
+            Payment.objects.filter(pk=payment.pk).update(
+                date_paid=datetime.datetime.combine(
+                    month, datetime.time(12), tzinfo=datetime.timezone.utc
+                )
+            )
+        self.assertEqual(self.partition_of(old), 'courses_payment_default')
+
+        with tempfile.TemporaryDirectory() as directory:
+            archives = partitions.maintain(months_ahead=1, retain_months=36,
+                                           archive_dir=directory)
+            self.assertEqual(archives, [
+                os.path.join(directory, 'courses_payment_y2019m05.csv.gz')
+            ])
+            with gzip.open(archives[0], 'rt') as file:
+                rows = file.read().splitlines()
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[1].startswith(f'{old.pk},'))
+
+        self.assertFalse(Payment.objects.filter(pk=old.pk).exists())
+        self.assertEqual(self.partition_of(kept), partitions.partition_name(
+            partitions.add_months(partitions.current_month(), -6)
+        ))
+        self.assertEqual(partitions.default_months(), [])
+        with connection.cursor() as cursor:
+            self.assertNotIn('courses_payment_y2019m05',
+                             partitions.partition_tables(cursor))
+        # Nothing left to do
+        self.assertEqual(partitions.maintain(retain_months=36,
+                                             archive_dir=directory), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Partitions of PostgreSQL')
+    def test_archive_detached_partition(self):
+        """Testing archival of partition detached by interrupted run"""
+        month = datetime.date(2019, 5, 1)
+        self.assertEqual(partitions.add_partitions([month]),
+                         ['courses_payment_y2019m05'])
+        name = partitions.partition_name(month)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE courses_payment '
+                           f'DETACH PARTITION {name}')
+        with tempfile.TemporaryDirectory() as directory:
+            path = partitions.archive_partition(name, directory)
+            self.assertTrue(os.path.exists(path))
+        self.assertEqual(partitions.old_partitions(36), [])
+
+    @mock.patch('courses.services.get_payment_status', return_value='paid')
+    def test_date_filter(self, get_payment_status):
+        """Testing that payments can be filtered by date range"""
+        user = User.objects.create(email='test@gmail.com')
+        old = Payment.objects.create(user=user, amount=100, type='card')
+        Payment.objects.filter(pk=old.pk).update(
+            date_paid=datetime.datetime(2025, 1, 15,
+                                        tzinfo=datetime.timezone.utc)
+        )
+        Payment.objects.create(user=user, amount=200, type='card')
+        self.client.force_authenticate(user)
+
+        response = self.client.get(reverse('courses:payments-list'),
+                                   {'date_paid__gte': '2026-01-01'})
+        self.assertEqual([payment['amount'] for payment in response.json()],
+                         [200])
+        response = self.client.get(reverse('courses:payments-list'),
+                                   {'date_paid__lt': '2026-01-01',
+                                    'type': 'card'})
+        self.assertEqual([payment['amount'] for payment in response.json()],
+                         [100])
+
+
+@mock.patch.object(outbox, 'wake_relay')
+class DeletionTest(APITestCase):
+
+    def setUp(self) -> None:
+        """Set up course with lessons, subscription and payments"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.course = Course.objects.create(name='test course',
+                                            description='course description',
+                                            owner=self.user)
+        self.lessons = [
+            Lesson.objects.create(name=f'test lesson {i}',
+                                  description='lesson description',
+                                  course=self.course, owner=self.user)
+            for i in range(3)
+        ]
+        Subscription.objects.create(course=self.course, user=self.user)
+        Payment.objects.create(course=self.course, user=self.user,
+                               amount=100, type='card')
+        Payment.objects.create(lesson=self.lessons[0], user=self.user,
+                               amount=10, type='card')
+        self.client.force_authenticate(self.user)
+
+    def test_destroy_course(self, wake_relay):
+        """Testing that course is hidden at once and purged in chunks"""
+        response = self.client.delete(
+            reverse('courses:courses-detail', kwargs={'pk': self.course.id})
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Course.objects.exists())
+        self.assertFalse(Lesson.objects.exists())
+        self.assertTrue(Course.all_objects.exists())
+        self.assertTrue(OutboxEvent.objects.filter(
+            task_name='config.tasks.purge_course', args=[self.course.id]
+        ).exists())
+
+        progress = mock.Mock()
+        deleted = deletion.purge_course(self.course.id, chunk_size=2,
+                                        progress=progress)
+
+        # Subscription, 2 payments, 3 lessons and course
+        self.assertEqual(deleted, 7)
+        progress.assert_any_call('courses.Lesson', 2)
+        progress.assert_any_call('courses.Lesson', 3)
+        self.assertFalse(Course.all_objects.exists())
+        self.assertFalse(Lesson.all_objects.exists())
+        self.assertFalse(Payment.objects.exists())
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_purge_replaces_receivers(self, wake_relay):
+        """Testing that purge drops access and leaderboard entries"""
+        self.course.deleted_at = timezone.now()
+        self.course.save()
+        entitlements.for_user(self.user)
+        key = version_key(entitlements.entitlements_key(self.user.pk))
+        self.addCleanup(cache.clear)
+        self.assertIsNotNone(cache.get(key))
+
+        with mock.patch.object(leaderboards, '_remove') as remove, \
+                self.captureOnCommitCallbacks(execute=True):
+            deletion.purge_course(self.course.id)
+        self.assertIsNone(cache.get(key))
+        remove.assert_called_with([self.course.id])
+
+    def test_destroy_course_with_update_events(self, wake_relay):
+        """Testing that update events of digests are purged with course"""
+        CourseUpdateEvent.objects.create(course=self.course)
+        CourseUpdateEvent.objects.create(course=self.course)
+        self.course.deleted_at = timezone.now()
+        self.course.save()
+
+        # Subscription, 2 payments, 3 lessons, 2 events and course
+        self.assertEqual(deletion.purge_course(self.course.id), 9)
+        self.assertFalse(CourseUpdateEvent.objects.exists())
+        self.assertFalse(Course.all_objects.exists())
+
+    def test_destroy_lesson(self, wake_relay):
+        """Testing that lesson is hidden at once with counters updated"""
+        response = self.client.delete(
+            reverse('courses:lesson-delete', kwargs={'pk': self.lessons[0].id})
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.lesson_count, 2)
+
+        self.assertEqual(deletion.purge_lesson(self.lessons[0].id), 2)
+        self.assertEqual(Lesson.all_objects.count(), 2)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_purge_requires_mark(self, wake_relay):
+        """Testing that courses not marked for deletion are kept"""
+        self.assertEqual(deletion.purge_course(self.course.id), 0)
+        self.assertEqual(Lesson.objects.count(), 3)
+
+
+@override_settings(NOTIFICATION_MODE='digest',
+                   DIGEST_INTERVAL=datetime.timedelta(hours=1))
+class DigestTest(APITestCase):
+
+    def setUp(self) -> None:
+        """Set up user subscribed to two courses"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.other_user = User.objects.create(email='test2@gmail.com')
+        self.courses = [
+            Course.objects.create(name=f'test course {i}',
+                                  description='course description',
+                                  owner=self.other_user)
+            for i in range(3)
+        ]
+        for course in self.courses[:2]:
+            Subscription.objects.create(course=course, user=self.user)
+        Subscription.objects.create(course=self.courses[2],
+                                    user=self.other_user)
+        self.window_end = notifications.current_window_end() \
+            + datetime.timedelta(hours=1)
+
+    def test_update_records_event(self):
+        """Testing that course updates are recorded instead of emails"""
+        self.client.force_authenticate(self.other_user)
+        self.client.patch(
+            reverse('courses:courses-detail',
+                    kwargs={'pk': self.courses[0].id}),
+            data={'name': 'test course updated'}
+        )
+        self.assertEqual(CourseUpdateEvent.objects.count(), 1)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_send_digests(self):
+        """Testing one email per user listing all updated courses"""
+        for course in (self.courses[0], self.courses[0], self.courses[1]):
+            notifications.course_updated(course.id)
+
+        sent = notifications.send_digests(window_end=self.window_end)
+
+        self.assertEqual(sent, 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['test@gmail.com'])
+        self.assertIn(' - test course 0\n - test course 1',
+                      mail.outbox[0].body)
+        self.assertFalse(CourseUpdateEvent.objects.exists())
+
+    def test_retry_is_idempotent(self):
+        """Testing that retried window does not send digest again"""
+        notifications.course_updated(self.courses[0].id)
+        notifications.course_updated(self.courses[2].id)
+        DigestDelivery.objects.create(user=self.user,
+                                      window_end=self.window_end)
+
+        notifications.send_digests(window_end=self.window_end)
+
+        self.assertEqual([message.to for message in mail.outbox],
+                         [['test2@gmail.com']])
+
+
+@override_settings(SSE_HEARTBEAT_SECONDS=0.2)
+class EventStreamTest(TransactionTestCase):
+
+    def setUp(self) -> None:
+        """Set up subscribed user and Redis shared by sync and async code"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.courses = [
+            Course.objects.create(name=f'test course {i}',
+                                  description='course description')
+            for i in range(2)
+        ]
+        Subscription.objects.create(course=self.courses[0], user=self.user)
+        server = fakeredis.FakeServer()
+        for patcher in (
+            mock.patch.object(events, 'get_redis',
+                              lambda: fakeredis.FakeRedis(server=server)),
+            mock.patch.object(stream, 'get_async_redis',
+                              lambda: fakeredis.aioredis.FakeRedis(
+                                  server=server)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_stream(self, scenario, headers=(), query=''):
+        """
+        Connects to event stream, runs scenario(wait_for) in a thread and
+        disconnects. Returns response status and body.
+        """
+        scope = {'type': 'http', 'path': '/events/', 'headers': [
+            (name.encode(), value.encode()) for name, value in headers
+        ], 'query_string': query.encode()}
+        response = {'status': None, 'body': ''}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            else:
+                response['body'] += message['body'].decode()
+
+        async def main():
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            app = asyncio.create_task(
+                stream.application(scope, receive, send)
+            )
+            loop = asyncio.get_running_loop()
+
+            def wait_for(text):
+                for _ in range(100):
+                    if text in response['body'] or app.done():
+                        return
+                    time.sleep(0.05)
+                self.fail(f'{text!r} not in {response["body"]!r}')
+
+            await loop.run_in_executor(None, scenario, wait_for)
+            disconnected.set()
+            await app
+
+        asyncio.run(main())
+        return response['status'], response['body']
+
+    def test_live_events(self):
+        """Testing delivery of events of subscribed courses only"""
+        token = AccessToken.for_user(self.user)
+
+        def scenario(wait_for):
+            wait_for('retry: ')
+            self.courses[0].name = 'test course updated'
+            self.courses[0].save()
+            Lesson.objects.create(name='test lesson',
+                                  description='lesson description',
+                                  course=self.courses[1])
+            wait_for('course.updated')
+            wait_for(': ping')
+
+            # New subscription is picked up by open stream
+            Subscription.objects.create(course=self.courses[1],
+                                        user=self.user)
+            for _ in range(100):
+                if any(events.course_channel(self.courses[1].id) in
+                       hub.listeners for hub in stream._hubs.values()):
+                    break
+                time.sleep(0.05)
+            Lesson.objects.create(name='test lesson 2',
+                                  description='lesson description',
+                                  course=self.courses[1])
+            wait_for('lesson.created')
+
+        status_code, body = self.run_stream(scenario, query=f'token={token}')
+
+        self.assertEqual(status_code, 200)
+        self.assertIn('event: course.updated\n', body)
+        self.assertEqual(body.count('event: lesson.created'), 1)
+        self.assertFalse(any(hub.listeners for hub in stream._hubs.values()))
+
+    def test_resume(self):
+        """Testing replay of missed events after Last-Event-ID"""
+        for course in self.courses + self.courses:
+            course.save()
+        first, second, _, fourth = [
+            event_id.decode() for event_id, _ in
+            events.get_redis().xrange(events.STREAM)
+        ]
+        token = AccessToken.for_user(self.user)
+        headers = [('Authorization', f'Bearer {token}')]
+
+        status_code, body = self.run_stream(
+            lambda wait_for: wait_for('retry: '),
+            headers=headers + [('Last-Event-ID', first)]
+        )
+        self.assertEqual(status_code, 200)
+        # Only event of subscribed course after the first one
+        self.assertEqual(body.count('event: course.updated'), 1)
+        self.assertNotIn('event: reset', body)
+        self.assertNotIn(f'id: {first}', body)
+        self.assertNotIn(f'id: {second}', body)
+        self.assertNotIn(f'id: {fourth}', body)
+
+        # Evicted events cannot be replayed
+        _, body = self.run_stream(lambda wait_for: wait_for('retry: '),
+                                  headers=headers + [('Last-Event-ID', '1-0')])
+        self.assertIn('event: reset', body)
+
+    def test_authentication(self):
+        """Testing that stream requires valid token"""
+        status_code, _ = self.run_stream(lambda wait_for: None,
+                                         query='token=invalid')
+        self.assertEqual(status_code, 401)
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'Changes are recorded by PostgreSQL triggers')
+class SyncTest(APITransactionTestCase):
+    """Rows are committed: sync returns changes of finished transactions"""
+
+    def setUp(self) -> None:
+        """Set up initial objects for each test"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.other_user = User.objects.create(email='test2@gmail.com')
+        self.course = Course.objects.create(name='test course',
+                                            description='course description',
+                                            owner=self.user)
+        self.lesson = Lesson.objects.create(name='test lesson',
+                                            description='lesson description',
+                                            course=self.course,
+                                            owner=self.user)
+        self.subscription = Subscription.objects.create(course=self.course,
+                                                        user=self.user)
+        self.other_course = Course.objects.create(
+            name='test course 2', description='course description',
+            owner=self.other_user
+        )
+        # Committed deletion does not start the relay thread
+        patcher = mock.patch.object(outbox, 'wake_relay')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_authenticate(self.user)
+
+    def sync(self, cursor=None):
+        params = {'cursor': cursor} if cursor else {}
+        response = self.client.get(reverse('courses:sync'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_sync(self):
+        """Testing that sync returns visible changes after cursor"""
+        result = self.sync()
+        # Counters of course are updated after lesson and subscription
+        self.assertEqual(
+            [(change['type'], change['id']) for change in result['changes']],
+            [('lesson', self.lesson.id),
+             ('subscription', self.subscription.id),
+             ('course', self.course.id)]
+        )
+        self.assertEqual(result['changes'][0]['data']['name'], 'test lesson')
+        self.assertFalse(result['has_more'])
+
+        # Nothing changed: horizon and one range query
+        with self.assertNumQueries(2):
+            changes, cursor, _ = sync.changes_since(self.user,
+                                                    result['cursor'])
+        self.assertEqual(changes, [])
+
+        self.lesson.name = 'test lesson updated'
+        self.lesson.save()
+        subscription_id = self.subscription.id
+        self.subscription.delete()
+        self.other_course.save()
+
+        result = self.sync(cursor)
+        self.assertEqual(result['changes'], [
+            {'type': 'lesson', 'id': self.lesson.id, 'deleted': False,
+             'data': {**result['changes'][0]['data'],
+                      'name': 'test lesson updated'}},
+            {'type': 'subscription', 'id': subscription_id,
+             'deleted': True, 'data': None},
+            {'type': 'course', 'id': self.course.id, 'deleted': False,
+             'data': {**result['changes'][2]['data'],
+                      'subscriber_count': 0}},
+        ])
+
+        # Soft deleted course is a tombstone
+        response = self.client.delete(
+            reverse('courses:courses-detail', kwargs={'pk': self.course.id})
+        )
+        self.assertEqual(response.status_code, 204)
+        result = self.sync(result['cursor'])
+        self.assertEqual(result['changes'], [
+            {'type': 'course', 'id': self.course.id, 'deleted': True,
+             'data': None},
+        ])
+
+    def test_pagination(self):
+        """Testing pages of changes and visibility for moderators"""
+        moderator = User.objects.create(email='test3@gmail.com',
+                                        role='moderator')
+        self.client.force_authenticate(moderator)
+
+        seen = []
+        cursor = None
+        with self.settings(SYNC_PAGE_SIZE=2):
+            while True:
+                result = self.sync(cursor)
+                seen.extend((change['type'], change['id'])
+                            for change in result['changes'])
+                cursor = result['cursor']
+                if not result['has_more']:
+                    break
+        # Subscriptions of other users are not visible
+        self.assertEqual(seen, [
+            ('lesson', self.lesson.id), ('course', self.course.id),
+            ('course', self.other_course.id),
+        ])
+
+    def test_change_owner(self):
+        """Testing that previous owner gets tombstone of object"""
+        cursor = self.sync()['cursor']
+        self.client.force_authenticate(self.other_user)
+        other_cursor = self.sync()['cursor']
+
+        self.course.owner = self.other_user
+        self.course.save()
+
+        result = self.sync(other_cursor)
+        self.assertEqual(
+            [(change['id'], change['deleted'])
+             for change in result['changes']],
+            [(self.course.id, False)]
+        )
+        self.client.force_authenticate(self.user)
+        result = self.sync(cursor)
+        self.assertEqual(result['changes'], [
+            {'type': 'course', 'id': self.course.id, 'deleted': True,
+             'data': None},
+        ])
+
+        # Moderators apply tombstone, then the object
+        moderator = User.objects.create(email='test3@gmail.com',
+                                        role='moderator')
+        changes, _, _ = sync.changes_since(moderator)
+        self.assertEqual(
+            [(change['id'], change['deleted']) for change in changes
+             if change['type'] == 'course'],
+            [(self.other_course.id, False), (self.course.id, True),
+             (self.course.id, False)]
+        )
+
+    def test_cursor(self):
+        """Testing invalid and expired cursors and pruning of tombstones"""
+        response = self.client.get(reverse('courses:sync'),
+                                   {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+        cursor = self.sync()['cursor']
+        with self.settings(SYNC_RETENTION=datetime.timedelta(seconds=-1)):
+            response = self.client.get(reverse('courses:sync'),
+                                       {'cursor': cursor})
+            self.assertEqual(response.status_code, 410)
+
+            self.subscription.delete()
+            self.assertEqual(sync.prune(), 1)
+        self.assertFalse(Change.objects.filter(model='subscription').exists())
+
+
+class LeaderboardTest(APITestCase):
+
+    def setUp(self) -> None:
+        """Set up initial objects and Redis for each test"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.other_user = User.objects.create(email='test2@gmail.com')
+        self.courses = [
+            Course.objects.create(name=f'test course {number}',
+                                  description='course description',
+                                  owner=self.user)
+            for number in range(3)
+        ]
+        redis_client = fakeredis.FakeRedis()
+        patcher = mock.patch.object(leaderboards, 'get_redis',
+                                    lambda: redis_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_authenticate(self.user)
+
+    def subscribe(self, course, user):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Subscription.objects.create(course=course, user=user)
+
+    def pay(self, course, amount, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Payment.objects.create(course=course, user=self.user,
+                                          amount=amount, type='card',
+                                          **kwargs)
+
+    def get_board(self, board, **params):
+        response = self.client.get(
+            reverse('courses:leaderboard', args=[board]), params
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    @mock.patch.object(outbox, 'wake_relay')
+    def test_deleted_courses(self, wake_relay):
+        """Testing that deleted courses leave leaderboards"""
+        for course, users in zip(self.courses, (
+                [self.user, self.other_user], [self.user, self.other_user],
+                [self.user])):
+            for user in users:
+                self.subscribe(course, user)
+        self.assertEqual(self.get_board('subscribers')['count'], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse('courses:courses-detail',
+                                                  args=[self.courses[0].pk]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        for window in ('all', 'week'):
+            data = self.get_board('subscribers', window=window)
+            self.assertEqual(data['count'], 2)
+            self.assertEqual(
+                [(item['rank'], item['course']['id'])
+                 for item in data['results']],
+                [(1, self.courses[1].pk), (2, self.courses[2].pk)]
+            )
+
+        # Deleted without signals: skipped by the first read, then removed
+        Course.objects.filter(pk=self.courses[1].pk) \
+            .update(deleted_at=timezone.now())
+        with self.captureOnCommitCallbacks(execute=True):
+            data = self.get_board('subscribers', window='all')
+        self.assertEqual(
+            [(item['rank'], item['course']['id'])
+             for item in data['results']],
+            [(1, self.courses[2].pk)]
+        )
+        self.assertEqual(self.get_board('subscribers', window='all')['count'],
+                         1)
+
+    def test_leaderboard(self):
+        """Testing leaderboards updated by subscriptions and payments"""
+        self.subscribe(self.courses[1], self.user)
+        subscription = self.subscribe(self.courses[1], self.other_user)
+        self.subscribe(self.courses[2], self.user)
+        self.pay(self.courses[0], 500)
+        self.pay(self.courses[2], 100)
+
+        data = self.get_board('subscribers', window='all')
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['results'], [
+            {'rank': 1, 'score': 2, 'course': {
+                'id': self.courses[1].pk, 'name': 'test course 1'}},
+            {'rank': 2, 'score': 1, 'course': {
+                'id': self.courses[2].pk, 'name': 'test course 2'}},
+        ])
+        self.assertEqual(
+            [item['course']['id'] for item
+             in self.get_board('revenue', window='day')['results']],
+            [self.courses[0].pk, self.courses[2].pk]
+        )
+
+        # Unsubscribed courses leave windows containing subscription day
+        with self.captureOnCommitCallbacks(execute=True):
+            subscription.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscription.objects.filter(course=self.courses[2]).delete()
+        self.assertEqual(
+            self.get_board('subscribers', window='all')['results'][0]['score'],
+            1
+        )
+        data = self.get_board('subscribers', window='month')
+        self.assertEqual(data['count'], 1)
+
+        # Pages are read by rank
+        data = self.get_board('revenue', window='all', page=2, page_size=1)
+        self.assertEqual(data['results'][0]['rank'], 2)
+        self.assertIsNone(data['next'])
+
+        response = self.client.get(
+            reverse('courses:leaderboard', args=['revenue']),
+            {'window': 'year'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(
+            reverse('courses:leaderboard', args=['lessons'])
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rebuild(self):
+        """Testing leaderboards rebuilt from the database"""
+        Subscription.objects.create(course=self.courses[0], user=self.user)
+        Subscription.objects.create(course=self.courses[0],
+                                    user=self.other_user)
+        old = Payment.objects.create(course=self.courses[1], user=self.user,
+                                     amount=300, type='card')
+        Payment.objects.filter(pk=old.pk).update(
+            date_paid=timezone.now() - datetime.timedelta(days=10)
+        )
+        Payment.objects.create(course=self.courses[2], user=self.user,
+                               amount=100, type='card')
+        self.assertEqual(self.get_board('subscribers', window='all')['count'],
+                         0)
+
+        leaderboards.rebuild()
+        self.assertEqual(
+            self.get_board('subscribers', window='all')['results'][0],
+            {'rank': 1, 'score': 2, 'course': {
+                'id': self.courses[0].pk, 'name': 'test course 0'}}
+        )
+        self.assertEqual(
+            [(item['course']['id'], item['score']) for item
+             in self.get_board('revenue', window='all')['results']],
+            [(self.courses[1].pk, 300), (self.courses[2].pk, 100)]
+        )
+        self.assertEqual(
+            [item['course']['id'] for item
+             in self.get_board('revenue', window='week')['results']],
+            [self.courses[2].pk]
+        )
+
+    def test_lesson_payments(self):
+        """Testing payments for lessons left out of revenue"""
+        lesson = Lesson.objects.create(name='test lesson',
+                                       description='lesson description',
+                                       course=self.courses[0],
+                                       owner=self.user)
+        self.pay(None, 700, lesson=lesson)
+        self.pay(self.courses[1], 100)
+        expected = [(self.courses[1].pk, 100)]
+        self.assertEqual(
+            [(item['course']['id'], item['score']) for item
+             in self.get_board('revenue', window='all')['results']],
+            expected
+        )
+
+        leaderboards.rebuild()
+        self.assertEqual(
+            [(item['course']['id'], item['score']) for item
+             in self.get_board('revenue', window='all')['results']],
+            expected
+        )
+
+
+class EntitlementTest(APITestCase):
+
+    def setUp(self) -> None:
+        """Set up initial objects for each test"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.other_user = User.objects.create(email='test2@gmail.com')
+        self.course = Course.objects.create(name='test course',
+                                            description='course description',
+                                            owner=self.other_user)
+        self.lesson = Lesson.objects.create(name='test lesson',
+                                            description='lesson description',
+                                            course=self.course,
+                                            owner=self.other_user)
+        self.own_course = Course.objects.create(
+            name='test course 2', description='course description',
+            owner=self.user
+        )
+        cache.clear()
+        # Ids of users are reused by next tests
+        self.addCleanup(cache.clear)
+        self.client.force_authenticate(self.user)
+
+    def test_load(self):
+        """Testing entitlements loaded with one query and cached"""
+        Subscription.objects.create(course=self.course, user=self.user)
+        Payment.objects.create(lesson=self.lesson, user=self.user,
+                               amount=100, type='card')
+        request = mock.Mock(user=self.user, _entitlements=None)
+        with self.assertNumQueries(1):
+            user_entitlements = entitlements.for_request(request)
+            self.assertIs(entitlements.for_request(request),
+                          user_entitlements)
+        self.assertEqual(user_entitlements.subscribed_courses,
+                         {self.course.pk})
+        self.assertEqual(user_entitlements.purchased_lessons,
+                         {self.lesson.pk})
+        self.assertEqual(user_entitlements.purchased_courses, set())
+
+        # Next requests read cache
+        with self.assertNumQueries(0):
+            self.assertTrue(entitlements.for_user(self.user)
+                            .is_subscribed(self.course.pk))
+
+    def test_access(self):
+        """Testing owner checked on object, subscribers denied"""
+        url = reverse('courses:courses-detail', args=[self.course.pk])
+        lesson_url = reverse('courses:lesson-detail', args=[self.lesson.pk])
+        own_url = reverse('courses:courses-detail', args=[self.own_course.pk])
+        response = self.client.get(own_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscription.objects.create(course=self.course, user=self.user)
+            Payment.objects.create(lesson=self.lesson, user=self.user,
+                                   amount=100, type='card')
+        # Subscription or purchase does not grant access
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(lesson_url).status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(self.other_user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.json()['is_subscribed'])
+        self.assertEqual(self.client.get(lesson_url).status_code,
+                         status.HTTP_200_OK)
+
+    @mock.patch.object(outbox, 'wake_relay')
+    def test_change_owner(self, wake_relay):
+        """Testing that previous owner is denied after change of owner"""
+        url = reverse('courses:courses-detail', args=[self.own_course.pk])
+        # Course is cached by the first request
+        self.assertEqual(self.client.get(url).status_code,
+                         status.HTTP_200_OK)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, {'owner': self.other_user.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.client.get(url).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.delete(url).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(self.other_user)
+        self.assertEqual(self.client.get(url).status_code,
+                         status.HTTP_200_OK)
+
+    def test_payment_status(self):
+        """Testing payment of course found by entitlements"""
+        url = reverse('courses:payment-status', args=[self.course.pk])
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Payment.objects.create(course=self.course, user=self.user,
+                                   amount=100, type='card')
+        with self.captureOnCommitCallbacks(execute=True):
+            payment = Payment.objects.create(course=self.course,
+                                             user=self.user, amount=200,
+                                             type='card')
+        with mock.patch('courses.services.get_payment_status',
+                        return_value='paid'):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['id'], payment.pk)
+
+
+class AdminTest(TestCase):
+
+    def setUp(self) -> None:
+        """Set up initial objects for each test"""
+        self.admin = User.objects.create(email='admin@gmail.com',
+                                         is_staff=True, is_superuser=True)
+        self.user = User.objects.create(email='test@gmail.com')
+        self.courses = [
+            Course.objects.create(name=f'test course {number}',
+                                  description='course description',
+                                  owner=self.user)
+            for number in range(3)
+        ]
+        for course in self.courses:
+            Lesson.objects.create(name='test lesson',
+                                  description='lesson description',
+                                  course=course, owner=self.user)
+            Subscription.objects.create(course=course, user=self.user)
+            Payment.objects.create(course=course, user=self.user,
+                                   amount=100, type='card')
+        self.client.force_login(self.admin)
+
+    def test_changelists(self):
+        """Testing lists load related objects with the page"""
+        for name in ('courses_course', 'courses_lesson', 'courses_payment',
+                     'courses_subscription', 'users_user'):
+            url = reverse(f'admin:{name}_changelist')
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            # Adding rows adds no queries
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            Course.objects.create(name='test course 4',
+                                  description='course description',
+                                  owner=self.admin)
+            Payment.objects.create(course=self.courses[0], user=self.admin,
+                                   amount=100, type='card')
+            with self.assertNumQueries(len(queries)):
+                self.client.get(url)
+
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'courses', 'model_name': 'course',
+            'field_name': 'owner', 'term': 'test',
+        })
+        self.assertEqual([item['text'] for item in response.json()['results']],
+                         ['test@gmail.com'])
+
+    def test_estimated_count(self):
+        """Testing counts estimated on PostgreSQL"""
+        queryset = Course.objects.all()
+        self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 3)
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+                mock.patch.object(EstimatedCountPaginator,
+                                  'planner_estimate', return_value=50000):
+            self.assertEqual(EstimatedCountPaginator(queryset, 10).count,
+                             50000)
+            with mock.patch.object(EstimatedCountPaginator,
+                                   'planner_estimate', return_value=10):
+                self.assertEqual(
+                    EstimatedCountPaginator(queryset, 10).count, 3
+                )
+
+    def test_actions(self):
+        """Testing bulk actions"""
+        url = reverse('admin:courses_course_changelist')
+        Course.objects.filter(pk=self.courses[0].pk).update(lesson_count=0)
+        self.client.post(url, {'action': 'recompute',
+                               '_selected_action': [self.courses[0].pk]})
+        self.assertEqual(Course.objects.get(pk=self.courses[0].pk)
+                         .lesson_count, 1)
+
+        subscriber = User.objects.create(email='test2@gmail.com')
+        Subscription.objects.create(course=self.courses[0], user=subscriber)
+        # Ids of users are reused by next tests
+        self.addCleanup(cache.clear)
+        for user in (self.user, subscriber):
+            self.assertTrue(entitlements.for_user(user).subscribed_courses)
+        # Estimate of PostgreSQL precedes exact count of small tables
+        queries = 10 if connection.vendor == 'postgresql' else 9
+        with self.assertNumQueries(queries), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {
+                'action': 'mark_deleted',
+                '_selected_action': [course.pk for course in self.courses],
+            })
+        self.assertFalse(Course.objects.exists())
+        # Bulk update drops entitlements of owners and subscribers
+        for user in (self.user, subscriber):
+            self.assertIsNone(cache.get(
+                version_key(entitlements.entitlements_key(user.pk))
+            ))
+            self.assertFalse(entitlements.for_user(user).subscribed_courses)
+        self.assertEqual(
+            OutboxEvent.objects.filter(task_name='config.tasks.purge_course')
+            .count(), 3
+        )
+
+        self.client.post(reverse('admin:users_user_changelist'), {
+            'action': 'deactivate', '_selected_action': [self.user.pk],
+        })
+        self.assertFalse(User.objects.get(pk=self.user.pk).is_active)
+
+
+class UploadTest(APITestCase):
+
+    def setUp(self) -> None:
+        """Set up initial objects and storages for each test"""
+        self.user = User.objects.create(email='test@gmail.com')
+        self.other_user = User.objects.create(email='test2@gmail.com')
+        self.course = Course.objects.create(name='test course',
+                                            description='course description',
+                                            owner=self.user)
+        self.client.force_authenticate(self.user)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.media_root = os.path.join(directory.name, 'media')
+        self.uploads_root = os.path.join(directory.name, 'uploads')
+        storage_settings = self.settings(
+            MEDIA_ROOT=self.media_root, UPLOAD_CHUNK_SIZE=1000,
+            STORAGES={
+                **settings.STORAGES,
+                'default': {
+                    'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                },
+                'uploads': {
+                    'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                    'OPTIONS': {'location': self.uploads_root},
+                },
+            },
+        )
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+
+        image = BytesIO()
+        # Noise is not compressed, file takes several chunks
+        Image.frombytes('RGB', (40, 40), os.urandom(40 * 40 * 3)) \
+            .save(image, 'PNG')
+        self.image = image.getvalue()
+
+    def start(self, **data):
+        response = self.client.post(reverse('courses:upload-create'), {
+            'target': 'course', 'object_id': self.course.pk,
+            'filename': '../preview.png', 'size': len(self.image),
+            'sha256': hashlib.sha256(self.image).hexdigest(), **data,
+        })
+        return response
+
+    def send(self, upload_id, offset, data):
+        return self.client.patch(
+            reverse('courses:upload', args=[upload_id]), data=data,
+            content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_upload(self):
+        """Testing upload resumed from offset and attached to course"""
+        response = self.start()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        upload_id = response.json()['id']
+        self.assertEqual(response.json()['filename'], 'preview.png')
+
+        self.assertEqual(self.send(upload_id, 0, self.image[:1000])
+                         .status_code, status.HTTP_200_OK)
+        # Repeated chunk is rejected
+        self.assertEqual(self.send(upload_id, 0, self.image[:1000])
+                         .status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.send(upload_id, 1000, self.image[1000:3000])
+                         .status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Client resumes from offset of upload
+        response = self.client.get(reverse('courses:upload',
+                                           args=[upload_id]))
+        offset = int(response['Upload-Offset'])
+        self.assertEqual(offset, 1000)
+        while offset < len(self.image):
+            response = self.send(upload_id, offset,
+                                 self.image[offset:offset + 1000])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            offset = int(response['Upload-Offset'])
+        self.assertIsNotNone(response.json()['completed_at'])
+
+        self.course.refresh_from_db()
+        with self.course.preview.open('rb') as file:
+            self.assertEqual(file.read(), self.image)
+        self.assertEqual(os.listdir(os.path.join(self.uploads_root,
+                                                 upload_id)), [])
+
+    def test_retry_completion(self):
+        """Testing completion retried after failure past the last chunk"""
+        upload_id = self.start().json()['id']
+        last = (len(self.image) - 1) // 1000 * 1000
+        for offset in range(0, last, 1000):
+            self.send(upload_id, offset, self.image[offset:offset + 1000])
+        offset = last
+        with mock.patch('courses.uploads.default_storage.save',
+                        side_effect=OSError('No space left on device')):
+            with self.assertRaises(OSError):
+                self.send(upload_id, offset, self.image[offset:])
+        upload = Upload.objects.get(pk=upload_id)
+        self.assertEqual(upload.offset, len(self.image))
+        self.assertIsNone(upload.completed_at)
+
+        # Empty chunk at the end completes upload
+        response = self.send(upload_id, len(self.image), b'')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(response.json()['completed_at'])
+        self.course.refresh_from_db()
+        with self.course.preview.open('rb') as file:
+            self.assertEqual(file.read(), self.image)
+        # Repeated request changes nothing
+        response = self.send(upload_id, len(self.image), b'')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_invalid_file(self):
+        """Testing files not matching checksum or not images"""
+        upload_id = self.start(sha256='0' * 64).json()['id']
+        for offset in range(0, len(self.image), 1000):
+            response = self.send(upload_id, offset,
+                                 self.image[offset:offset + 1000])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('sha256', response.json())
+        # Upload starts again
+        self.assertEqual(Upload.objects.get(pk=upload_id).offset, 0)
+        self.course.refresh_from_db()
+        self.assertFalse(self.course.preview)
+
+        text = b'not an image'
+        upload_id = self.start(size=len(text),
+                               sha256=hashlib.sha256(text).hexdigest()) \
+            .json()['id']
+        response = self.send(upload_id, 0, text)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('filename', response.json())
+        self.assertEqual(os.listdir(self.media_root), [])
+
+    def test_permissions(self):
+        """Testing uploads to objects of other users"""
+        self.assertEqual(self.start(filename='preview.exe').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        upload_id = self.start().json()['id']
+
+        self.client.force_authenticate(self.other_user)
+        self.assertEqual(self.start().status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.send(upload_id, 0, self.image[:1000])
+                         .status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,188 @@
+"""
+Resumable chunked uploads of preview images.
+
+Client creates an upload with file size and SHA-256, then sends chunks
+with PATCH and `Upload-Offset` header. Chunks are streamed to upload
+storage (STORAGES['uploads']) under unique names and committed by moving
+the offset of the upload, so a chunk lost with connection or sent twice
+is simply sent again from the current offset. After the last chunk the
+file is assembled into the default storage while its checksum is computed,
+verified and attached to preview of the course or lesson. Completion
+interrupted after the last chunk (storage error, killed worker) is run
+again by an empty PATCH at the end of the file.
+"""
+import hashlib
+import io
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage, storages
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from courses.models import Course, Lesson, Upload
+
+TARGETS = {'course': Course, 'lesson': Lesson}
+
+
+class OffsetConflict(APIException):
+    """Chunk does not start at the current offset"""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Upload-Offset does not match offset of upload.'
+    default_code = 'offset_conflict'
+
+
+def get_storage():
+    return storages['uploads']
+
+
+def chunk_name(upload, offset):
+    # Unique, concurrent requests never overwrite chunks of each other
+    return f'{upload.pk}/{offset:016d}-{uuid.uuid4().hex[:8]}'
+
+
+class ChunksReader(io.RawIOBase):
+    """Reads chunks from storage one after another, hashing the data"""
+
+    def __init__(self, storage, names):
+        self.storage = storage
+        self.names = list(names)
+        self.current = None
+        self.digest = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            if self.current is None:
+                if not self.names:
+                    return 0
+                self.current = self.storage.open(self.names.pop(0), 'rb')
+            data = self.current.read(len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                self.digest.update(data)
+                return len(data)
+            self.current.close()
+            self.current = None
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+        super().close()
+
+
+def write_chunk(upload, offset, stream, length):
+    """
+    Writes chunk of length bytes from stream at offset.
+    Returns upload, completed if this was the last chunk or an empty
+    chunk at the end.
+    """
+    if offset != upload.offset:
+        raise OffsetConflict()
+    if length == 0 and offset == upload.size:
+        # All chunks are received, completion is retried
+        if upload.completed_at is None:
+            complete(upload)
+        return upload
+    if length <= 0 or length > settings.UPLOAD_CHUNK_SIZE or \
+            offset + length > upload.size:
+        raise ValidationError({'Content-Length': [
+            f'Chunk must have 1 to {settings.UPLOAD_CHUNK_SIZE} bytes and '
+            f'end within {upload.size} bytes of file.'
+        ]})
+
+    storage = get_storage()
+    name = storage.save(chunk_name(upload, offset), File(stream))
+    # Connection was lost during the chunk
+    if storage.size(name) != length:
+        storage.delete(name)
+        raise ValidationError({'Content-Length': [
+            'Chunk is shorter than Content-Length.'
+        ]})
+
+    with transaction.atomic():
+        upload = Upload.objects.select_for_update().get(pk=upload.pk)
+        if upload.offset != offset:
+            # The same chunk was committed by a concurrent request
+            transaction.on_commit(lambda: storage.delete(name))
+            raise OffsetConflict()
+        upload.offset += length
+        upload.chunks.append(name)
+        upload.save(update_fields=['offset', 'chunks'])
+
+    if upload.offset == upload.size:
+        complete(upload)
+    return upload
+
+
+def delete_chunks(upload):
+    """Deletes chunks, including ones of failed requests"""
+    storage = get_storage()
+    try:
+        names = storage.listdir(str(upload.pk))[1]
+    except FileNotFoundError:
+        return
+    for name in names:
+        storage.delete(f'{upload.pk}/{name}')
+
+
+def complete(upload):
+    """Assembles, verifies and attaches file of received upload"""
+    instance = TARGETS[upload.target].objects \
+        .filter(pk=upload.object_id).first()
+    if instance is None:
+        delete_chunks(upload)
+        raise ValidationError({'object_id': [
+            f'{upload.target.capitalize()} does not exist anymore.'
+        ]})
+    reader = ChunksReader(get_storage(), upload.chunks)
+    with reader:
+        name = default_storage.save(upload.filename,
+                                    File(reader, upload.filename))
+
+    error = None
+    if reader.digest.hexdigest() != upload.sha256:
+        error = {'sha256': ['Checksum of received file does not match.']}
+    else:
+        try:
+            with default_storage.open(name, 'rb') as file:
+                Image.open(file).verify()
+        # Pillow raises different errors for broken files
+        except Exception:
+            error = {'filename': ['File is not a valid image.']}
+    if error:
+        default_storage.delete(name)
+        # Client starts again
+        delete_chunks(upload)
+        upload.offset = 0
+        upload.chunks = []
+        upload.save(update_fields=['offset', 'chunks'])
+        raise ValidationError(error)
+
+    instance.preview.name = name
+    with transaction.atomic():
+        instance.save(update_fields=['preview'])
+        upload.completed_at = timezone.now()
+        upload.save(update_fields=['completed_at'])
+    delete_chunks(upload)
+
+
+def prune(expiry=None):
+    """
+    Deletes uploads older than expiry with chunks of unfinished ones.
+    Returns number of deleted uploads.
+    """
+    expiry = expiry or settings.UPLOAD_EXPIRY
+    uploads = Upload.objects.filter(created_at__lt=timezone.now() - expiry)
+    deleted = 0
+    for upload in uploads.iterator():
+        if upload.completed_at is None:
+            delete_chunks(upload)
+        deleted += upload.delete()[0]
+    return deleted
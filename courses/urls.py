@@ -5,7 +5,8 @@ from courses.apps import CoursesConfig
 from courses.views import LessonListAPIView, LessonCreateAPIView, \
     LessonRetrieveAPIView, LessonUpdateAPIView, CourseViewSet, \
     PaymentListAPIView, SubscriptionCreateAPIView, SubscriptionDestroyAPIView, \
-    LessonDestroyAPIView, PaymentCreateAPIView, PaymentRetrieveAPIView
+    LessonDestroyAPIView, PaymentCreateAPIView, PaymentRetrieveAPIView, \
+    SyncAPIView, LeaderboardAPIView, UploadCreateAPIView, UploadAPIView
 
 app_name = CoursesConfig.name
 
@@ -28,4 +29,14 @@ urlpatterns = [
     path('courses/subscribe/', SubscriptionCreateAPIView.as_view(), name='subscribe'),
     path('courses/<int:pk>/unsubscribe/', SubscriptionDestroyAPIView.as_view(), name='unsubscribe'),
 
+    # delta sync
+    path('sync/', SyncAPIView.as_view(), name='sync'),
+
+    # leaderboards
+    path('leaderboards/<str:board>/', LeaderboardAPIView.as_view(), name='leaderboard'),
+
+    # resumable uploads of previews
+    path('uploads/', UploadCreateAPIView.as_view(), name='upload-create'),
+    path('uploads/<uuid:pk>/', UploadAPIView.as_view(), name='upload'),
+
 ] + router.urls
@@ -1,23 +1,39 @@
-import datetime
-
-from django.shortcuts import render
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics, viewsets, status
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-
-from config.tasks import send_notification
-from courses.models import Lesson, Course, Payment, Subscription
+from rest_framework.views import APIView
+
+from config.db_router import ReplicaReadMixin
+from config.query_limits import QueryLimitMixin
+from courses import caching, entitlements, leaderboards, notifications, \
+    outbox, sync, uploads
+from courses.counters import recompute_counters
+from courses.models import Lesson, Course, Payment, Subscription, Upload
 from courses.paginators import DefaultPaginator
 from courses.permissions import IsModerator, IsOwner
 from courses.serializers import CourseSerializer, LessonSerializer, \
-    PaymentSerializer, SubscriptionSerializer, CourseSubSerializer, \
-    PaymentRetrieveSerializer
+    PaymentSerializer, SubscriptionSerializer, PaymentRetrieveSerializer, \
+    UploadSerializer
 from users.models import UserRoles
 
 
-class CourseViewSet(viewsets.ModelViewSet):
+def owner_cache_id(request):
+    """Owner of cached pages visible to user"""
+    if request.user.role == UserRoles.MODERATOR:
+        return caching.ALL
+    return request.user.pk
+
+
+class CourseViewSet(QueryLimitMixin, ReplicaReadMixin,
+                    viewsets.ModelViewSet):
     """
     CRUD mechanism for :model:`courses.Course` using DRF
     """
@@ -25,6 +41,9 @@ class CourseViewSet(viewsets.ModelViewSet):
     queryset = Course.objects.all()
     # Add pagination
     pagination_class = DefaultPaginator
+    # Moderators list all courses
+    statement_timeout = {'list': 5}
+    query_budget = {'list': 10, 'retrieve': 10}
 
     def get_permissions(self):
         """
@@ -48,12 +67,23 @@ class CourseViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         """Save owner field during creation"""
-        new_course = serializer.save()
-        new_course.owner = self.request.user
-        new_course.save()
+        serializer.save(owner=self.request.user)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        """Hide course at once, delete its subtree in background"""
+        instance.deleted_at = timezone.now()
+        instance.save(update_fields=['deleted_at'])
+        outbox.publish('config.tasks.purge_course', instance.pk)
 
     def list(self, request, *args, **kwargs):
         """Override LIST action"""
+        if not request.query_params:
+            # Default first page is served from cache
+            page = caching.get_course_page(owner_cache_id(request))
+            return self.paginator.get_first_page_response(
+                request, caching.absolute_urls(request, page)
+            )
         # Check if user is NOT moderator
         if self.request.user.role != UserRoles.MODERATOR:
             # Return the list of user's courses
@@ -61,17 +91,31 @@ class CourseViewSet(viewsets.ModelViewSet):
         else:
             # Return all courses
             self.queryset = Course.objects.all()
+        # Counters are stored in course, only lessons are loaded
+        self.queryset = self.queryset.prefetch_related('lessons')
         return super().list(request, *args, **kwargs)
 
     def retrieve(self, request, *args, **kwargs):
         """Override READ action"""
+        data = caching.get_cached_course(self.kwargs['pk'])
+        if data is None:
+            data = caching.get_course(self.get_object())
+        else:
+            # Owner is known from cached representation
+            self.check_object_permissions(
+                request, Course(pk=data['id'], owner_id=data['owner'])
+            )
+        data = caching.absolute_urls(request, data)
 
         # Check if user is NOT moderator
         if self.request.user.role != UserRoles.MODERATOR:
-            serializer = CourseSubSerializer(self.get_object(), context={'request': request})
-            return Response(serializer.data)
-        return super().retrieve(request, *args, **kwargs)
+            # Subscription status is added per user (see CourseSubSerializer)
+            data = {**data, 'is_subscribed': entitlements.for_request(
+                request
+            ).is_subscribed(data['id'])}
+        return Response(data)
 
+    @transaction.atomic
     def update(self, request, *args, **kwargs):
         """Override UPDATE action to notify subscribers of course"""
 
@@ -87,16 +131,8 @@ class CourseViewSet(viewsets.ModelViewSet):
             # forcibly invalidate the prefetch cache on the instance.
             instance._prefetched_objects_cache = {}
 
-        # Get list of all subscribers
-        subscription_list = Subscription.objects.filter(course=instance)
-        # Check if at least one subscriber exists
-        if subscription_list:
-            for subscription in subscription_list:
-                # Send mail to each subscriber
-                send_notification.delay(
-                    subscription.course.name,
-                    subscription.user.email
-                )
+        # Notify subscribers once the update is committed
+        notifications.course_updated(instance.pk)
 
         return Response(serializer.data)
 
@@ -112,12 +148,10 @@ class LessonCreateAPIView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         """Save owner field during creation"""
-        new_lesson = serializer.save()
-        new_lesson.owner = self.request.user
-        new_lesson.save()
+        serializer.save(owner=self.request.user)
 
 
-class LessonListAPIView(generics.ListAPIView):
+class LessonListAPIView(ReplicaReadMixin, generics.ListAPIView):
     """
     List DRF generic for :model:`courses.Lesson`
     """
@@ -126,6 +160,15 @@ class LessonListAPIView(generics.ListAPIView):
     # Add pagination
     pagination_class = DefaultPaginator
 
+    def list(self, request, *args, **kwargs):
+        if not request.query_params:
+            # Default first page is served from cache
+            page = caching.get_lesson_page(owner_cache_id(request))
+            return self.paginator.get_first_page_response(
+                request, caching.absolute_urls(request, page)
+            )
+        return super().list(request, *args, **kwargs)
+
     def get_queryset(self):
         """Method that return queryset for controller"""
         # Check if user is NOT moderator
@@ -159,29 +202,23 @@ class LessonUpdateAPIView(generics.UpdateAPIView):
     # Only Owner or Moderator can edit this lesson
     permission_classes = [IsModerator | IsOwner]
 
+    @transaction.atomic
     def perform_update(self, serializer):
         updated_lesson = serializer.save()
-        updated_lesson.save()
-        # Get course
-        course = Course.objects.get(pk=updated_lesson.course_id)
-        # Record previous update time
-        prev_update_time = course.updated_at if course.updated_at else 0
-        # Add new update time (UTC)
-        course.updated_at = datetime.datetime.now()
-        course.save()
-        # Send notification if last update was more than 4 hours ago
-        # Moscow - UTC time
-        if course.updated_at - prev_update_time.replace(tzinfo=None) > datetime.timedelta(hours=7):
-            # Get list of all subscribers
-            subscription_list = Subscription.objects.filter(course=course)
-            # Check if at least one subscriber exists
-            if subscription_list:
-                for subscription in subscription_list:
-                    # Send mail to each subscriber
-                    send_notification.delay(
-                        subscription.course.name,
-                        subscription.user.email
-                    )
+        now = timezone.now()
+        # Record update time of course in a single statement,
+        # without loading the course
+        Course.objects.filter(pk=updated_lesson.course_id).update(
+            updated_at=now
+        )
+        # Send notification once per interval: further updates within
+        # the interval have the same event key and are ignored by outbox
+        interval = settings.COURSE_NOTIFICATION_INTERVAL.total_seconds()
+        notifications.course_updated(
+            updated_lesson.course_id,
+            event_key=f'course-updated:{updated_lesson.course_id}:'
+                      f'{int(now.timestamp() // interval)}'
+        )
 
 
 class LessonDestroyAPIView(generics.DestroyAPIView):
@@ -193,19 +230,40 @@ class LessonDestroyAPIView(generics.DestroyAPIView):
     # Only Owner can delete this lesson
     permission_classes = [IsOwner]
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        """Hide lesson at once, delete its payments in background"""
+        instance.deleted_at = timezone.now()
+        instance.save(update_fields=['deleted_at'])
+        # Hidden lesson is not counted
+        recompute_counters(Course.objects.filter(pk=instance.course_id))
+        outbox.publish('config.tasks.purge_lesson', instance.pk)
 
-class PaymentListAPIView(generics.ListAPIView):
+
+class PaymentListAPIView(QueryLimitMixin, ReplicaReadMixin,
+                         generics.ListAPIView):
     """
     List DRF generic for :model:`courses.Payment`
     """
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
+    # Filters without date range scan all partitions
+    statement_timeout = 3
+    query_budget = 5
     # Adding filter modules
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     # Define ordering settings
     ordering_fields = ('date_paid',)
     # Define filtering settings
-    filterset_fields = ('course', 'lesson', 'type',)
+    # Date range limits scanned partitions of payments
+    filterset_fields = {
+        'course': ['exact'],
+        'lesson': ['exact'],
+        'type': ['exact'],
+        'date_paid': ['gte', 'lt'],
+    }
+    # Rate limits (see DEFAULT_THROTTLE_RATES)
+    throttle_scope = 'payment_list'
 
 
 class PaymentCreateAPIView(generics.CreateAPIView):
@@ -213,13 +271,16 @@ class PaymentCreateAPIView(generics.CreateAPIView):
     Create DRF generic for :model:`courses.Payment`
     """
     serializer_class = PaymentSerializer
+    # Every payment is a STRIPE API call (see DEFAULT_THROTTLE_RATES)
+    throttle_scope = 'payment_create'
 
     def perform_create(self, serializer):
         """Save user and course field during creation"""
-        new_payment = serializer.save()
-        new_payment.user = self.request.user
-        new_payment.course = Course.objects.get(pk=self.kwargs.get('pk'))
-        new_payment.save()
+        # Course is known on creation, so its revenue counter is updated
+        serializer.save(
+            user=self.request.user,
+            course=get_object_or_404(Course, pk=self.kwargs.get('pk'))
+        )
 
 
 class PaymentRetrieveAPIView(generics.RetrieveAPIView):
@@ -229,10 +290,16 @@ class PaymentRetrieveAPIView(generics.RetrieveAPIView):
     serializer_class = PaymentSerializer
 
     def get_object(self):
-        obj = Payment.objects.get(
-            user=self.request.user,
-            course=Course.objects.get(pk=self.kwargs.get('pk'))
-        )
+        course_id = self.kwargs.get('pk')
+        # Users without purchase of course are answered without queries
+        if not entitlements.for_request(self.request) \
+                .has_purchased(course_id):
+            raise Http404
+        # The latest payment (default ordering)
+        obj = Payment.objects.filter(user=self.request.user,
+                                     course_id=course_id).first()
+        if obj is None:
+            raise Http404
         return obj
 
 
@@ -247,9 +314,7 @@ class SubscriptionCreateAPIView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         """Save user field during creation"""
-        new_sub = serializer.save()
-        new_sub.user = self.request.user
-        new_sub.save()
+        serializer.save(user=self.request.user)
 
 
 class SubscriptionDestroyAPIView(generics.DestroyAPIView):
@@ -270,3 +335,94 @@ class SubscriptionDestroyAPIView(generics.DestroyAPIView):
         self.perform_destroy(instance)
         # Return HTTP response
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class SyncAPIView(APIView):
+    """
+    Changes of courses, lessons and subscriptions visible to user after
+    cursor (see courses.sync). Reads from primary database: replicas do
+    not know running transactions of primary.
+    """
+
+    def get(self, request):
+        changes, cursor, has_more = sync.changes_since(
+            request.user, request.query_params.get('cursor')
+        )
+        return Response({'changes': changes, 'cursor': cursor,
+                         'has_more': has_more})
+
+
+class LeaderboardAPIView(generics.GenericAPIView):
+    """
+    Courses with most subscribers or revenue over window (?window=,
+    LEADERBOARD_WINDOWS or 'all'), read page by page from Redis
+    (see courses.leaderboards)
+    """
+    pagination_class = DefaultPaginator
+
+    def get(self, request, board):
+        if board not in leaderboards.BOARDS:
+            raise NotFound()
+        window = request.query_params.get('window', 'week')
+        if window not in leaderboards.windows():
+            raise ValidationError({'window': [
+                f'Choose one of: {", ".join(leaderboards.windows())}.'
+            ]})
+
+        entries = self.paginate_queryset(
+            leaderboards.Leaderboard(board, window)
+        )
+        courses = Course.objects.in_bulk([course for course, _ in entries])
+        # Deleted meanwhile, removal is repeated in case it was lost
+        leaderboards.remove(set(dict(entries)) - set(courses))
+        entries = [(course_id, score) for course_id, score in entries
+                   if course_id in courses]
+        first_rank = self.paginator.page.start_index()
+        results = [{
+            'rank': first_rank + index,
+            'course': {'id': course_id, 'name': courses[course_id].name},
+            'score': int(score),
+        } for index, (course_id, score) in enumerate(entries)]
+        return self.get_paginated_response(results)
+
+
+class UploadCreateAPIView(generics.CreateAPIView):
+    """
+    Starts resumable upload of preview of course or lesson
+    (see courses.uploads)
+    """
+    serializer_class = UploadSerializer
+
+    def perform_create(self, serializer):
+        """Save owner field during creation"""
+        serializer.save(owner=self.request.user)
+
+
+class UploadAPIView(generics.RetrieveAPIView):
+    """
+    State of upload (GET) and its chunks (PATCH with Upload-Offset header,
+    raw bytes in body)
+    """
+    serializer_class = UploadSerializer
+    queryset = Upload.objects.all()
+    # Only Owner continues upload
+    permission_classes = [IsOwner]
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        response['Upload-Offset'] = response.data['offset']
+        return response
+
+    def patch(self, request, *args, **kwargs):
+        upload = self.get_object()
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            raise ValidationError({'Upload-Offset': ['Offset is required.']})
+        # Body is streamed to storage, not parsed
+        upload = uploads.write_chunk(
+            upload, offset, request.stream,
+            int(request.META.get('CONTENT_LENGTH') or 0)
+        )
+        return Response(self.get_serializer(upload).data,
+                        headers={'Upload-Offset': str(upload.offset)})
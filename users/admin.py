@@ -1,3 +1,28 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
-# Register your models here.
+from courses.admin import LargeTableAdmin
+from users.models import User
+
+
+@admin.register(User)
+class UserAdmin(LargeTableAdmin):
+    list_display = ('id', 'email', 'role', 'is_active', 'last_login')
+    # Filters by choices, without queries for options
+    list_filter = ('role', 'is_active')
+    search_fields = ('email',)
+    # Unique index, autocomplete lists users in this order
+    ordering = ('email',)
+    readonly_fields = ('password', 'last_login', 'date_joined')
+    actions = ('activate', 'deactivate')
+
+    @admin.action(description='Activate selected users')
+    def activate(self, request, queryset):
+        updated = queryset.update(is_active=True)
+        self.message_user(request, f'{updated} users are activated.',
+                          messages.SUCCESS)
+
+    @admin.action(description='Deactivate selected users')
+    def deactivate(self, request, queryset):
+        updated = queryset.update(is_active=False)
+        self.message_user(request, f'{updated} users are deactivated.',
+                          messages.SUCCESS)
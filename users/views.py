@@ -3,11 +3,12 @@ from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from config.db_router import ReplicaReadMixin
 from users.models import User
 from users.serializers import UserSerializer, UserLimitedSerializer
 
 
-class UserViewSet(viewsets.ViewSet):
+class UserViewSet(ReplicaReadMixin, viewsets.ViewSet):
     """
     CRUD mechanism for :model:`users.User` using DRF
     """